@@ -1,10 +1,87 @@
 """
 应用程序配置模块
 """
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
-from app.core.constants import API_VERSION, DEFAULT_CREATE_IMAGE_MODEL, DEFAULT_FILTER_MODELS, DEFAULT_MODEL, DEFAULT_STREAM_CHUNK_SIZE, DEFAULT_STREAM_LONG_TEXT_THRESHOLD, DEFAULT_STREAM_MAX_DELAY, DEFAULT_STREAM_MIN_DELAY, DEFAULT_STREAM_SHORT_TEXT_THRESHOLD
+from app.core.constants import (
+    API_VERSION,
+    DEFAULT_ADMISSION_DEFAULT_RPM,
+    DEFAULT_ADMISSION_ENABLED,
+    DEFAULT_ADMISSION_MAX_CONCURRENCY,
+    DEFAULT_ADMISSION_MAX_QUEUE,
+    DEFAULT_ADMISSION_QUEUE_TIMEOUT,
+    DEFAULT_ADMISSION_TENANT_CONCURRENCY,
+    DEFAULT_CONTEXT_CACHE_ENABLED,
+    DEFAULT_CONTEXT_CACHE_MAX_PER_KEY,
+    DEFAULT_CONTEXT_CACHE_MIN_REPEATS,
+    DEFAULT_CONTEXT_CACHE_MIN_TOKENS,
+    DEFAULT_CONTEXT_CACHE_TTL,
+    DEFAULT_CREATE_IMAGE_MODEL,
+    DEFAULT_EMBEDDING_BATCH_SIZE,
+    DEFAULT_EMBEDDING_CACHE_DIR,
+    DEFAULT_EMBEDDING_CACHE_DISK_MAX_BYTES,
+    DEFAULT_EMBEDDING_CACHE_ENABLED,
+    DEFAULT_EMBEDDING_CACHE_MEMORY_BYTES,
+    DEFAULT_EMBEDDING_CONCURRENCY,
+    DEFAULT_EMBEDDING_MAX_RETRIES,
+    DEFAULT_FILTER_MODELS,
+    DEFAULT_HEDGE_ENABLED,
+    DEFAULT_HEDGE_MAX_RATIO,
+    DEFAULT_HEDGE_MIN_DELAY,
+    DEFAULT_HEDGE_MIN_SAMPLES,
+    DEFAULT_HEDGE_PERCENTILE,
+    DEFAULT_HTTP2_ENABLED,
+    DEFAULT_HTTP_CONNECT_TIMEOUT,
+    DEFAULT_HTTP_KEEPALIVE_EXPIRY,
+    DEFAULT_HTTP_MAX_CONNECTIONS,
+    DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    DEFAULT_IMAGE_CACHE_MAX_BYTES,
+    DEFAULT_IMAGE_FETCH_CONCURRENCY,
+    DEFAULT_IMAGE_FETCH_MAX_BYTES,
+    DEFAULT_IMAGE_FETCH_TIMEOUT,
+    DEFAULT_IMAGE_GEN_MAX_CONCURRENCY,
+    DEFAULT_IMAGE_GEN_MAX_QUEUE,
+    DEFAULT_IMAGE_GEN_PER_KEY_CONCURRENCY,
+    DEFAULT_IMAGE_GEN_QUEUE_TIMEOUT,
+    DEFAULT_JSON_CODEC,
+    DEFAULT_KEY_COOLDOWN_BASE,
+    DEFAULT_KEY_COOLDOWN_MAX,
+    DEFAULT_KEY_EWMA_ALPHA,
+    DEFAULT_KEY_RECOVERY_CONCURRENCY,
+    DEFAULT_KEY_RECOVERY_ENABLED,
+    DEFAULT_KEY_RECOVERY_INTERVAL,
+    DEFAULT_KEY_RPM_LIMIT,
+    DEFAULT_KEY_STATE_BACKEND,
+    DEFAULT_KEY_STATE_FLUSH_INTERVAL,
+    DEFAULT_KEY_STATE_REDIS_URL,
+    DEFAULT_KEY_STATE_SQLITE_PATH,
+    DEFAULT_KEY_TPM_LIMIT,
+    DEFAULT_LOG_FORMAT,
+    DEFAULT_LOG_LEVEL,
+    DEFAULT_LOG_PAYLOAD_MAX_CHARS,
+    DEFAULT_LOG_PAYLOAD_SAMPLE_RATE,
+    DEFAULT_LOG_QUEUE_SIZE,
+    DEFAULT_MODEL,
+    DEFAULT_MODEL_CATALOG_TTL,
+    DEFAULT_RATE_LIMIT_COOLDOWN,
+    DEFAULT_RESPONSE_CACHE_ENABLED,
+    DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+    DEFAULT_RESPONSE_CACHE_TTL,
+    DEFAULT_STREAM_CHUNK_SIZE,
+    DEFAULT_STREAM_COALESCE_MAX_SIZE,
+    DEFAULT_STREAM_COALESCE_WINDOW,
+    DEFAULT_STREAM_LONG_TEXT_THRESHOLD,
+    DEFAULT_STREAM_MAX_DELAY,
+    DEFAULT_STREAM_MAX_RETRIES,
+    DEFAULT_STREAM_MIN_DELAY,
+    DEFAULT_STREAM_MODE,
+    DEFAULT_STREAM_RETRY_POLICY,
+    DEFAULT_STREAM_SHORT_TEXT_THRESHOLD,
+    DEFAULT_TOKENS_FILE,
+    DEFAULT_TOKENS_RELOAD_INTERVAL,
+    DEFAULT_UPLOAD_CONCURRENCY,
+)
 
 
 class Settings(BaseSettings):
@@ -14,13 +91,98 @@ class Settings(BaseSettings):
     ALLOWED_TOKENS: List[str]
     BASE_URL: str = f"https://generativelanguage.googleapis.com/{API_VERSION}"
     AUTH_TOKEN: str = ""
+    TOKENS_FILE: str = DEFAULT_TOKENS_FILE
+    TOKENS_RELOAD_INTERVAL: float = DEFAULT_TOKENS_RELOAD_INTERVAL
+    
+    # 准入控制配置
+    ADMISSION_ENABLED: bool = DEFAULT_ADMISSION_ENABLED
+    ADMISSION_MAX_CONCURRENCY: int = DEFAULT_ADMISSION_MAX_CONCURRENCY
+    ADMISSION_TENANT_CONCURRENCY: int = DEFAULT_ADMISSION_TENANT_CONCURRENCY
+    ADMISSION_DEFAULT_RPM: int = DEFAULT_ADMISSION_DEFAULT_RPM
+    ADMISSION_MAX_QUEUE: int = DEFAULT_ADMISSION_MAX_QUEUE
+    ADMISSION_QUEUE_TIMEOUT: float = DEFAULT_ADMISSION_QUEUE_TIMEOUT
     MAX_FAILURES: int = 3
     TEST_MODEL: str = DEFAULT_MODEL
     
+    # 密钥调度配置
+    KEY_EWMA_ALPHA: float = DEFAULT_KEY_EWMA_ALPHA
+    KEY_COOLDOWN_BASE: float = DEFAULT_KEY_COOLDOWN_BASE
+    KEY_COOLDOWN_MAX: float = DEFAULT_KEY_COOLDOWN_MAX
+    
+    # 密钥限流配置
+    KEY_RPM_LIMIT: int = DEFAULT_KEY_RPM_LIMIT
+    KEY_TPM_LIMIT: int = DEFAULT_KEY_TPM_LIMIT
+    MODEL_RATE_LIMITS: Dict[str, Dict[str, int]] = {}
+    RATE_LIMIT_COOLDOWN: float = DEFAULT_RATE_LIMIT_COOLDOWN
+    
+    # 密钥自动恢复配置
+    KEY_RECOVERY_ENABLED: bool = DEFAULT_KEY_RECOVERY_ENABLED
+    KEY_RECOVERY_INTERVAL: float = DEFAULT_KEY_RECOVERY_INTERVAL
+    KEY_RECOVERY_CONCURRENCY: int = DEFAULT_KEY_RECOVERY_CONCURRENCY
+    
+    # 密钥状态共享配置
+    KEY_STATE_BACKEND: str = DEFAULT_KEY_STATE_BACKEND
+    KEY_STATE_SQLITE_PATH: str = DEFAULT_KEY_STATE_SQLITE_PATH
+    KEY_STATE_REDIS_URL: str = DEFAULT_KEY_STATE_REDIS_URL
+    KEY_STATE_FLUSH_INTERVAL: float = DEFAULT_KEY_STATE_FLUSH_INTERVAL
+    
+    # 对冲请求配置
+    HEDGE_ENABLED: bool = DEFAULT_HEDGE_ENABLED
+    HEDGE_PERCENTILE: float = DEFAULT_HEDGE_PERCENTILE
+    HEDGE_MIN_DELAY: float = DEFAULT_HEDGE_MIN_DELAY
+    HEDGE_MAX_RATIO: float = DEFAULT_HEDGE_MAX_RATIO
+    HEDGE_MIN_SAMPLES: int = DEFAULT_HEDGE_MIN_SAMPLES
+    
+    # 响应缓存配置
+    RESPONSE_CACHE_ENABLED: bool = DEFAULT_RESPONSE_CACHE_ENABLED
+    RESPONSE_CACHE_TTL: float = DEFAULT_RESPONSE_CACHE_TTL
+    RESPONSE_CACHE_MAX_BYTES: int = DEFAULT_RESPONSE_CACHE_MAX_BYTES
+    
+    # 上下文缓存配置
+    CONTEXT_CACHE_ENABLED: bool = DEFAULT_CONTEXT_CACHE_ENABLED
+    CONTEXT_CACHE_MIN_TOKENS: int = DEFAULT_CONTEXT_CACHE_MIN_TOKENS
+    CONTEXT_CACHE_MIN_REPEATS: int = DEFAULT_CONTEXT_CACHE_MIN_REPEATS
+    CONTEXT_CACHE_TTL: int = DEFAULT_CONTEXT_CACHE_TTL
+    CONTEXT_CACHE_MAX_PER_KEY: int = DEFAULT_CONTEXT_CACHE_MAX_PER_KEY
+    
+    # 嵌入请求配置
+    EMBEDDING_BATCH_SIZE: int = DEFAULT_EMBEDDING_BATCH_SIZE
+    EMBEDDING_CONCURRENCY: int = DEFAULT_EMBEDDING_CONCURRENCY
+    EMBEDDING_MAX_RETRIES: int = DEFAULT_EMBEDDING_MAX_RETRIES
+    EMBEDDING_CACHE_ENABLED: bool = DEFAULT_EMBEDDING_CACHE_ENABLED
+    EMBEDDING_CACHE_MEMORY_BYTES: int = DEFAULT_EMBEDDING_CACHE_MEMORY_BYTES
+    EMBEDDING_CACHE_DIR: str = DEFAULT_EMBEDDING_CACHE_DIR
+    EMBEDDING_CACHE_DISK_MAX_BYTES: int = DEFAULT_EMBEDDING_CACHE_DISK_MAX_BYTES
+    
+    # 上游HTTP连接池配置
+    HTTP2_ENABLED: bool = DEFAULT_HTTP2_ENABLED
+    HTTP_MAX_CONNECTIONS: int = DEFAULT_HTTP_MAX_CONNECTIONS
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS
+    HTTP_KEEPALIVE_EXPIRY: float = DEFAULT_HTTP_KEEPALIVE_EXPIRY
+    HTTP_CONNECT_TIMEOUT: float = DEFAULT_HTTP_CONNECT_TIMEOUT
+    
+    # 消息图片下载配置
+    IMAGE_FETCH_TIMEOUT: float = DEFAULT_IMAGE_FETCH_TIMEOUT
+    IMAGE_FETCH_MAX_BYTES: int = DEFAULT_IMAGE_FETCH_MAX_BYTES
+    IMAGE_FETCH_CONCURRENCY: int = DEFAULT_IMAGE_FETCH_CONCURRENCY
+    IMAGE_CACHE_MAX_BYTES: int = DEFAULT_IMAGE_CACHE_MAX_BYTES
+    
+    # JSON编解码配置
+    JSON_CODEC: str = DEFAULT_JSON_CODEC
+    
+    # 日志配置
+    LOG_LEVEL: str = DEFAULT_LOG_LEVEL
+    LOG_LEVELS: Dict[str, str] = {}
+    LOG_FORMAT: str = DEFAULT_LOG_FORMAT
+    LOG_QUEUE_SIZE: int = DEFAULT_LOG_QUEUE_SIZE
+    LOG_PAYLOAD_MAX_CHARS: int = DEFAULT_LOG_PAYLOAD_MAX_CHARS
+    LOG_PAYLOAD_SAMPLE_RATE: float = DEFAULT_LOG_PAYLOAD_SAMPLE_RATE
+    
     # 模型相关配置
     SEARCH_MODELS: List[str] = ["gemini-2.0-flash-exp"]
     IMAGE_MODELS: List[str] = ["gemini-2.0-flash-exp"]
     FILTERED_MODELS: List[str] = DEFAULT_FILTER_MODELS
+    MODEL_CATALOG_TTL: float = DEFAULT_MODEL_CATALOG_TTL
     TOOLS_CODE_EXECUTION_ENABLED: bool = False
     SHOW_SEARCH_LINK: bool = True
     SHOW_THINKING_PROCESS: bool = True
@@ -29,18 +191,30 @@ class Settings(BaseSettings):
     PAID_KEY: List[str] = []
     CREATE_IMAGE_MODEL: str = DEFAULT_CREATE_IMAGE_MODEL
     UPLOAD_PROVIDER: str = "smms"
+    UPLOAD_CONCURRENCY: int = DEFAULT_UPLOAD_CONCURRENCY
+    IMAGE_GEN_MAX_CONCURRENCY: int = DEFAULT_IMAGE_GEN_MAX_CONCURRENCY
+    IMAGE_GEN_PER_KEY_CONCURRENCY: int = DEFAULT_IMAGE_GEN_PER_KEY_CONCURRENCY
+    IMAGE_GEN_MAX_QUEUE: int = DEFAULT_IMAGE_GEN_MAX_QUEUE
+    IMAGE_GEN_QUEUE_TIMEOUT: float = DEFAULT_IMAGE_GEN_QUEUE_TIMEOUT
     SMMS_SECRET_TOKEN: str = ""
     PICGO_API_KEY: str = ""
     CLOUDFLARE_IMGBED_URL: str = ""
     CLOUDFLARE_IMGBED_AUTH_CODE: str = ""
     
     # 流式输出优化器配置
+    STREAM_MODE: str = DEFAULT_STREAM_MODE
+    STREAM_COALESCE_WINDOW: float = DEFAULT_STREAM_COALESCE_WINDOW
+    STREAM_COALESCE_MAX_SIZE: int = DEFAULT_STREAM_COALESCE_MAX_SIZE
     STREAM_MIN_DELAY: float = DEFAULT_STREAM_MIN_DELAY
     STREAM_MAX_DELAY: float = DEFAULT_STREAM_MAX_DELAY
     STREAM_SHORT_TEXT_THRESHOLD: int = DEFAULT_STREAM_SHORT_TEXT_THRESHOLD
     STREAM_LONG_TEXT_THRESHOLD: int = DEFAULT_STREAM_LONG_TEXT_THRESHOLD
     STREAM_CHUNK_SIZE: int = DEFAULT_STREAM_CHUNK_SIZE
     
+    # 流式重试配置
+    STREAM_RETRY_POLICY: str = DEFAULT_STREAM_RETRY_POLICY
+    STREAM_MAX_RETRIES: int = DEFAULT_STREAM_MAX_RETRIES
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # 设置默认AUTH_TOKEN（如果未提供）
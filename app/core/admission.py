@@ -0,0 +1,203 @@
+"""
+准入控制模块
+
+按客户端令牌（租户）限制请求：每个令牌的 RPM 令牌桶、每个租户的并发上限，以及全局并发上限。
+全局并发已满时请求进入各自租户的队列，按权重做加权公平排队（加权赤字轮转，DRR），
+避免单个批处理客户端占满密钥池而饿死交互式用户。被拒绝的请求返回 429 与 Retry-After。
+每次准入与放行的开销均为 O(1)（均摊）。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+from app.config.config import settings
+from app.core.token_store import TokenInfo
+from app.exception.exceptions import RateLimitExceededError
+from app.log.logger import get_security_logger
+
+logger = get_security_logger()
+
+# 权重下限，避免权重过小时轮转次数过多
+_MIN_WEIGHT = 0.01
+
+
+class _Tenant:
+    """租户的并发计数、等待队列与轮转赤字"""
+
+    __slots__ = ("name", "weight", "concurrency", "active", "waiters", "deficit", "scheduled", "rejected")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.weight = 1.0
+        self.concurrency = 0
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.deficit = 0.0
+        self.scheduled = False
+        self.rejected = 0
+
+    def has_capacity(self) -> bool:
+        return not self.concurrency or self.active < self.concurrency
+
+
+class AdmissionController:
+    """按租户的准入控制与加权公平排队
+
+    Args:
+        max_concurrency: 全局同时处理的请求数，达到后新请求排队，0 表示不限制
+        max_queue: 全局最多排队的请求数，超出时直接拒绝
+        queue_timeout: 单个请求最长排队时间（秒），超时后拒绝
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max(0, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self._tenants: Dict[str, _Tenant] = {}
+        # 有等待者的租户，按轮转顺序排列
+        self._ring: Deque[_Tenant] = deque()
+        self._service_time = 0.0
+
+    def _tenant(self, info: TokenInfo) -> _Tenant:
+        tenant = self._tenants.get(info.name)
+        if tenant is None:
+            tenant = self._tenants[info.name] = _Tenant(info.name)
+        # 令牌文件重新加载后使用最新的权重与并发上限
+        tenant.weight = max(info.weight, _MIN_WEIGHT)
+        tenant.concurrency = info.concurrency
+        return tenant
+
+    def _has_capacity(self) -> bool:
+        return not self.max_concurrency or self.active < self.max_concurrency
+
+    def _grant(self, tenant: _Tenant) -> None:
+        self.active += 1
+        tenant.active += 1
+
+    def _release(self, tenant: _Tenant) -> None:
+        self.active -= 1
+        tenant.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按加权赤字轮转放行等待者；达到自身并发上限的租户不阻塞其他租户"""
+        blocked = 0
+        while self._has_capacity() and blocked < len(self._ring):
+            tenant = self._ring[0]
+            while tenant.waiters and tenant.waiters[0].done():
+                tenant.waiters.popleft()
+            if not tenant.waiters:
+                self._ring.popleft()
+                tenant.scheduled = False
+                tenant.deficit = 0.0
+                continue
+            if not tenant.has_capacity():
+                self._ring.rotate(-1)
+                blocked += 1
+                continue
+            blocked = 0
+            if tenant.deficit < 1.0:
+                tenant.deficit += tenant.weight
+                if tenant.deficit < 1.0:
+                    self._ring.rotate(-1)
+                    continue
+            tenant.deficit -= 1.0
+            future = tenant.waiters.popleft()
+            self.queued -= 1
+            self._grant(tenant)
+            future.set_result(None)
+            if tenant.deficit < 1.0:
+                self._ring.rotate(-1)
+
+    def retry_after(self, tenant: _Tenant) -> int:
+        """按平均处理耗时与排在该租户前面的请求数估算的重试等待秒数"""
+        service_time = self._service_time or 1.0
+        ahead = len(tenant.waiters) + 1
+        share = tenant.concurrency or self.max_concurrency or 1
+        return max(1, math.ceil(service_time * ahead / share))
+
+    def _reject(self, tenant: _Tenant, reason: str, retry_after: float) -> RateLimitExceededError:
+        self.rejected += 1
+        tenant.rejected += 1
+        logger.warning(f"Request from {tenant.name} rejected: {reason}, retry after {retry_after:.1f}s")
+        return RateLimitExceededError(f"Too many requests ({reason})", retry_after=retry_after)
+
+    async def _acquire(self, tenant: _Tenant) -> None:
+        # 全局未满时仍在排队的租户都被自身上限挡住，不影响其他租户直接运行
+        if self._has_capacity() and tenant.has_capacity() and not tenant.waiters:
+            self._grant(tenant)
+            return
+        if self.queued >= self.max_queue:
+            raise self._reject(tenant, "queue is full", self.retry_after(tenant))
+        future = asyncio.get_running_loop().create_future()
+        tenant.waiters.append(future)
+        self.queued += 1
+        if not tenant.scheduled:
+            tenant.scheduled = True
+            self._ring.append(tenant)
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 已被放行但调用方随即超时或断开，归还名额
+                self._release(tenant)
+            else:
+                tenant.waiters.remove(future)
+                self.queued -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(
+                    tenant, f"queued for more than {self.queue_timeout}s", self.retry_after(tenant)
+                ) from None
+            raise
+
+    def _record_service_time(self, elapsed: float) -> None:
+        if self._service_time:
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+        else:
+            self._service_time = elapsed
+
+    @asynccontextmanager
+    async def admit(self, info: TokenInfo) -> AsyncIterator[None]:
+        """为令牌的一次请求获取准入名额，超出 RPM 或排队失败时抛出 RateLimitExceededError"""
+        tenant = self._tenant(info)
+        wait = info.acquire()
+        if wait > 0:
+            raise self._reject(tenant, "rpm limit reached", wait)
+        await self._acquire(tenant)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_service_time(time.monotonic() - start)
+            self._release(tenant)
+
+    def stats(self) -> Dict[str, object]:
+        """全局与各租户的并发、排队与拒绝统计"""
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "tenants": {
+                name: {
+                    "active": tenant.active,
+                    "queued": len(tenant.waiters),
+                    "rejected": tenant.rejected,
+                    "weight": tenant.weight,
+                }
+                for name, tenant in self._tenants.items()
+            },
+        }
+
+
+# 默认的准入控制器实例，所有生成类请求共享
+admission_controller = AdmissionController(
+    max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+)
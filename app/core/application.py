@@ -10,7 +10,10 @@ from app.log.logger import get_application_logger
 from app.middleware.middleware import setup_middlewares
 from app.exception.exceptions import setup_exception_handlers
 from app.router.routes import setup_routers
+from app.service.client.http_client import close_http_client, init_http_client
 from app.service.key.key_manager import get_key_manager_instance
+from app.service.key.key_recovery import start_key_recovery, stop_key_recovery
+from app.utils.json_codec import FastJSONResponse
 from app.core.initialization import initialize_app
 
 logger = get_application_logger()
@@ -27,16 +30,26 @@ async def lifespan(app: FastAPI):
     logger.info("Application starting up...")
     try:
         # 初始化KeyManager
-        await get_key_manager_instance(settings.API_KEYS)
+        key_manager = await get_key_manager_instance(settings.API_KEYS)
         logger.info("KeyManager initialized successfully")
+        # 加载共享的密钥状态并启动后台同步
+        await key_manager.start_state_sync()
+        # 初始化共享的上游连接池
+        await init_http_client()
+        logger.info("Shared HTTP client initialized successfully")
+        # 启动密钥自动恢复任务
+        await start_key_recovery(key_manager)
     except Exception as e:
-        logger.error(f"Failed to initialize KeyManager: {str(e)}")
+        logger.error(f"Failed to initialize application: {str(e)}")
         raise
     
     yield  # 应用程序运行期间
     
     # 关闭事件
     logger.info("Application shutting down...")
+    await stop_key_recovery()
+    await key_manager.stop_state_sync()
+    await close_http_client()
 
 def create_app() -> FastAPI:
     """
@@ -53,7 +66,8 @@ def create_app() -> FastAPI:
         title="Gemini Balance API",
         description="Gemini API代理服务，支持负载均衡和密钥管理",
         version="1.0.0",
-        lifespan=lifespan
+        lifespan=lifespan,
+        default_response_class=FastJSONResponse
     )
     
     # 配置静态文件
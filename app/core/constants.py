@@ -6,6 +6,31 @@
 API_VERSION = "v1beta"
 DEFAULT_TIMEOUT = 300  # 秒
 
+# 上游HTTP连接池相关常量
+DEFAULT_HTTP2_ENABLED = True
+DEFAULT_HTTP_MAX_CONNECTIONS = 200
+DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
+DEFAULT_HTTP_KEEPALIVE_EXPIRY = 60.0  # 秒
+DEFAULT_HTTP_CONNECT_TIMEOUT = 10.0  # 秒
+
+# 密钥调度相关常量
+DEFAULT_KEY_EWMA_ALPHA = 0.3  # 成功率与延迟EWMA的平滑系数
+DEFAULT_KEY_COOLDOWN_BASE = 1.0  # 秒，首次失败后的冷却时长，之后按连续失败次数翻倍
+DEFAULT_KEY_COOLDOWN_MAX = 60.0  # 秒
+# 密钥限流相关常量，0 表示不限制
+DEFAULT_KEY_RPM_LIMIT = 0
+DEFAULT_KEY_TPM_LIMIT = 0
+DEFAULT_RATE_LIMIT_COOLDOWN = 60.0  # 秒，上游返回 429 但未给出重试时间时的冷却时长
+# 密钥自动恢复相关常量
+DEFAULT_KEY_RECOVERY_ENABLED = True
+DEFAULT_KEY_RECOVERY_INTERVAL = 300.0  # 秒，每轮衰减一次失败次数并探测被禁用的密钥
+DEFAULT_KEY_RECOVERY_CONCURRENCY = 5
+# 密钥状态共享相关常量，可选 memory / sqlite / redis
+DEFAULT_KEY_STATE_BACKEND = "memory"
+DEFAULT_KEY_STATE_SQLITE_PATH = "data/key_state.db"
+DEFAULT_KEY_STATE_REDIS_URL = "redis://localhost:6379/0"
+DEFAULT_KEY_STATE_FLUSH_INTERVAL = 1.0  # 秒，批量写入并拉取共享状态的间隔
+
 # 模型相关常量
 SUPPORTED_ROLES = ["user", "model", "system"]
 DEFAULT_MODEL = "gemini-1.5-flash"
@@ -13,6 +38,7 @@ DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = 8192
 DEFAULT_TOP_P = 0.9
 DEFAULT_TOP_K = 40
+DEFAULT_MODEL_CATALOG_TTL = 300.0  # 秒，模型列表缓存的新鲜期，过期后后台刷新
 DEFAULT_FILTER_MODELS = [
         "gemini-1.0-pro-vision-latest", 
         "gemini-pro-vision", 
@@ -21,6 +47,11 @@ DEFAULT_FILTER_MODELS = [
         "embedding-gecko-001"
     ]
 DEFAULT_CREATE_IMAGE_MODEL = "imagen-3.0-generate-002"
+DEFAULT_UPLOAD_CONCURRENCY = 4  # 同一响应中并发上传到图床的图片数
+DEFAULT_IMAGE_GEN_MAX_CONCURRENCY = 4  # 全局同时进行的图片生成数
+DEFAULT_IMAGE_GEN_PER_KEY_CONCURRENCY = 2  # 每个付费密钥同时进行的图片生成数
+DEFAULT_IMAGE_GEN_MAX_QUEUE = 16  # 最多排队等待的图片生成请求数
+DEFAULT_IMAGE_GEN_QUEUE_TIMEOUT = 30.0  # 图片生成请求最长排队时间（秒）
 
 # 图像生成相关常量
 VALID_IMAGE_RATIOS = ["1:1", "3:4", "4:3", "9:16", "16:9"]
@@ -35,7 +66,74 @@ DEFAULT_STREAM_MAX_DELAY = 0.024
 DEFAULT_STREAM_SHORT_TEXT_THRESHOLD = 10
 DEFAULT_STREAM_LONG_TEXT_THRESHOLD = 50
 DEFAULT_STREAM_CHUNK_SIZE = 5
+# 流式输出模式: drip(逐字符延迟输出), passthrough(直接转发上游块), coalesce(按时间窗口合并写出)
+STREAM_MODES = ["drip", "passthrough", "coalesce"]
+DEFAULT_STREAM_MODE = "passthrough"
+STREAM_MODE_HEADER = "X-Stream-Mode"
+DEFAULT_STREAM_COALESCE_WINDOW = 0.05  # 秒
+DEFAULT_STREAM_COALESCE_MAX_SIZE = 8192  # 字符
+# 流式重试策略：已向客户端发送内容后上游中断时续写（resume）或发送错误事件结束（error）
+STREAM_RETRY_POLICIES = ["resume", "error"]
+DEFAULT_STREAM_RETRY_POLICY = "resume"
+DEFAULT_STREAM_MAX_RETRIES = 3
+# 对冲请求相关常量
+DEFAULT_HEDGE_ENABLED = False
+DEFAULT_HEDGE_PERCENTILE = 95.0  # 主请求超过该模型近期延迟的此分位数仍未返回时发出对冲请求
+DEFAULT_HEDGE_MIN_DELAY = 1.0  # 秒，对冲前的最短等待时间
+DEFAULT_HEDGE_MAX_RATIO = 0.05  # 对冲请求数占总请求数的上限
+DEFAULT_HEDGE_MIN_SAMPLES = 20  # 模型积累到该样本数后才开始对冲
+
+# 响应缓存相关常量
+DEFAULT_RESPONSE_CACHE_ENABLED = False
+DEFAULT_RESPONSE_CACHE_TTL = 300.0  # 秒，缓存条目的有效期
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 缓存容量（字节）
+
+# 上下文缓存相关常量
+DEFAULT_CONTEXT_CACHE_ENABLED = False
+DEFAULT_CONTEXT_CACHE_MIN_TOKENS = 32768  # 前缀估算 token 数达到该值才创建 cachedContents
+DEFAULT_CONTEXT_CACHE_MIN_REPEATS = 2  # 前缀出现该次数后才创建缓存
+DEFAULT_CONTEXT_CACHE_TTL = 600  # 秒，cachedContents 的有效期，使用中的缓存会自动延长
+DEFAULT_CONTEXT_CACHE_MAX_PER_KEY = 8  # 每个密钥最多保留的缓存数，超出时删除最久未使用的缓存
+
+# 嵌入请求配置
+DEFAULT_EMBEDDING_BATCH_SIZE = 100  # 单次上游嵌入请求的最大输入条数
+DEFAULT_EMBEDDING_CONCURRENCY = 4  # 同一请求中并发发送的批次数
+DEFAULT_EMBEDDING_MAX_RETRIES = 3  # 每个批次的最大尝试次数
+DEFAULT_EMBEDDING_CACHE_ENABLED = True
+DEFAULT_EMBEDDING_CACHE_MEMORY_BYTES = 64 * 1024 * 1024  # 内存层容量（字节）
+DEFAULT_EMBEDDING_CACHE_DIR = ""  # 磁盘层目录，为空时不持久化
+DEFAULT_EMBEDDING_CACHE_DISK_MAX_BYTES = 1024 * 1024 * 1024  # 磁盘层最大字节数
+
+# 客户端令牌相关常量
+DEFAULT_TOKENS_FILE = ""  # 令牌文件路径，为空时只使用 ALLOWED_TOKENS
+DEFAULT_TOKENS_RELOAD_INTERVAL = 5.0  # 秒，检查令牌文件是否变化的最小间隔
+
+# 准入控制相关常量
+DEFAULT_ADMISSION_ENABLED = True
+DEFAULT_ADMISSION_MAX_CONCURRENCY = 0  # 全局同时处理的生成类请求数，达到后按租户公平排队，0 表示不限制
+DEFAULT_ADMISSION_TENANT_CONCURRENCY = 0  # 每个租户（同名令牌）的并发上限，0 表示不限制
+DEFAULT_ADMISSION_DEFAULT_RPM = 0  # 每个令牌的每分钟请求数上限，0 表示不限制
+DEFAULT_ADMISSION_MAX_QUEUE = 256  # 最多排队的请求数
+DEFAULT_ADMISSION_QUEUE_TIMEOUT = 30.0  # 秒，单个请求的最长排队时间
+
+# 日志相关常量
+LOG_FORMATS = ["text", "json"]
+DEFAULT_LOG_LEVEL = "info"
+DEFAULT_LOG_FORMAT = "text"
+DEFAULT_LOG_QUEUE_SIZE = 10000  # 待写出日志的队列容量，队列满时丢弃新日志而不阻塞请求
+DEFAULT_LOG_PAYLOAD_MAX_CHARS = 2048  # 记录请求体时的最大字符数，0 表示不限制
+DEFAULT_LOG_PAYLOAD_SAMPLE_RATE = 1.0  # 记录请求体的采样率（仅在 DEBUG 级别启用时生效）
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# JSON编解码后端: auto(优先 orjson，其次 msgspec，最后标准库) / orjson / msgspec / json
+DEFAULT_JSON_CODEC = "auto"
 
 # 正则表达式模式
 IMAGE_URL_PATTERN = r'!\[(.*?)\]\((.*?)\)'
 DATA_URL_PATTERN = r'data:([^;]+);base64,(.+)'
+
+# 消息中图片下载相关常量
+DEFAULT_IMAGE_FETCH_TIMEOUT = 10.0  # 秒，单张图片下载的总超时时间
+DEFAULT_IMAGE_FETCH_MAX_BYTES = 20 * 1024 * 1024  # 单张图片的最大字节数
+DEFAULT_IMAGE_FETCH_CONCURRENCY = 8  # 同一请求中并发下载的图片数
+DEFAULT_IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # URL -> base64 缓存的容量
@@ -0,0 +1,242 @@
+"""
+指标模块
+
+轻量的进程内指标注册表，以 Prometheus 文本格式导出计数器、直方图与抓取时计算的仪表。
+请求路径上的开销只有一次 perf_counter 与一次字典查找，不依赖 prometheus_client。
+"""
+import asyncio
+import hashlib
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# 默认直方图分桶（秒），覆盖微秒级的本地阶段到分钟级的上游调用
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# 抓取时计算的仪表: (名称, 帮助信息, [(标签字典, 值)])
+GaugeSample = Tuple[str, str, List[Tuple[Dict[str, str], float]]]
+
+
+# 模型目录中列出的模型名（含变体）；模型名来自客户端输入，未列出的模型在指标中统一记为 "other"，
+# 避免客户端通过变换模型名制造无限多的时间序列
+_known_models: FrozenSet[str] = frozenset()
+
+
+def set_known_models(models: Iterable[str]) -> None:
+    """更新可作为指标标签的模型名，由模型目录在每次刷新后调用"""
+    global _known_models
+    _known_models = frozenset(models)
+
+
+def model_label(model: Optional[str]) -> str:
+    """模型名对应的指标标签: 已知模型为去掉 models/ 前缀的模型名，未知模型为 other"""
+    if not model:
+        return ""
+    model = model[len("models/"):] if model.startswith("models/") else model
+    return model if model in _known_models else "other"
+
+
+@lru_cache(maxsize=4096)
+def key_hash(api_key: str) -> str:
+    """密钥的短哈希，用作指标标签，避免在指标中暴露密钥"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """按固定分桶统计分布的直方图"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各分桶计数..., 总和, 总数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._values.get(labels)
+        return int(series[-1]) if series else 0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            inf = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, inf)} {int(series[-1])}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {int(series[-1])}"
+
+
+class MetricsRegistry:
+    """指标注册表，collector 在每次抓取时返回当前的仪表值"""
+
+    def __init__(self):
+        self._metrics: List[object] = []
+        self._collectors: List[Callable[[], Iterable[GaugeSample]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[GaugeSample]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self, *extra: Iterable[GaugeSample]) -> str:
+        """渲染全部指标，extra 为本次抓取额外附加的仪表"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        gauges = [collector() for collector in self._collectors]
+        for group in gauges + list(extra):
+            for name, documentation, samples in group:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "gemini_balance_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+HTTP_DURATION = registry.histogram(
+    "gemini_balance_http_request_duration_seconds", "HTTP request duration including streaming", ("method", "route")
+)
+STAGE_DURATION = registry.histogram(
+    "gemini_balance_stage_duration_seconds", "Time spent in each request processing stage", ("stage", "model")
+)
+UPSTREAM_REQUESTS = registry.counter(
+    "gemini_balance_upstream_requests_total", "Upstream calls by model, key hash and outcome", ("model", "key", "status")
+)
+UPSTREAM_LATENCY = registry.histogram(
+    "gemini_balance_upstream_latency_seconds",
+    "Upstream time to first byte (streaming) or response (non-streaming)",
+    ("model", "key"),
+)
+
+
+@contextmanager
+def stage_timer(stage: str, model: str = "") -> Iterator[None]:
+    """统计代码块耗时: with stage_timer("convert", model): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage, model_label(model))
+
+
+def timed_stage(stage: str) -> Callable:
+    """统计函数耗时的装饰器，支持同步与异步函数"""
+
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    STAGE_DURATION.observe(time.perf_counter() - start, stage, "")
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STAGE_DURATION.observe(time.perf_counter() - start, stage, "")
+
+        return wrapper
+
+    return decorator
+
+
+def record_upstream(model: str, api_key: str, status: str, latency: Optional[float] = None) -> None:
+    """记录一次上游调用的结果与延迟"""
+    hashed = key_hash(api_key)
+    model = model_label(model)
+    UPSTREAM_REQUESTS.inc(model, hashed, status)
+    if latency is not None:
+        UPSTREAM_LATENCY.observe(latency, model, hashed)
+        STAGE_DURATION.observe(latency, "upstream_ttfb", model)
@@ -3,26 +3,50 @@ from typing import Optional
 from fastapi import Header, HTTPException
 
 from app.config.config import settings
+from app.core.metrics import timed_stage
+from app.core.token_store import TokenInfo, TokenStore, get_token_store
+from app.exception.exceptions import AuthorizationError, RateLimitExceededError
 from app.log.logger import get_security_logger
 
 logger = get_security_logger()
 
 
 def verify_auth_token(token: str) -> bool:
-    return token == settings.AUTH_TOKEN
+    return get_token_store().is_admin(token)
 
 
 class SecurityService:
-    def __init__(self, allowed_tokens: list, auth_token: str):
-        self.allowed_tokens = allowed_tokens
-        self.auth_token = auth_token
-
+    def __init__(self, allowed_tokens: list, auth_token: str, token_store: Optional[TokenStore] = None):
+        # TokenStore 定义了 __len__，空的共享存储也必须沿用，不能用 or 判断
+        self.token_store = token_store if token_store is not None else TokenStore(allowed_tokens, auth_token)
+        # 启用准入控制时 RPM 由准入控制中间件检查，否则在认证时检查
+        self.enforce_rpm = not settings.ADMISSION_ENABLED
+
+    def _authorize(self, token: Optional[str]) -> Optional[TokenInfo]:
+        """查找令牌，无效令牌返回 None；未启用准入控制时在这里消耗一次 RPM 配额"""
+        info = self.token_store.lookup(token)
+        if info is not None and self.enforce_rpm:
+            wait = info.acquire()
+            if wait > 0:
+                logger.warning(f"Token {info.name} exceeded its rate limit")
+                raise RateLimitExceededError(retry_after=wait)
+        return info
+
+    def check_model_access(self, token: str, model: Optional[str]) -> None:
+        """检查令牌是否允许使用该模型"""
+        info = self.token_store.lookup(token)
+        if info is not None and not info.allows_model(model):
+            logger.warning(f"Token {info.name} is not allowed to use model {model}")
+            raise AuthorizationError(f"Model {model} is not allowed for this token")
+
+    @timed_stage("auth")
     async def verify_key(self, key: str):
-        if key not in self.allowed_tokens and key != self.auth_token:
+        if self._authorize(key) is None:
             logger.error("Invalid key")
             raise HTTPException(status_code=401, detail="Invalid key")
         return key
 
+    @timed_stage("auth")
     async def verify_authorization(
         self, authorization: Optional[str] = Header(None)
     ) -> str:
@@ -37,12 +61,13 @@ class SecurityService:
             )
 
         token = authorization.replace("Bearer ", "")
-        if token not in self.allowed_tokens and token != self.auth_token:
+        if self._authorize(token) is None:
             logger.error("Invalid token")
             raise HTTPException(status_code=401, detail="Invalid token")
 
         return token
 
+    @timed_stage("auth")
     async def verify_goog_api_key(
         self, x_goog_api_key: Optional[str] = Header(None)
     ) -> str:
@@ -51,15 +76,13 @@ class SecurityService:
             logger.error("Missing x-goog-api-key header")
             raise HTTPException(status_code=401, detail="Missing x-goog-api-key header")
 
-        if (
-            x_goog_api_key not in self.allowed_tokens
-            and x_goog_api_key != self.auth_token
-        ):
+        if self._authorize(x_goog_api_key) is None:
             logger.error("Invalid x-goog-api-key")
             raise HTTPException(status_code=401, detail="Invalid x-goog-api-key")
 
         return x_goog_api_key
 
+    @timed_stage("auth")
     async def verify_auth_token(
         self, authorization: Optional[str] = Header(None)
     ) -> str:
@@ -67,18 +90,19 @@ class SecurityService:
             logger.error("Missing auth_token header")
             raise HTTPException(status_code=401, detail="Missing auth_token header")
         token = authorization.replace("Bearer ", "")
-        if token != self.auth_token:
+        if not self.token_store.is_admin(token):
             logger.error("Invalid auth_token")
             raise HTTPException(status_code=401, detail="Invalid auth_token")
 
         return token
 
+    @timed_stage("auth")
     async def verify_key_or_goog_api_key(
         self, key: Optional[str] = None , x_goog_api_key: Optional[str] = Header(None)
     ) -> str:
         """验证URL中的key或请求头中的x-goog-api-key"""
         # 如果URL中的key有效，直接返回
-        if key in self.allowed_tokens or key == self.auth_token:
+        if key and self._authorize(key) is not None:
             return key
         
         # 否则检查请求头中的x-goog-api-key
@@ -86,8 +110,8 @@ class SecurityService:
             logger.error("Invalid key and missing x-goog-api-key header")
             raise HTTPException(status_code=401, detail="Invalid key and missing x-goog-api-key header")
         
-        if x_goog_api_key not in self.allowed_tokens and x_goog_api_key != self.auth_token:
+        if self._authorize(x_goog_api_key) is None:
             logger.error("Invalid key and invalid x-goog-api-key")
             raise HTTPException(status_code=401, detail="Invalid key and invalid x-goog-api-key")
         
-        return x_goog_api_key
\ No newline at end of file
+        return x_goog_api_key
@@ -0,0 +1,215 @@
+"""
+令牌存储模块
+
+客户端令牌以 SHA-256 摘要为键存入字典，校验时先对令牌求摘要再查表，耗时与令牌数量无关；
+管理员令牌用 hmac.compare_digest 做常量时间比较。每个令牌可附带元数据（名称、每分钟请求数上限、
+允许使用的模型、并发上限与公平排队权重）。可选的令牌文件在内容变化后自动重新加载，无需重启。
+
+令牌文件为 JSON 列表，元素可以是明文令牌字符串，或如下对象（用 sha256 代替 token 可避免在文件中保存明文）:
+    {"token": "sk-xxx", "name": "team-a", "rpm": 60, "concurrency": 4, "weight": 2, "models": ["gemini-1.5-flash"]}
+    {"sha256": "<令牌的十六进制摘要>", "name": "team-b"}
+"""
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from app.config.config import settings
+from app.log.logger import get_security_logger
+from app.service.key.rate_limiter import TokenBucket
+
+logger = get_security_logger()
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class TokenInfo:
+    """令牌元数据
+
+    Args:
+        name: 令牌名称，用于日志
+        rpm: 每分钟请求数上限，0 表示不限制
+        models: 允许使用的模型，None 表示不限制
+        is_admin: 是否为管理员令牌（AUTH_TOKEN）
+        concurrency: 同名令牌（同一租户）同时处理的请求数上限，0 表示不限制
+        weight: 密钥池繁忙时公平排队的权重
+    """
+
+    __slots__ = ("name", "rpm", "models", "is_admin", "concurrency", "weight", "bucket")
+
+    def __init__(
+        self,
+        name: str = "",
+        rpm: int = 0,
+        models: Optional[Iterable[str]] = None,
+        is_admin: bool = False,
+        concurrency: int = 0,
+        weight: float = 1.0,
+    ):
+        self.name = name
+        self.rpm = rpm
+        self.models: Optional[FrozenSet[str]] = frozenset(models) if models is not None else None
+        self.is_admin = is_admin
+        self.concurrency = concurrency
+        self.weight = weight
+        self.bucket = TokenBucket(rpm) if rpm > 0 else None
+
+    def allows_model(self, model: Optional[str]) -> bool:
+        if self.models is None or not model:
+            return True
+        model = model[len("models/"):] if model.startswith("models/") else model
+        return model in self.models
+
+    def acquire(self) -> float:
+        """消耗一次请求配额，返回需要等待的秒数（0 表示放行）"""
+        if self.bucket is None:
+            return 0.0
+        now = time.monotonic()
+        wait = self.bucket.wait_time(now)
+        if wait <= 0:
+            self.bucket.consume(now)
+        return wait
+
+
+class TokenStore:
+    """按 SHA-256 摘要索引的令牌存储
+
+    Args:
+        tokens: 配置中的客户端令牌（ALLOWED_TOKENS）
+        auth_token: 管理员令牌（AUTH_TOKEN）
+        path: 令牌文件路径，为空时只使用配置中的令牌
+        reload_interval: 检查令牌文件是否变化的最小间隔（秒）
+        default_rpm: 未单独配置时每个令牌的每分钟请求数上限，0 表示不限制
+        default_concurrency: 未单独配置时每个租户的并发上限，0 表示不限制
+    """
+
+    def __init__(
+        self,
+        tokens: List[str],
+        auth_token: str,
+        path: str = "",
+        reload_interval: float = 5.0,
+        default_rpm: int = 0,
+        default_concurrency: int = 0,
+    ):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.default_rpm = default_rpm
+        self.default_concurrency = default_concurrency
+        self._admin_digest = token_digest(auth_token) if auth_token else None
+        self._admin_info = TokenInfo(name="admin", is_admin=True)
+        self._static: Dict[bytes, TokenInfo] = {
+            token_digest(token): TokenInfo(
+                name=f"token-{index}", rpm=default_rpm, concurrency=default_concurrency
+            )
+            for index, token in enumerate(tokens)
+        }
+        self._index: Dict[bytes, TokenInfo] = dict(self._static)
+        self._file_state: Optional[Tuple[int, int]] = None
+        self._next_check = 0.0
+        if path:
+            self.reload()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _parse(self, entries: list) -> Dict[bytes, TokenInfo]:
+        index: Dict[bytes, TokenInfo] = {}
+        for position, entry in enumerate(entries):
+            if isinstance(entry, str):
+                entry = {"token": entry}
+            if not isinstance(entry, dict):
+                raise ValueError(f"Invalid token entry at position {position}")
+            if entry.get("token"):
+                digest = token_digest(entry["token"])
+            elif entry.get("sha256"):
+                digest = bytes.fromhex(entry["sha256"])
+                if len(digest) != hashlib.sha256().digest_size:
+                    raise ValueError(f"Invalid sha256 digest at position {position}")
+            else:
+                raise ValueError(f"Token entry at position {position} has neither token nor sha256")
+            rpm, concurrency, weight = entry.get("rpm"), entry.get("concurrency"), entry.get("weight")
+            index[digest] = TokenInfo(
+                name=str(entry.get("name") or f"file-{position}"),
+                rpm=int(rpm) if rpm is not None else self.default_rpm,
+                models=entry.get("models"),
+                concurrency=int(concurrency) if concurrency is not None else self.default_concurrency,
+                weight=float(weight) if weight is not None else 1.0,
+            )
+        return index
+
+    def reload(self) -> bool:
+        """重新加载令牌文件，文件未变化时跳过；加载失败时保留原有令牌"""
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            logger.error(f"Token file {self.path} is not readable: {str(e)}")
+            return False
+        state = (stat.st_mtime_ns, stat.st_size)
+        if state == self._file_state:
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+            if not isinstance(entries, list):
+                raise ValueError("token file must contain a JSON list")
+            loaded = self._parse(entries)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Failed to load token file {self.path}: {str(e)}")
+            return False
+
+        index = dict(self._static)
+        index.update(loaded)
+        # 限额未变的令牌沿用原有令牌桶，避免重新加载时重置配额
+        for digest, info in index.items():
+            previous = self._index.get(digest)
+            if previous is not None and previous.rpm == info.rpm:
+                info.bucket = previous.bucket
+        self._index = index
+        self._file_state = state
+        logger.info(f"Loaded {len(loaded)} tokens from {self.path}")
+        return True
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.reload_interval
+            self.reload()
+
+    def lookup(self, token: Optional[str]) -> Optional[TokenInfo]:
+        """查找令牌，返回其元数据；无效令牌返回 None"""
+        if not token:
+            return None
+        if self.path:
+            self._maybe_reload()
+        digest = token_digest(token)
+        if self._admin_digest is not None and hmac.compare_digest(digest, self._admin_digest):
+            return self._admin_info
+        return self._index.get(digest)
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        return bool(token) and self._admin_digest is not None and hmac.compare_digest(
+            token_digest(token), self._admin_digest
+        )
+
+
+_token_store: Optional[TokenStore] = None
+
+
+def get_token_store() -> TokenStore:
+    """按配置创建共享的令牌存储"""
+    global _token_store
+    if _token_store is None:
+        _token_store = TokenStore(
+            settings.ALLOWED_TOKENS,
+            settings.AUTH_TOKEN,
+            path=settings.TOKENS_FILE,
+            reload_interval=settings.TOKENS_RELOAD_INTERVAL,
+            default_rpm=settings.ADMISSION_DEFAULT_RPM,
+            default_concurrency=settings.ADMISSION_TENANT_CONCURRENCY,
+        )
+    return _token_store
@@ -17,7 +17,7 @@ class UploadResponse:
     
     
 class ImageUploader:
-    def upload(self, file: bytes, filename: str) -> UploadResponse:
+    async def upload(self, file: bytes, filename: str) -> UploadResponse:
         raise NotImplementedError
     
     
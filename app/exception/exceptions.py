@@ -2,6 +2,9 @@
 异常处理模块，定义应用程序中使用的自定义异常和异常处理器
 """
 
+import math
+from typing import Dict, Optional
+
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
@@ -15,10 +18,17 @@ logger = get_exceptions_logger()
 class APIError(Exception):
     """API错误基类"""
 
-    def __init__(self, status_code: int, detail: str, error_code: str = None):
+    def __init__(
+        self,
+        status_code: int,
+        detail: str,
+        error_code: str = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
         self.status_code = status_code
         self.detail = detail
         self.error_code = error_code or "api_error"
+        self.headers = headers
         super().__init__(self.detail)
 
 
@@ -68,11 +78,98 @@ class APIKeyError(APIError):
 
 
 class ServiceUnavailableError(APIError):
-    """服务不可用错误"""
+    """服务不可用错误
 
-    def __init__(self, detail: str = "Service temporarily unavailable"):
+    Args:
+        detail: 错误信息
+        retry_after: 建议客户端重试前等待的秒数，通过 Retry-After 头返回
+    """
+
+    def __init__(
+        self,
+        detail: str = "Service temporarily unavailable",
+        retry_after: Optional[float] = None,
+    ):
+        headers = None
+        if retry_after is not None:
+            headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
         super().__init__(
-            status_code=503, detail=detail, error_code="service_unavailable"
+            status_code=503,
+            detail=detail,
+            error_code="service_unavailable",
+            headers=headers,
+        )
+        self.retry_after = retry_after
+
+
+class RateLimitExceededError(APIError):
+    """客户端令牌超出请求频率限制
+
+    Args:
+        detail: 错误信息
+        retry_after: 建议客户端重试前等待的秒数，通过 Retry-After 头返回
+    """
+
+    def __init__(self, detail: str = "Rate limit exceeded", retry_after: float = 1.0):
+        super().__init__(
+            status_code=429,
+            detail=detail,
+            error_code="rate_limit_exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        self.retry_after = retry_after
+
+
+class UpstreamError(APIError):
+    """上游 Gemini API 调用错误
+
+    Args:
+        status_code: 上游返回的HTTP状态码
+        detail: 上游返回的错误内容
+        retry_after: 上游建议的重试等待秒数（Retry-After 头或 RetryInfo.retryDelay）
+        reason: 上游 ErrorInfo 中的错误原因，如 API_KEY_INVALID
+        quota_id: 上游 QuotaFailure 中触发的配额标识
+        quota_model: 配额限制所针对的模型（配额按模型计算时存在）
+    """
+
+    KEY_ERROR_REASONS = ("API_KEY_INVALID", "API_KEY_EXPIRED", "API_KEY_SERVICE_BLOCKED")
+
+    def __init__(
+        self,
+        status_code: int,
+        detail: str,
+        retry_after: Optional[float] = None,
+        reason: Optional[str] = None,
+        quota_id: Optional[str] = None,
+        quota_model: Optional[str] = None,
+    ):
+        super().__init__(
+            status_code=status_code,
+            detail=f"API call failed with status code {status_code}, {detail}",
+            error_code="upstream_error",
+        )
+        self.retry_after = retry_after
+        self.reason = reason
+        self.quota_id = quota_id
+        self.quota_model = quota_model
+
+    @property
+    def is_rate_limited(self) -> bool:
+        """密钥配额暂时耗尽，冷却后可恢复"""
+        return self.status_code == 429
+
+    @property
+    def is_key_error(self) -> bool:
+        """密钥本身无效或无权限"""
+        return self.status_code in (401, 403) or self.reason in self.KEY_ERROR_REASONS
+
+    @property
+    def is_client_error(self) -> bool:
+        """请求本身有误，换密钥重试也无济于事"""
+        return (
+            400 <= self.status_code < 500
+            and self.status_code not in (408, 429)
+            and not self.is_key_error
         )
 
 
@@ -91,6 +188,7 @@ def setup_exception_handlers(app: FastAPI) -> None:
         return JSONResponse(
             status_code=exc.status_code,
             content={"error": {"code": exc.error_code, "message": exc.detail}},
+            headers=exc.headers,
         )
 
     @app.exception_handler(StarletteHTTPException)
@@ -0,0 +1,102 @@
+# app/handler/chunk_template.py
+
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from app.utils.json_codec import dumps
+
+
+class OpenAIChunkTemplate:
+    """OpenAI流式响应块模板
+
+    每个流只序列化一次不变的外层字段（id、created、model、role），
+    之后每个文本块只需转义增量文本并拼接到预先生成的前后缀中。
+    """
+
+    def __init__(self, model: str, chunk_id: Optional[str] = None, created: Optional[int] = None):
+        self.chunk_id = chunk_id or f"chatcmpl-{uuid.uuid4()}"
+        self.created = created or int(time.time())
+        self.model = model
+        envelope = dumps(
+            {
+                "id": self.chunk_id,
+                "object": "chat.completion.chunk",
+                "created": self.created,
+                "model": model,
+            }
+        )
+        # 去掉结尾的 "}"，便于在后面追加 choices 字段
+        self._head = "data: " + envelope[:-1] + ',"choices":[{"index":0,'
+        self._content_prefix = self._head + '"delta":{"content":'
+        self._content_suffix = ',"role":"assistant"},"finish_reason":null}]}\n\n'
+        self._finish_cache: Dict[str, str] = {}
+
+    def content(self, text: str) -> str:
+        """生成只包含文本增量的SSE事件"""
+        return self._content_prefix + dumps(text) + self._content_suffix
+
+    def chunk(self, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+        """生成包含任意 delta（如工具调用）的SSE事件"""
+        return (
+            self._head
+            + '"delta":'
+            + dumps(delta)
+            + ',"finish_reason":'
+            + dumps(finish_reason)
+            + "}]}\n\n"
+        )
+
+    def finish(self, finish_reason: str) -> str:
+        """生成结束事件（空 delta + finish_reason），按结束原因缓存"""
+        event = self._finish_cache.get(finish_reason)
+        if event is None:
+            event = self.chunk({}, finish_reason)
+            self._finish_cache[finish_reason] = event
+        return event
+
+
+class GeminiChunkTemplate:
+    """Gemini流式响应块模板
+
+    Gemini 的响应块没有跨块不变的外层字段（finishReason、usageMetadata 等逐块变化），
+    因此模板按上游块构建：整块只序列化一次，拆分输出时只转义并拼接文本部分。
+    """
+
+    _PLACEHOLDER = "\u0000gemini-balance-text\u0000"
+
+    def __init__(self, response: Dict[str, Any], text: str):
+        self.response = response
+        self.text = text
+        self._prefix: Optional[str] = None
+        self._suffix: Optional[str] = None
+
+    def _build(self) -> None:
+        part = self.response["candidates"][0]["content"]["parts"][0]
+        part["text"] = self._PLACEHOLDER
+        try:
+            encoded = "data: " + dumps(self.response) + "\n\n"
+        finally:
+            part["text"] = self.text
+        marker = dumps(self._PLACEHOLDER)
+        if encoded.count(marker) == 1:
+            self._prefix, _, self._suffix = encoded.partition(marker)
+        else:
+            self._prefix = self._suffix = ""
+
+    def content(self, text: str) -> str:
+        """生成文本部分替换为 text 的SSE事件"""
+        if text == self.text:
+            # 整块转发时不需要模板，直接序列化一次
+            return "data: " + dumps(self.response) + "\n\n"
+        if self._prefix is None:
+            self._build()
+        if not self._prefix:
+            # 占位符冲突时退化为逐块序列化
+            part = self.response["candidates"][0]["content"]["parts"][0]
+            part["text"] = text
+            try:
+                return "data: " + dumps(self.response) + "\n\n"
+            finally:
+                part["text"] = self.text
+        return self._prefix + dumps(text) + self._suffix
@@ -0,0 +1,164 @@
+"""
+对冲请求模块
+
+非流式请求在超过该模型近期延迟的指定分位数仍未返回时，换一个密钥再发一次请求，
+取先返回的结果并取消另一个，用少量额外请求换取尾延迟的下降。被取消的主请求以取消时已等待的
+时间计入延迟样本，使分位数不会因慢请求被对冲掉而逐渐偏低。
+对冲次数受预算限制：每个请求积累 HEDGE_MAX_RATIO 个额度，每次对冲消耗一个，
+上游整体变慢时也不会成倍放大配额消耗。
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.config.config import settings
+from app.log.logger import get_hedge_logger
+from app.service.key.key_manager import KeyManager
+from app.utils.latency import LatencyWindow
+
+T = TypeVar("T")
+logger = get_hedge_logger()
+
+
+class HedgeBudget:
+    """对冲额度：每个请求增加 ratio，每次对冲消耗 1，最多积累 burst"""
+
+    __slots__ = ("ratio", "burst", "tokens")
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+
+    def on_request(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class RequestHedger:
+    """按模型统计延迟分位数，并在主请求过慢时换密钥发出对冲请求
+
+    Args:
+        enabled: 是否启用对冲，关闭时直接执行主请求
+        percentile: 触发对冲的延迟分位数
+        min_delay: 触发对冲的最短等待时间（秒），避免对本来就很快的模型频繁对冲
+        max_ratio: 对冲请求数占总请求数的上限
+        min_samples: 模型积累到该样本数之后才开始对冲
+        window: 每个模型保留的延迟样本数
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        min_delay: float = 1.0,
+        max_ratio: float = 0.05,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.budget = HedgeBudget(max_ratio)
+        self._latencies: Dict[str, LatencyWindow] = {}
+
+    def threshold(self, model: str) -> Optional[float]:
+        """触发对冲的等待时间，样本不足时返回 None"""
+        latencies = self._latencies.get(model)
+        if latencies is None or len(latencies.samples) < self.min_samples:
+            return None
+        return max(self.min_delay, latencies.percentile(self.percentile))
+
+    def record(self, model: str, latency: float) -> None:
+        latencies = self._latencies.get(model)
+        if latencies is None:
+            latencies = self._latencies[model] = LatencyWindow(self.window)
+        latencies.add(latency)
+
+    async def _timed(self, model: str, attempt: Callable[[str], Awaitable[T]], api_key: str) -> T:
+        start = time.monotonic()
+        result = await attempt(api_key)
+        self.record(model, time.monotonic() - start)
+        return result
+
+    async def run(
+        self,
+        key_manager: KeyManager,
+        model: str,
+        api_key: str,
+        attempt: Callable[[str], Awaitable[T]],
+    ) -> T:
+        """执行 attempt(api_key)，超过阈值仍未返回时用另一个密钥对冲
+
+        两个请求都失败时抛出主请求的错误，由外层重试逻辑处理；
+        另一个请求的失败在这里直接报告给密钥管理器。
+        """
+        if not self.enabled:
+            return await attempt(api_key)
+        self.budget.on_request()
+        started = time.monotonic()
+        primary = asyncio.create_task(self._timed(model, attempt, api_key))
+        threshold = self.threshold(model)
+        if threshold is None:
+            return await primary
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=threshold)
+        except asyncio.CancelledError:
+            # 客户端断开时 asyncio.wait 不会取消主请求，需要手动取消
+            primary.cancel()
+            raise
+        if done or not self.budget.try_spend():
+            return await primary
+
+        hedge_key = await key_manager.get_next_working_key(model)
+        if hedge_key == api_key:
+            return await primary
+        logger.info(f"Model {model} exceeded {threshold:.2f}s, hedging with API key {hedge_key}")
+        hedge = asyncio.create_task(self._timed(model, attempt, hedge_key))
+        tasks = {primary: api_key, hedge: hedge_key}
+        pending = set(tasks)
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+        finally:
+            # 取消落后的请求，其在途计数由 track() 在取消时释放
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        for task, key in tasks.items():
+            if task is winner or task.cancelled() or task.exception() is None:
+                continue
+            if winner is None and task is primary:
+                # 主请求的错误交给外层重试逻辑处理
+                continue
+            await key_manager.handle_api_failure(key, error=task.exception(), model=model)
+        if winner is None:
+            raise primary.exception()
+        if winner is hedge:
+            logger.info(f"Hedged request on API key {hedge_key} won")
+            if primary.cancelled():
+                # 落后的主请求被取消，以其已等待的时间作为删失样本（真实延迟不低于该值）；
+                # 否则被对冲胜过的慢请求永远不进入样本，分位数逐渐偏低，对冲越来越早
+                self.record(model, time.monotonic() - started)
+        return winner.result()
+
+
+# 默认的对冲器实例，OpenAI 与 Gemini 接口共享按模型统计的延迟
+request_hedger = RequestHedger(
+    enabled=settings.HEDGE_ENABLED,
+    percentile=settings.HEDGE_PERCENTILE,
+    min_delay=settings.HEDGE_MIN_DELAY,
+    max_ratio=settings.HEDGE_MAX_RATIO,
+    min_samples=settings.HEDGE_MIN_SAMPLES,
+)
@@ -4,17 +4,16 @@ from abc import ABC, abstractmethod
 import json
 import re
 from typing import Any, Dict, List, Optional
-import requests
-import base64
 
 from app.core.constants import DATA_URL_PATTERN, IMAGE_URL_PATTERN, SUPPORTED_ROLES
+from app.utils.image_fetcher import image_fetcher
 
 
 class MessageConverter(ABC):
     """消息转换器基类"""
 
     @abstractmethod
-    def convert(self, messages: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    async def convert(self, messages: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
         pass
 
 def _get_mime_type_and_data(base64_string):
@@ -40,7 +39,30 @@ def _get_mime_type_and_data(base64_string):
     # 如果不是预期格式，假定它只是数据部分
     return None, base64_string
 
-def _convert_image(image_url: str) -> Dict[str, Any]:
+class _PendingImage:
+    """待下载的图片部分，所有消息转换完成后统一并发下载再替换"""
+
+    __slots__ = ("url", "camel_case", "fallback_text")
+
+    def __init__(self, url: str, camel_case: bool = False, fallback_text: Optional[str] = None):
+        self.url = url
+        # image_url 部分使用 inline_data/mime_type，文本中的 Markdown 图片使用 inlineData/mimeType
+        self.camel_case = camel_case
+        # 下载失败时回退为文本；为 None 时下载失败直接抛出异常
+        self.fallback_text = fallback_text
+
+    def resolve(self, result) -> Dict[str, Any]:
+        if isinstance(result, Exception):
+            if self.fallback_text is None:
+                raise result
+            return {"text": self.fallback_text}
+        mime_type, encoded_data = result
+        if self.camel_case:
+            return {"inlineData": {"mimeType": mime_type, "data": encoded_data}}
+        return {"inline_data": {"mime_type": mime_type, "data": encoded_data}}
+
+
+def _convert_image(image_url: str):
     if image_url.startswith("data:image"):
         mime_type, encoded_data = _get_mime_type_and_data(image_url)
         return {
@@ -49,70 +71,43 @@ def _convert_image(image_url: str) -> Dict[str, Any]:
                 "data": encoded_data
             }
         }
-    else:
-        encoded_data = _convert_image_to_base64(image_url)
-        return {
-            "inline_data": {
-                "mime_type": "image/png",
-                "data": encoded_data
-            }
-        }
+    return _PendingImage(image_url)
 
 
-def _convert_image_to_base64(url: str) -> str:
+def _process_text_with_image(text: str) -> List[Any]:
     """
-    将图片URL转换为base64编码
-    Args:
-        url: 图片URL
-    Returns:
-        str: base64编码的图片数据
-    """
-    response = requests.get(url)
-    if response.status_code == 200:
-        # 将图片内容转换为base64
-        img_data = base64.b64encode(response.content).decode('utf-8')
-        return img_data
-    else:
-        raise Exception(f"Failed to fetch image: {response.status_code}")
-
-
-def _process_text_with_image(text: str) -> List[Dict[str, Any]]:
-    """
-    处理可能包含图片URL的文本，提取图片并转换为base64
+    处理可能包含图片URL的文本，图片部分留待统一下载并转换为base64
 
     Args:
         text: 可能包含图片URL的文本
 
     Returns:
-        List[Dict[str, Any]]: 包含文本和图片的部分列表
+        List[Any]: 包含文本和待下载图片的部分列表
     """
-    parts = []
     img_url_match = re.search(IMAGE_URL_PATTERN, text)
     if img_url_match:
-        # 提取URL
-        img_url = img_url_match.group(2)
-        # 将URL对应的图片转换为base64
-        try:
-            base64_data = _convert_image_to_base64(img_url)
-            parts.append({
-                "inlineData": {
-                    "mimeType": "image/png",
-                    "data": base64_data
-                }
-            })
-        except Exception:
-            # 如果转换失败，回退到文本模式
-            parts.append({"text": text})
-    else:
-        # 没有图片URL，作为纯文本处理
-        parts.append({"text": text})
-    return parts
+        # 提取URL，下载失败时回退到文本模式
+        return [_PendingImage(img_url_match.group(2), camel_case=True, fallback_text=text)]
+    # 没有图片URL，作为纯文本处理
+    return [{"text": text}]
+
+
+async def _resolve_images(part_lists: List[List[Any]]) -> None:
+    """并发下载所有待下载的图片并原地替换为 inline data"""
+    pending = [part for parts in part_lists for part in parts if isinstance(part, _PendingImage)]
+    if not pending:
+        return
+    results = await image_fetcher.fetch_many(part.url for part in pending)
+    for parts in part_lists:
+        for i, part in enumerate(parts):
+            if isinstance(part, _PendingImage):
+                parts[i] = part.resolve(results[part.url])
 
 
 class OpenAIMessageConverter(MessageConverter):
     """OpenAI消息格式转换器"""
 
-    def convert(self, messages: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    async def convert(self, messages: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
         converted_messages = []
         system_instruction_parts = []
 
@@ -163,6 +158,11 @@ class OpenAIMessageConverter(MessageConverter):
                 else:
                     converted_messages.append({"role": role, "parts": parts})
 
+        # 整个对话中的图片并发下载，而不是逐条阻塞下载
+        await _resolve_images(
+            [message["parts"] for message in converted_messages] + [system_instruction_parts]
+        )
+
         system_instruction = (
             None
             if not system_instruction_parts
@@ -1,7 +1,6 @@
 # app/services/chat/response_handler.py
 
 import base64
-import json
 import random
 import string
 from abc import ABC, abstractmethod
@@ -9,7 +8,8 @@ from typing import Dict, Any, List, Optional
 import time
 import uuid
 from app.config.config import settings
-from app.utils.uploader import ImageUploaderFactory
+from app.utils.json_codec import dumps
+from app.utils.uploader import upload_images
 
 
 class ResponseHandler(ABC):
@@ -33,15 +33,18 @@ class GeminiResponseHandler(ResponseHandler):
         return _handle_gemini_normal_response(response, model, stream)
 
 
-def _handle_openai_stream_response(response: Dict[str, Any], model: str, finish_reason: str) -> Dict[str, Any]:
+def _extract_openai_stream_delta(response: Dict[str, Any], model: str) -> Dict[str, Any]:
     text, tool_calls = _extract_result(response, model, stream=True, gemini_format=False)
     if not text and not tool_calls:
-        delta = {}
-    else:
-        delta = {"content": text, "role": "assistant"}
-        if tool_calls:
-            delta["tool_calls"] = tool_calls
+        return {}
+    delta = {"content": text, "role": "assistant"}
+    if tool_calls:
+        delta["tool_calls"] = tool_calls
+    return delta
 
+
+def _handle_openai_stream_response(response: Dict[str, Any], model: str, finish_reason: str) -> Dict[str, Any]:
+    delta = _extract_openai_stream_delta(response, model)
     return {
         "id": f"chatcmpl-{uuid.uuid4()}",
         "object": "chat.completion.chunk",
@@ -87,6 +90,10 @@ class OpenAIResponseHandler(ResponseHandler):
         if stream:
             return _handle_openai_stream_response(response, model, finish_reason)
         return _handle_openai_normal_response(response, model, finish_reason)
+
+    def handle_stream_delta(self, response: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """只提取流式响应块的 delta，外层字段由 OpenAIChunkTemplate 统一生成"""
+        return _extract_openai_stream_delta(response, model)
     
     def handle_image_chat_response(self, image_str: str, model: str, stream=False, finish_reason="stop"):
         if stream:
@@ -194,25 +201,38 @@ def _extract_result(response: Dict[str, Any], model: str, stream: bool = False,
             text = "暂无返回"
     return text, tool_calls
 
-def _extract_image_data(part: dict) -> str:
-    image_uploader = None
-    if settings.UPLOAD_PROVIDER == "smms":
-        image_uploader = ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER,api_key=settings.SMMS_SECRET_TOKEN)
-    elif settings.UPLOAD_PROVIDER == "picgo":
-        image_uploader = ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER,api_key=settings.PICGO_API_KEY)
-    elif settings.UPLOAD_PROVIDER == "cloudflare_imgbed":
-        image_uploader = ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER,base_url=settings.CLOUDFLARE_IMGBED_URL,auth_code=settings.CLOUDFLARE_IMGBED_AUTH_CODE)
+async def upload_inline_images(response: Dict[str, Any]) -> None:
+    """并发上传响应中的所有图片，并把图床地址写回对应的 inlineData
+
+    响应处理是同步的，需要在调用 handle_response / handle_stream_delta 之前执行，
+    避免在事件循环中逐张阻塞上传。
+    """
+    candidates = response.get("candidates")
+    if not candidates:
+        return
+    parts = [
+        part
+        for part in candidates[0].get("content", {}).get("parts", [])
+        if "inlineData" in part
+    ]
+    if not parts:
+        return
     current_date = time.strftime("%Y/%m/%d")
-    filename = f"{current_date}/{uuid.uuid4().hex[:8]}.png"
-    base64_data = part["inlineData"]["data"]
-    #将base64_data转成bytes数组
-    bytes_data = base64.b64decode(base64_data)
-    upload_response = image_uploader.upload(bytes_data,filename)
-    if upload_response.success:
-        text = f"\n\n![image]({upload_response.data.url})\n\n"
-    else:
-        text = ""
-    return text
+    files = [
+        (base64.b64decode(part["inlineData"]["data"]), f"{current_date}/{uuid.uuid4().hex[:8]}.png")
+        for part in parts
+    ]
+    upload_responses = await upload_images(files)
+    for part, upload_response in zip(parts, upload_responses):
+        part["inlineData"]["url"] = upload_response.data.url if upload_response.success else ""
+
+
+def _extract_image_data(part: dict) -> str:
+    # 图片已由 upload_inline_images 上传
+    url = part["inlineData"].get("url")
+    if url:
+        return f"\n\n![image]({url})\n\n"
+    return ""
     
 def _extract_tool_calls(parts: List[Dict[str, Any]], gemini_format: bool) -> List[Dict[str, Any]]:
     """提取工具调用信息"""
@@ -236,7 +256,7 @@ def _extract_tool_calls(parts: List[Dict[str, Any]], gemini_format: bool) -> Lis
         else:
             id = f"call_{''.join(random.sample(letters, 32))}"
             name = item.get("name", "")
-            arguments = json.dumps(item.get("args", None) or {})
+            arguments = dumps(item.get("args", None) or {})
 
             tool_calls.append(
                 {
@@ -3,6 +3,12 @@
 from functools import wraps
 from typing import Callable, TypeVar
 
+from app.exception.exceptions import (
+    AuthorizationError,
+    RateLimitExceededError,
+    ServiceUnavailableError,
+    UpstreamError,
+)
 from app.log.logger import get_retry_logger
 
 T = TypeVar("T")
@@ -16,6 +22,14 @@ class RetryHandler:
         self.max_retries = max_retries
         self.key_arg = key_arg
 
+    @staticmethod
+    def _get_model(kwargs: dict):
+        """从路由参数中取出模型名，供密钥管理器按模型冷却与选择密钥"""
+        model = kwargs.get("model_name")
+        if model is None:
+            model = getattr(kwargs.get("request"), "model", None)
+        return model
+
     def __call__(self, func: Callable[..., T]) -> Callable[..., T]:
         @wraps(func)
         async def wrapper(*args, **kwargs) -> T:
@@ -29,12 +43,27 @@ class RetryHandler:
                     logger.warning(
                         f"API call failed with error: {str(e)}. Attempt {attempt + 1} of {self.max_retries}"
                     )
+                    if isinstance(e, ServiceUnavailableError):
+                        # 本地限流拒绝与密钥无关，重试只会加重排队
+                        break
+                    if isinstance(e, (AuthorizationError, RateLimitExceededError)):
+                        # 客户端令牌无权使用该模型或超出频率限制，与密钥无关
+                        break
+                    # 路由会把上游错误包装成 HTTPException，这里取回原始错误用于分类
+                    error = e if isinstance(e, UpstreamError) else e.__cause__
+                    if not isinstance(error, UpstreamError):
+                        error = e
+                    if isinstance(error, UpstreamError) and error.is_client_error:
+                        # 请求本身有误，换密钥重试没有意义
+                        break
 
                     # 从函数参数中获取 key_manager
                     key_manager = kwargs.get("key_manager")
                     if key_manager:
                         old_key = kwargs.get(self.key_arg)
-                        new_key = await key_manager.handle_api_failure(old_key)
+                        new_key = await key_manager.handle_api_failure(
+                            old_key, error=error, model=self._get_model(kwargs)
+                        )
                         kwargs[self.key_arg] = new_key
                         logger.info(f"Switched to new API key: {new_key}")
 
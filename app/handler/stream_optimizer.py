@@ -2,16 +2,21 @@
 
 import asyncio
 import math
-from typing import Any, AsyncGenerator, Callable, List
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, List, Optional
 
 from app.config.config import settings
 from app.core.constants import (
     DEFAULT_STREAM_CHUNK_SIZE,
+    DEFAULT_STREAM_COALESCE_MAX_SIZE,
+    DEFAULT_STREAM_COALESCE_WINDOW,
     DEFAULT_STREAM_LONG_TEXT_THRESHOLD,
     DEFAULT_STREAM_MAX_DELAY,
     DEFAULT_STREAM_MIN_DELAY,
+    DEFAULT_STREAM_MODE,
     DEFAULT_STREAM_SHORT_TEXT_THRESHOLD,
+    STREAM_MODES,
 )
+from app.core.metrics import STAGE_DURATION
 from app.log.logger import get_gemini_logger, get_openai_logger
 
 logger_openai = get_openai_logger()
@@ -21,7 +26,11 @@ logger_gemini = get_gemini_logger()
 class StreamOptimizer:
     """流式输出优化器
 
-    提供流式输出优化功能，包括智能延迟调整和长文本分块输出。
+    提供三种输出模式：
+    - drip: 智能延迟调整和长文本分块输出（逐字符/逐块 sleep）
+    - passthrough: 上游块到达即转发，不引入任何人为延迟
+    - coalesce: 在时间窗口内合并多个SSE事件为一次写出，上游结束时立即刷新，
+      因此总完成时间不会晚于上游
     """
 
     def __init__(
@@ -32,6 +41,9 @@ class StreamOptimizer:
         short_text_threshold: int = DEFAULT_STREAM_SHORT_TEXT_THRESHOLD,
         long_text_threshold: int = DEFAULT_STREAM_LONG_TEXT_THRESHOLD,
         chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+        mode: str = DEFAULT_STREAM_MODE,
+        coalesce_window: float = DEFAULT_STREAM_COALESCE_WINDOW,
+        coalesce_max_size: int = DEFAULT_STREAM_COALESCE_MAX_SIZE,
     ):
         """初始化流式输出优化器
 
@@ -42,6 +54,9 @@ class StreamOptimizer:
             short_text_threshold: 短文本阈值（字符数）
             long_text_threshold: 长文本阈值（字符数）
             chunk_size: 长文本分块大小（字符数）
+            mode: 默认输出模式，取值见 STREAM_MODES
+            coalesce_window: coalesce 模式下两次写出之间的最小间隔（秒）
+            coalesce_max_size: coalesce 模式下缓冲区达到该大小（字符数）时立即写出
         """
         self.logger = logger
         self.min_delay = min_delay
@@ -49,6 +64,24 @@ class StreamOptimizer:
         self.short_text_threshold = short_text_threshold
         self.long_text_threshold = long_text_threshold
         self.chunk_size = chunk_size
+        self.mode = mode if mode in STREAM_MODES else DEFAULT_STREAM_MODE
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_size = coalesce_max_size
+
+    def resolve_mode(self, mode: Optional[str] = None) -> str:
+        """解析请求指定的输出模式，无效或未指定时使用部署默认模式
+
+        参数:
+            mode: 请求指定的模式（例如来自 X-Stream-Mode 请求头）
+
+        返回:
+            实际使用的输出模式
+        """
+        if mode:
+            mode = mode.strip().lower()
+            if mode in STREAM_MODES:
+                return mode
+        return self.mode
 
     def calculate_delay(self, text_length: int) -> float:
         """根据文本长度计算延迟时间
@@ -91,6 +124,7 @@ class StreamOptimizer:
         text: str,
         create_response_chunk: Callable[[str], Any],
         format_chunk: Callable[[Any], str],
+        mode: Optional[str] = None,
     ) -> AsyncGenerator[str, None]:
         """优化流式输出
 
@@ -98,6 +132,7 @@ class StreamOptimizer:
             text: 要输出的文本
             create_response_chunk: 创建响应块的函数，接收文本，返回响应块
             format_chunk: 格式化响应块的函数，接收响应块，返回格式化后的字符串
+            mode: 请求指定的输出模式，None 表示使用默认模式
 
         返回:
             异步生成器，生成格式化后的响应块
@@ -105,27 +140,121 @@ class StreamOptimizer:
         if not text:
             return
 
+        if self.resolve_mode(mode) != "drip":
+            # passthrough/coalesce：整块转发，不做人为拆分和延迟
+            yield format_chunk(create_response_chunk(text))
+            return
+
         # 计算智能延迟时间
         delay = self.calculate_delay(len(text))
         if self.logger:
             self.logger.info(f"Text length: {len(text)}, delay: {delay:.4f}s")
 
         # 根据文本长度决定输出方式
-        if len(text) >= self.long_text_threshold:
-            # 长文本：分块输出
-            chunks = self.split_text_into_chunks(text)
-            if self.logger:
-                self.logger.info(f"Long text: splitting into {len(chunks)} chunks")
-            for chunk_text in chunks:
-                chunk_response = create_response_chunk(chunk_text)
-                yield format_chunk(chunk_response)
-                await asyncio.sleep(delay)
-        else:
-            # 短文本：逐字符输出
-            for char in text:
-                char_chunk = create_response_chunk(char)
-                yield format_chunk(char_chunk)
-                await asyncio.sleep(delay)
+        sleeps = 0
+        try:
+            if len(text) >= self.long_text_threshold:
+                # 长文本：分块输出
+                chunks = self.split_text_into_chunks(text)
+                if self.logger:
+                    self.logger.info(f"Long text: splitting into {len(chunks)} chunks")
+                for chunk_text in chunks:
+                    chunk_response = create_response_chunk(chunk_text)
+                    yield format_chunk(chunk_response)
+                    await asyncio.sleep(delay)
+                    sleeps += 1
+            else:
+                # 短文本：逐字符输出
+                for char in text:
+                    char_chunk = create_response_chunk(char)
+                    yield format_chunk(char_chunk)
+                    await asyncio.sleep(delay)
+                    sleeps += 1
+        finally:
+            # 记录人为引入的总延迟
+            STAGE_DURATION.observe(delay * sleeps, "stream_optimizer", "")
+
+    async def coalesce_stream(
+        self, stream: AsyncIterable[str], mode: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """按时间窗口合并流式输出
+
+        非 coalesce 模式下原样转发。coalesce 模式下，距上次写出已超过时间窗口的
+        事件会立即写出；窗口内到达的事件被缓冲，在窗口到期、缓冲区超过上限或
+        上游结束时一次性写出，因此不会把完成时间推迟到上游之后。
+
+        参数:
+            stream: 生成SSE字符串的异步可迭代对象
+            mode: 请求指定的输出模式，None 表示使用默认模式
+
+        返回:
+            异步生成器，生成（可能已合并的）SSE字符串
+        """
+        if self.resolve_mode(mode) != "coalesce":
+            async for item in stream:
+                yield item
+            return
+
+        loop = asyncio.get_running_loop()
+        iterator = stream.__aiter__()
+        pending = None
+        buffer: List[str] = []
+        buffered_size = 0
+        last_flush = -math.inf
+        buffered_at = 0.0
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = (
+                    max(0.0, last_flush + self.coalesce_window - loop.time())
+                    if buffer
+                    else None
+                )
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    # 窗口到期，写出缓冲区
+                    STAGE_DURATION.observe(loop.time() - buffered_at, "stream_optimizer", "")
+                    yield "".join(buffer)
+                    buffer.clear()
+                    buffered_size = 0
+                    last_flush = loop.time()
+                    continue
+
+                task, pending = pending, None
+                try:
+                    item = task.result()
+                except StopAsyncIteration:
+                    break
+
+                now = loop.time()
+                if not buffer:
+                    buffered_at = now
+                buffer.append(item)
+                buffered_size += len(item)
+                if (
+                    now - last_flush >= self.coalesce_window
+                    or buffered_size >= self.coalesce_max_size
+                ):
+                    STAGE_DURATION.observe(now - buffered_at, "stream_optimizer", "")
+                    yield "".join(buffer)
+                    buffer.clear()
+                    buffered_size = 0
+                    last_flush = now
+
+            if buffer:
+                STAGE_DURATION.observe(loop.time() - buffered_at, "stream_optimizer", "")
+                yield "".join(buffer)
+        finally:
+            if pending is not None:
+                pending.cancel()
+                try:
+                    await pending
+                except (asyncio.CancelledError, Exception):
+                    pass
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
 
 
 # 创建默认的优化器实例，可以直接导入使用
@@ -136,6 +265,9 @@ openai_optimizer = StreamOptimizer(
     short_text_threshold=settings.STREAM_SHORT_TEXT_THRESHOLD,
     long_text_threshold=settings.STREAM_LONG_TEXT_THRESHOLD,
     chunk_size=settings.STREAM_CHUNK_SIZE,
+    mode=settings.STREAM_MODE,
+    coalesce_window=settings.STREAM_COALESCE_WINDOW,
+    coalesce_max_size=settings.STREAM_COALESCE_MAX_SIZE,
 )
 
 gemini_optimizer = StreamOptimizer(
@@ -145,4 +277,7 @@ gemini_optimizer = StreamOptimizer(
     short_text_threshold=settings.STREAM_SHORT_TEXT_THRESHOLD,
     long_text_threshold=settings.STREAM_LONG_TEXT_THRESHOLD,
     chunk_size=settings.STREAM_CHUNK_SIZE,
+    mode=settings.STREAM_MODE,
+    coalesce_window=settings.STREAM_COALESCE_WINDOW,
+    coalesce_max_size=settings.STREAM_COALESCE_MAX_SIZE,
 )
@@ -0,0 +1,104 @@
+"""
+流式重试策略
+
+上游流在首个数据块之前失败时，换密钥从头重试对客户端是透明的；一旦已有内容发送给客户端，
+从头重试会让客户端收到重复内容并浪费 token。此时按 STREAM_RETRY_POLICY 处理：
+- resume: 把已发送的文本作为 model 轮的前缀追加到请求中，换密钥让模型从断点续写
+- error: 发送一个错误事件后正常结束流
+已发送函数调用、图片、代码执行等非文本内容时无法续写，总是按 error 处理。
+"""
+from typing import Any, Dict, List
+
+from app.exception.exceptions import UpstreamError
+
+FAILOVER = "failover"
+RESUME = "resume"
+ABORT = "abort"
+
+# Gemini 错误响应中 HTTP 状态码对应的 status 字段
+_GEMINI_STATUS = {
+    400: "INVALID_ARGUMENT",
+    403: "PERMISSION_DENIED",
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+
+class StreamProgress:
+    """记录已发送给客户端的上游内容"""
+
+    __slots__ = ("started", "resumable", "_texts")
+
+    def __init__(self):
+        self.started = False
+        self.resumable = True
+        self._texts: List[str] = []
+
+    def record(self, chunk: Dict[str, Any]) -> None:
+        """记录一个即将发送给客户端的上游数据块（Gemini 格式）"""
+        candidates = chunk.get("candidates")
+        if not candidates:
+            return
+        for part in candidates[0].get("content", {}).get("parts", []):
+            self.started = True
+            if part.keys() == {"text"}:
+                self._texts.append(part["text"])
+            else:
+                self.resumable = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._texts)
+
+
+def next_action(error: Exception, progress: StreamProgress, policy: str) -> str:
+    """根据错误类型与已发送的内容决定下一步：换密钥重试、续写或结束"""
+    if isinstance(error, UpstreamError) and error.is_client_error:
+        return ABORT
+    if not progress.started:
+        return FAILOVER
+    if policy == RESUME and progress.resumable and progress.text:
+        return RESUME
+    return ABORT
+
+
+def build_resume_payload(payload: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """在原请求末尾追加已生成的文本作为 model 轮前缀，原请求末尾已是 model 轮时直接拼接"""
+    contents = list(payload.get("contents", []))
+    if contents and contents[-1].get("role") == "model":
+        last = contents[-1]
+        contents[-1] = {**last, "parts": [*last.get("parts", []), {"text": text}]}
+    else:
+        contents.append({"role": "model", "parts": [{"text": text}]})
+    return {**payload, "contents": contents}
+
+
+def _error_code(error: Exception) -> int:
+    # 连接中断、超时等非上游错误按服务不可用处理
+    return error.status_code if isinstance(error, UpstreamError) else 503
+
+
+def openai_error_body(error: Exception) -> Dict[str, Any]:
+    """OpenAI 格式的流内错误事件"""
+    return {
+        "error": {
+            "message": f"Streaming failed: {str(error)}",
+            "type": "upstream_error",
+            "code": _error_code(error),
+        }
+    }
+
+
+def gemini_error_body(error: Exception) -> Dict[str, Any]:
+    """Gemini 格式的流内错误事件"""
+    code = _error_code(error)
+    return {
+        "error": {
+            "code": code,
+            "message": f"Streaming failed: {str(error)}",
+            "status": _GEMINI_STATUS.get(code, "UNKNOWN"),
+        }
+    }
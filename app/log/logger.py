@@ -1,7 +1,16 @@
+import atexit
+import json
 import logging
-import sys
-from typing import Dict, Optional
 import platform
+import queue
+import random
+import re
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from app.config.config import settings
 
 # ANSI转义序列颜色代码
 COLORS = {
@@ -33,10 +42,65 @@ class ColoredFormatter(logging.Formatter):
         return super().format(record)
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    结构化JSON日志格式化器，每条日志输出为一行JSON
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "location": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
 # 日志格式
 FORMATTER = ColoredFormatter(
-    "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s"
+    "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - [%(request_id)s] - %(message)s"
 )
+JSON_FORMATTER = JsonFormatter()
+
+# 当前请求的ID，由请求ID中间件设置
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    在调用方线程中为日志记录附加当前请求ID
+    """
+
+    def filter(self, record):
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    只把日志记录放入有界队列，格式化与写出由后台线程完成；队列满时丢弃并计数，不阻塞事件循环
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 只合并消息参数，格式化交给后台线程
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 # 日志级别映射
 LOG_LEVELS = {
@@ -53,33 +117,70 @@ class Logger:
         pass
 
     _loggers: Dict[str, logging.Logger] = {}
+    _queue_handler: Optional[NonBlockingQueueHandler] = None
+    _listener: Optional[QueueListener] = None
+
+    @staticmethod
+    def _get_queue_handler() -> NonBlockingQueueHandler:
+        """
+        获取所有logger共享的队列handler，首次调用时启动后台写出线程
+        """
+        if Logger._queue_handler is None:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(JSON_FORMATTER if settings.LOG_FORMAT == "json" else FORMATTER)
+            handler = NonBlockingQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+            handler.addFilter(RequestIdFilter())
+            Logger._listener = QueueListener(handler.queue, console_handler)
+            Logger._listener.start()
+            Logger._queue_handler = handler
+            atexit.register(Logger.shutdown)
+        return Logger._queue_handler
 
     @staticmethod
     def setup_logger(
             name: str,
-            level: str = "debug",
+            level: Optional[str] = None,
     ) -> logging.Logger:
         """
         设置并获取logger
         :param name: logger名称
-        :param level: 日志级别
+        :param level: 日志级别，未指定时依次使用 LOG_LEVELS 中该logger的级别与 LOG_LEVEL
         :return: logger实例
         """
         if name in Logger._loggers:
             return Logger._loggers[name]
 
+        level = level or settings.LOG_LEVELS.get(name) or settings.LOG_LEVEL
         logger = logging.getLogger(name)
         logger.setLevel(LOG_LEVELS.get(level.lower(), logging.INFO))
         logger.propagate = False
 
-        # 添加控制台输出
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setFormatter(FORMATTER)
-        logger.addHandler(console_handler)
+        # 通过队列输出到控制台
+        logger.addHandler(Logger._get_queue_handler())
 
         Logger._loggers[name] = logger
         return logger
 
+    @staticmethod
+    def shutdown() -> None:
+        """
+        停止后台写出线程并写出队列中剩余的日志
+        """
+        if Logger._listener is not None:
+            Logger._listener.stop()
+            Logger._listener = None
+            for logger in Logger._loggers.values():
+                logger.removeHandler(Logger._queue_handler)
+            Logger._queue_handler = None
+            Logger._loggers.clear()
+
+    @staticmethod
+    def dropped_count() -> int:
+        """
+        队列已满而被丢弃的日志条数
+        """
+        return Logger._queue_handler.dropped if Logger._queue_handler is not None else 0
+
     @staticmethod
     def get_logger(name: str) -> Optional[logging.Logger]:
         """
@@ -90,6 +191,33 @@ class Logger:
         return Logger._loggers.get(name)
 
 
+# 连续的长base64片段（如内联图片），记录请求体时只保留长度
+_BASE64_RUN = re.compile(r"[A-Za-z0-9+/=]{256,}")
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any, level: int = logging.DEBUG) -> None:
+    """
+    按采样率与大小上限记录请求/响应体，日志级别未启用或未被采样时不做序列化
+    :param logger: logger实例
+    :param label: 日志前缀，如 "Request"
+    :param payload: pydantic模型、字典或字符串
+    :param level: 日志级别
+    """
+    if not logger.isEnabledFor(level) or random.random() >= settings.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    if hasattr(payload, "model_dump_json"):
+        text = payload.model_dump_json(exclude_none=True)
+    elif isinstance(payload, str):
+        text = payload
+    else:
+        text = json.dumps(payload, ensure_ascii=False, default=str)
+    text = _BASE64_RUN.sub(lambda match: f"<{len(match.group())} chars>", text)
+    limit = settings.LOG_PAYLOAD_MAX_CHARS
+    if limit and len(text) > limit:
+        text = f"{text[:limit]}...<truncated {len(text) - limit} chars>"
+    logger.log(level, "%s: %s", label, text, stacklevel=2)
+
+
 # 预定义的loggers
 def get_openai_logger():
     return Logger.setup_logger("openai")
@@ -152,4 +280,31 @@ def get_middleware_logger():
 
 
 def get_routes_logger():
-    return Logger.setup_logger("routes")
\ No newline at end of file
+    return Logger.setup_logger("routes")
+
+def get_http_client_logger():
+    return Logger.setup_logger("http_client")
+
+
+def get_json_codec_logger():
+    return Logger.setup_logger("json_codec")
+
+
+def get_key_recovery_logger():
+    return Logger.setup_logger("key_recovery")
+
+
+def get_hedge_logger():
+    return Logger.setup_logger("hedge")
+
+
+def get_image_fetcher_logger():
+    return Logger.setup_logger("image_fetcher")
+
+
+def get_response_cache_logger():
+    return Logger.setup_logger("response_cache")
+
+
+def get_context_cache_logger():
+    return Logger.setup_logger("context_cache")
@@ -0,0 +1,84 @@
+"""
+准入控制中间件，对生成类请求按客户端令牌限流与公平排队
+"""
+from typing import Optional
+from urllib.parse import parse_qs
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.admission import AdmissionController, admission_controller
+from app.core.token_store import TokenStore, get_token_store
+from app.exception.exceptions import RateLimitExceededError
+from app.utils.json_codec import FastJSONResponse
+
+# 需要准入控制的接口（按路径后缀匹配），模型列表、统计等轻量接口不受限制
+ADMITTED_PATH_SUFFIXES = (
+    ":generateContent",
+    ":streamGenerateContent",
+    "/chat/completions",
+    "/embeddings",
+    "/images/generations",
+)
+
+
+def _client_token(scope: Scope) -> Optional[str]:
+    """按 Authorization、x-goog-api-key、URL 参数 key 的顺序取出客户端令牌"""
+    goog_api_key = None
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            authorization = value.decode("latin-1")
+            if authorization.startswith("Bearer "):
+                return authorization[len("Bearer "):]
+        elif name == b"x-goog-api-key":
+            goog_api_key = value.decode("latin-1")
+    if goog_api_key:
+        return goog_api_key
+    query_string = scope.get("query_string")
+    if query_string and b"key=" in query_string:
+        keys = parse_qs(query_string.decode("latin-1")).get("key")
+        if keys:
+            return keys[0]
+    return None
+
+
+class AdmissionMiddleware:
+    """纯 ASGI 中间件，名额在响应（包括流式响应）发送完毕后才归还
+
+    无效令牌不在这里处理，交给路由的认证依赖返回 401。
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: Optional[AdmissionController] = None,
+        token_store: Optional[TokenStore] = None,
+    ):
+        self.app = app
+        self.controller = controller or admission_controller
+        self.token_store = token_store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].endswith(ADMITTED_PATH_SUFFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        store = self.token_store if self.token_store is not None else get_token_store()
+        info = store.lookup(_client_token(scope))
+        if info is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            async with self.controller.admit(info):
+                await self.app(scope, receive, send)
+        except RateLimitExceededError as e:
+            response = FastJSONResponse(
+                status_code=e.status_code,
+                content={"error": {"code": e.error_code, "message": e.detail}},
+                headers=e.headers,
+            )
+            await response(scope, receive, send)
@@ -0,0 +1,39 @@
+"""
+指标中间件，按路由模板与状态码统计请求数与耗时
+"""
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.metrics import HTTP_DURATION, HTTP_REQUESTS
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件，耗时统计到响应体发送完毕为止，因此包含流式响应的完整时长"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 使用路由模板而不是原始路径，避免路径参数导致标签基数膨胀
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method, path, status)
+            HTTP_DURATION.observe(time.perf_counter() - start, method, path)
@@ -2,44 +2,61 @@
 中间件配置模块，负责设置和配置应用程序的中间件
 """
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 # from app.middleware.request_logging_middleware import RequestLoggingMiddleware
+from app.config.config import settings
 from app.core.constants import API_VERSION
 from app.core.security import verify_auth_token
 from app.log.logger import get_middleware_logger
+from app.middleware.admission_middleware import AdmissionMiddleware
+from app.middleware.metrics_middleware import MetricsMiddleware
+from app.middleware.request_id_middleware import RequestIdMiddleware
 
 logger = get_middleware_logger()
 
+# 无需登录即可访问的路径（精确匹配）与路径前缀
+PUBLIC_PATHS = frozenset(["/", "/auth", "/metrics"])
+PUBLIC_PATH_PREFIXES = ("/static", "/gemini", "/v1", f"/{API_VERSION}", "/health", "/hf")
 
-class AuthMiddleware(BaseHTTPMiddleware):
+
+def is_public_path(path: str) -> bool:
+    """判断路径是否允许绕过登录，前缀元组的 startswith 在一次调用中完成全部比较"""
+    return path in PUBLIC_PATHS or path.startswith(PUBLIC_PATH_PREFIXES)
+
+
+class AuthMiddleware:
     """
     认证中间件，处理未经身份验证的请求
+
+    纯 ASGI 实现，已认证的请求直接交给下游应用，不包装响应流
     """
 
-    async def dispatch(self, request: Request, call_next):
-        # 允许特定路径绕过身份验证
-        if (
-            request.url.path not in ["/", "/auth"]
-            and not request.url.path.startswith("/static")
-            and not request.url.path.startswith("/gemini")
-            and not request.url.path.startswith("/v1")
-            and not request.url.path.startswith(f"/{API_VERSION}")
-            and not request.url.path.startswith("/health")
-            and not request.url.path.startswith("/hf")
-        ):
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-            auth_token = request.cookies.get("auth_token")
-            if not auth_token or not verify_auth_token(auth_token):
-                logger.warning(f"Unauthorized access attempt to {request.url.path}")
-                return RedirectResponse(url="/")
-            logger.debug("Request authenticated successfully")
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or is_public_path(scope["path"]):
+            await self.app(scope, receive, send)
+            return
 
-        response = await call_next(request)
-        return response
+        auth_token = None
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                auth_token = cookie_parser(value.decode("latin-1")).get("auth_token")
+                break
+        if not auth_token or not verify_auth_token(auth_token):
+            logger.warning("Unauthorized access attempt to %s", scope["path"])
+            response = RedirectResponse(url="/")
+            await response(scope, receive, send)
+            return
+
+        logger.debug("Request authenticated successfully")
+        await self.app(scope, receive, send)
 
 
 def setup_middlewares(app: FastAPI) -> None:
@@ -55,6 +72,16 @@ def setup_middlewares(app: FastAPI) -> None:
     # 添加请求日志中间件（可选，默认注释掉）
     # app.add_middleware(RequestLoggingMiddleware)
 
+    # 添加准入控制中间件，按客户端令牌限流并在密钥池繁忙时公平排队
+    if settings.ADMISSION_ENABLED:
+        app.add_middleware(AdmissionMiddleware)
+
+    # 添加指标中间件，位于认证中间件之外以统计完整的请求耗时
+    app.add_middleware(MetricsMiddleware)
+
+    # 添加请求ID中间件，使中间件与路由中的日志都带有请求ID
+    app.add_middleware(RequestIdMiddleware)
+
     # 配置CORS中间件
     app.add_middleware(
         CORSMiddleware,
@@ -0,0 +1,46 @@
+"""
+请求ID中间件，为每个请求分配ID并写入日志上下文与响应头
+"""
+import re
+import uuid
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.constants import REQUEST_ID_HEADER
+from app.log.logger import request_id_var
+
+# 只接受长度有限、字符安全的客户端请求ID，避免日志注入
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_HEADER_NAME = REQUEST_ID_HEADER.lower().encode("latin-1")
+
+
+class RequestIdMiddleware:
+    """纯 ASGI 中间件，沿用客户端提供的 X-Request-ID，未提供或不合法时生成新的ID"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == _HEADER_NAME:
+                request_id = value.decode("latin-1")
+                break
+        if not request_id or not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)[REQUEST_ID_HEADER] = request_id
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
@@ -1,40 +1,66 @@
-import json
+import logging
 
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.config.config import settings
 from app.log.logger import get_request_logger
 
 logger = get_request_logger()
 
 
 # 添加中间件类
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+class RequestLoggingMiddleware:
+    """
+    纯 ASGI 请求日志中间件
+
+    在请求体流经 receive 时旁路记录，只保留前 LOG_PAYLOAD_MAX_CHARS 字节用于日志，
+    不缓冲整个请求体，也不需要重放 receive
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # 记录请求路径
-        logger.info(f"Request path: {request.url.path}")
-
-        # 获取并记录请求体
-        try:
-            body = await request.body()
-            if body:
-                body_str = body.decode()
-                # 尝试格式化JSON
-                try:
-                    formatted_body = json.loads(body_str)
-                    logger.info(
-                        f"Formatted request body:\n{json.dumps(formatted_body, indent=2, ensure_ascii=False)}"
-                    )
-                except json.JSONDecodeError:
-                    logger.info("Request body is not valid JSON.")
-        except Exception as e:
-            logger.error(f"Error reading request body: {str(e)}")
-
-        # 重置请求的接收器，以便后续处理器可以继续读取请求体
-        async def receive():
-            return {"type": "http.request", "body": body, "more_body": False}
-
-        request._receive = receive
-
-        response = await call_next(request)
-        return response
+        logger.info("Request path: %s", scope["path"])
+        if not logger.isEnabledFor(logging.INFO):
+            await self.app(scope, receive, send)
+            return
+
+        limit = settings.LOG_PAYLOAD_MAX_CHARS
+        captured = bytearray()
+        total = 0
+        logged = False
+
+        def flush() -> None:
+            nonlocal logged
+            logged = True
+            if not total:
+                return
+            text = captured.decode("utf-8", errors="replace")
+            if total > len(captured):
+                text = f"{text}...<truncated {total - len(captured)} bytes>"
+            logger.info("Request body (%d bytes): %s", total, text)
+
+        async def receive_wrapper() -> Message:
+            nonlocal total
+            message = await receive()
+            if message["type"] == "http.request" and not logged:
+                body = message.get("body", b"")
+                total += len(body)
+                # 获取并记录请求体（只保留上限以内的部分）
+                if not limit:
+                    captured.extend(body)
+                elif len(captured) < limit:
+                    captured.extend(body[: limit - len(captured)])
+                if not message.get("more_body", False):
+                    flush()
+            elif message["type"] == "http.disconnect" and not logged:
+                flush()
+            return message
+
+        await self.app(scope, receive_wrapper, send)
@@ -1,15 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
-from copy import deepcopy
 from app.config.config import settings
-from app.log.logger import get_gemini_logger
+from app.log.logger import get_gemini_logger, log_payload
 from app.core.security import SecurityService
-from app.domain.gemini_models import GeminiContent, GeminiRequest
+from app.core.token_store import get_token_store
+from app.domain.gemini_models import GeminiRequest
 from app.service.chat.gemini_chat_service import GeminiChatService
 from app.service.key.key_manager import KeyManager, get_key_manager_instance
-from app.service.model.model_service import ModelService
+from app.service.model.model_catalog import etag_response, model_catalog
 from app.handler.retry_handler import RetryHandler
-from app.core.constants import API_VERSION
+from app.core.constants import API_VERSION, STREAM_MODE_HEADER
 
 # 路由设置
 router = APIRouter(prefix=f"/gemini/{API_VERSION}")
@@ -17,8 +19,7 @@ router_v1beta = APIRouter(prefix=f"/{API_VERSION}")
 logger = get_gemini_logger()
 
 # 初始化服务
-security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN)
-model_service = ModelService(settings.SEARCH_MODELS, settings.IMAGE_MODELS)
+security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN, token_store=get_token_store())
 
 
 async def get_key_manager():
@@ -26,58 +27,27 @@ async def get_key_manager():
     return await get_key_manager_instance()
 
 
-async def get_next_working_key(key_manager: KeyManager = Depends(get_key_manager)):
-    """获取下一个可用的API密钥"""
-    return await key_manager.get_next_working_key()
+async def get_next_working_key(
+    model_name: str,
+    key_manager: KeyManager = Depends(get_key_manager),
+):
+    """获取下一个可用的API密钥，跳过在该模型上受限的密钥"""
+    return await key_manager.get_next_working_key(model_name)
 
 
 @router.get("/models")
 @router_v1beta.get("/models")
 async def list_models(
     _=Depends(security_service.verify_key_or_goog_api_key),
-    key_manager: KeyManager = Depends(get_key_manager)
+    key_manager: KeyManager = Depends(get_key_manager),
+    if_none_match: Optional[str] = Header(None),
 ):
     """获取可用的Gemini模型列表"""
     logger.info("-" * 50 + "list_gemini_models" + "-" * 50)
     logger.info("Handling Gemini models list request")
-    
-    api_key = await key_manager.get_next_working_key()
-    logger.info(f"Using API key: {api_key}")
-    
-    models_json = model_service.get_gemini_models(api_key)
-    model_mapping = {x.get("name", "").split("/", maxsplit=1)[1]: x for x in models_json["models"]}
-    
-    # 添加搜索模型
-    if model_service.search_models:
-        for name in model_service.search_models:
-            model = model_mapping.get(name)
-            if not model:
-                continue
-                
-            item = deepcopy(model)
-            item["name"] = f"models/{name}-search"
-            display_name = f'{item.get("displayName")} For Search'
-            item["displayName"] = display_name
-            item["description"] = display_name
-            
-            models_json["models"].append(item)
-    
-    # 添加图像生成模型
-    if model_service.image_models:
-        for name in model_service.image_models:
-            model = model_mapping.get(name)
-            if not model:
-                continue
-                
-            item = deepcopy(model)
-            item["name"] = f"models/{name}-image"
-            display_name = f'{item.get("displayName")} For Image'
-            item["displayName"] = display_name
-            item["description"] = display_name
-            
-            models_json["models"].append(item)
-            
-    return models_json
+
+    catalog = await model_catalog.get(key_manager)
+    return etag_response(catalog.gemini_body, catalog.gemini_etag, if_none_match)
 
 
 @router.post("/models/{model_name}:generateContent")
@@ -86,25 +56,28 @@ async def list_models(
 async def generate_content(
     model_name: str,
     request: GeminiRequest,
-    _=Depends(security_service.verify_key_or_goog_api_key),
+    token: str = Depends(security_service.verify_key_or_goog_api_key),
     api_key: str = Depends(get_next_working_key),
-    key_manager: KeyManager = Depends(get_key_manager)
+    key_manager: KeyManager = Depends(get_key_manager),
+    cache_control: Optional[str] = Header(None)
 ):
     """非流式生成内容"""
     logger.info("-" * 50 + "gemini_generate_content" + "-" * 50)
-    logger.info(f"Handling Gemini content generation request for model: {model_name}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Handling Gemini content generation request for model: %s", model_name)
+    log_payload(logger, "Request", request)
+    logger.info("Using API key: %s", api_key)
     
-    if not model_service.check_model_support(model_name):
+    if not model_catalog.check_model_support(model_name):
         raise HTTPException(status_code=400, detail=f"Model {model_name} is not supported")
+    security_service.check_model_access(token, model_name)
     
     try:
         chat_service = GeminiChatService(settings.BASE_URL, key_manager)
         response = await chat_service.generate_content(
             model=model_name,
             request=request,
-            api_key=api_key
+            api_key=api_key,
+            cache_control=cache_control
         )
         return response
     except Exception as e:
@@ -118,25 +91,30 @@ async def generate_content(
 async def stream_generate_content(
     model_name: str,
     request: GeminiRequest,
-    _=Depends(security_service.verify_key_or_goog_api_key),
+    token: str = Depends(security_service.verify_key_or_goog_api_key),
     api_key: str = Depends(get_next_working_key),
-    key_manager: KeyManager = Depends(get_key_manager)
+    key_manager: KeyManager = Depends(get_key_manager),
+    stream_mode: Optional[str] = Header(None, alias=STREAM_MODE_HEADER),
+    cache_control: Optional[str] = Header(None)
 ):
     """流式生成内容"""
     logger.info("-" * 50 + "gemini_stream_generate_content" + "-" * 50)
-    logger.info(f"Handling Gemini streaming content generation for model: {model_name}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Handling Gemini streaming content generation for model: %s", model_name)
+    log_payload(logger, "Request", request)
+    logger.info("Using API key: %s", api_key)
     
-    if not model_service.check_model_support(model_name):
+    if not model_catalog.check_model_support(model_name):
         raise HTTPException(status_code=400, detail=f"Model {model_name} is not supported")
+    security_service.check_model_access(token, model_name)
     
     try:
         chat_service = GeminiChatService(settings.BASE_URL, key_manager)
         response_stream = chat_service.stream_generate_content(
             model=model_name,
             request=request,
-            api_key=api_key
+            api_key=api_key,
+            stream_mode=stream_mode,
+            cache_control=cache_control
         )
         return StreamingResponse(response_stream, media_type="text/event-stream")
     except Exception as e:
@@ -154,21 +132,8 @@ async def verify_key(api_key: str):
         key_manager = await get_key_manager()
         chat_service = GeminiChatService(settings.BASE_URL, key_manager)
         
-        # 使用generate_content接口测试key的有效性
-        gemini_request = GeminiRequest(
-            contents=[
-                GeminiContent(
-                    role="user",
-                    parts=[{"text": "hi"}]
-                )
-            ]
-        )
-        
-        response = await chat_service.generate_content(
-            settings.TEST_MODEL,
-            gemini_request, 
-            api_key
-        )
+        # 使用最小的generate_content请求测试key的有效性
+        response = await chat_service.verify_key(api_key)
         
         if response:
             return JSONResponse({"status": "valid"})
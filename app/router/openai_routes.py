@@ -1,28 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
 from app.config.config import settings
+from app.core.constants import STREAM_MODE_HEADER
 from app.core.security import SecurityService
+from app.core.token_store import get_token_store
 from app.domain.openai_models import (
     ChatRequest,
     EmbeddingRequest,
     ImageGenerationRequest,
 )
+from app.exception.exceptions import ServiceUnavailableError
 from app.handler.retry_handler import RetryHandler
-from app.log.logger import get_openai_logger
+from app.log.logger import get_openai_logger, log_payload
 from app.service.chat.openai_chat_service import OpenAIChatService
+from app.service.embedding.embedding_cache import get_embedding_cache
 from app.service.embedding.embedding_service import EmbeddingService
 from app.service.image.image_create_service import ImageCreateService
+from app.service.image.image_limiter import image_generation_limiter
 from app.service.key.key_manager import KeyManager, get_key_manager_instance
-from app.service.model.model_service import ModelService
+from app.service.model.model_catalog import etag_response, model_catalog
 
 router = APIRouter()
 logger = get_openai_logger()
 
 # 初始化服务
-security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN)
-model_service = ModelService(settings.SEARCH_MODELS, settings.IMAGE_MODELS)
-embedding_service = EmbeddingService(settings.BASE_URL)
+security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN, token_store=get_token_store())
+embedding_service = EmbeddingService(settings.BASE_URL, cache=get_embedding_cache())
 image_create_service = ImageCreateService()
 
 
@@ -31,9 +37,15 @@ async def get_key_manager():
 
 
 async def get_next_working_key_wrapper(
+    http_request: Request,
     key_manager: KeyManager = Depends(get_key_manager),
 ):
-    return await key_manager.get_next_working_key()
+    # 请求体在进入依赖前已被解析并缓存，这里只取模型名用于按模型选择密钥
+    try:
+        model = (await http_request.json()).get("model")
+    except Exception:
+        model = None
+    return await key_manager.get_next_working_key(model)
 
 
 @router.get("/v1/models")
@@ -41,13 +53,13 @@ async def get_next_working_key_wrapper(
 async def list_models(
     _=Depends(security_service.verify_authorization),
     key_manager: KeyManager = Depends(get_key_manager),
+    if_none_match: Optional[str] = Header(None),
 ):
     logger.info("-" * 50 + "list_models" + "-" * 50)
     logger.info("Handling models list request")
-    api_key = await key_manager.get_next_working_key()
-    logger.info(f"Using API key: {api_key}")
     try:
-        return model_service.get_gemini_openai_models(api_key)
+        catalog = await model_catalog.get(key_manager)
+        return etag_response(catalog.openai_body, catalog.openai_etag, if_none_match)
     except Exception as e:
         logger.error(f"Error getting models list: {str(e)}")
         raise HTTPException(
@@ -60,9 +72,11 @@ async def list_models(
 @RetryHandler(max_retries=3, key_arg="api_key")
 async def chat_completion(
     request: ChatRequest,
-    _=Depends(security_service.verify_authorization),
+    token: str = Depends(security_service.verify_authorization),
     api_key: str = Depends(get_next_working_key_wrapper),
     key_manager: KeyManager = Depends(get_key_manager),
+    stream_mode: Optional[str] = Header(None, alias=STREAM_MODE_HEADER),
+    cache_control: Optional[str] = Header(None),
 ):
     # 生成唯一請求ID
     request_id = f"chat_{str(request.model)}_{str(id(request))}"
@@ -72,21 +86,26 @@ async def chat_completion(
         api_key = await key_manager.get_paid_key(request_id=request_id)
     chat_service = OpenAIChatService(settings.BASE_URL, key_manager)
     logger.info("-" * 50 + "chat_completion" + "-" * 50)
-    logger.info(f"Handling chat completion request for model: {request.model}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Handling chat completion request for model: %s", request.model)
+    log_payload(logger, "Request", request)
+    logger.info("Using API key: %s", api_key)
 
-    if not model_service.check_model_support(request.model):
+    if not model_catalog.check_model_support(request.model):
         raise HTTPException(
             status_code=400, detail=f"Model {request.model} is not supported"
         )
+    security_service.check_model_access(token, request.model)
 
     try:
         # 如果model是imagen3,使用paid_key
         if request.model == f"{settings.CREATE_IMAGE_MODEL}-chat":
-            response = await chat_service.create_image_chat_completion(request=request)
+            response = await chat_service.create_image_chat_completion(
+                request=request, stream_mode=stream_mode
+            )
         else:
-            response = await chat_service.create_chat_completion(request, api_key)
+            response = await chat_service.create_chat_completion(
+                request, api_key, stream_mode=stream_mode, cache_control=cache_control
+            )
         # 处理流式响应
         if request.stream:
             return StreamingResponse(response, media_type="text/event-stream")
@@ -95,6 +114,11 @@ async def chat_completion(
         if request.model == f"{settings.CREATE_IMAGE_MODEL}-chat":
             key_manager.release_paid_key(request_id)
         return response
+    except ServiceUnavailableError:
+        # 图片生成繁忙，直接返回 503 与 Retry-After
+        if request.model == f"{settings.CREATE_IMAGE_MODEL}-chat":
+            key_manager.release_paid_key(request_id)
+        raise
     except Exception as e:
         logger.error(f"Chat completion failed after retries: {str(e)}")
         # 即使發生錯誤，也釋放請求ID關聯的密鑰
@@ -116,6 +140,8 @@ async def generate_image(
         response = await image_create_service.generate_images(request)
         logger.info("Image generation request successful")
         return response
+    except ServiceUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Image generation request failed: {str(e)}")
         raise HTTPException(
@@ -127,16 +153,20 @@ async def generate_image(
 @router.post("/hf/v1/embeddings")
 async def embedding(
     request: EmbeddingRequest,
-    _=Depends(security_service.verify_authorization),
+    token: str = Depends(security_service.verify_authorization),
     key_manager: KeyManager = Depends(get_key_manager),
 ):
     logger.info("-" * 50 + "embedding" + "-" * 50)
     logger.info(f"Handling embedding request for model: {request.model}")
-    api_key = await key_manager.get_next_working_key()
-    logger.info(f"Using API key: {api_key}")
+    security_service.check_model_access(token, request.model)
+    api_key = await key_manager.get_next_working_key(request.model)
+    logger.info("Using API key: %s", api_key)
     try:
         response = await embedding_service.create_embedding(
-            input_text=request.input, model=request.model, api_key=api_key
+            input_text=request.input,
+            model=request.model,
+            api_key=api_key,
+            key_manager=key_manager,
         )
         logger.info("Embedding request successful")
         return response
@@ -145,6 +175,20 @@ async def embedding(
         raise HTTPException(status_code=500, detail="Embedding request failed") from e
 
 
+@router.get("/v1/embeddings/cache/stats")
+@router.get("/hf/v1/embeddings/cache/stats")
+async def get_embedding_cache_stats(
+    _=Depends(security_service.verify_auth_token),
+):
+    """获取嵌入缓存的命中率与占用统计"""
+    cache = embedding_service.cache
+    return {
+        "status": "success",
+        "enabled": cache is not None,
+        "data": cache.stats() if cache is not None else {},
+    }
+
+
 @router.get("/v1/keys/list")
 @router.get("/hf/v1/keys/list")
 async def get_keys_list(
@@ -163,7 +207,8 @@ async def get_keys_list(
             "data": {
                 "valid_keys": keys_status["valid_keys"],
                 "invalid_keys": keys_status["invalid_keys"],
-                "paid_keys_usage": paid_keys_usage
+                "paid_keys_usage": paid_keys_usage,
+                "key_stats": key_manager.get_key_stats(),
             },
             "total": len(keys_status["valid_keys"]) + len(keys_status["invalid_keys"]),
         }
@@ -189,7 +234,8 @@ async def get_paid_keys_usage(
         return {
             "status": "success",
             "data": {
-                "paid_keys_usage": paid_keys_usage
+                "paid_keys_usage": paid_keys_usage,
+                "image_generation": image_generation_limiter.stats(),
             },
             "total_usage": sum(paid_keys_usage.values())
         }
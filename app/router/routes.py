@@ -2,20 +2,32 @@
 路由配置模块，负责设置和配置应用程序的路由
 """
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 
-from app.core.security import verify_auth_token
+from app.config.config import settings
+from app.core.admission import admission_controller
+from app.core.metrics import key_hash, registry
+from app.core.security import SecurityService, verify_auth_token
+from app.core.token_store import get_token_store
 from app.log.logger import get_routes_logger
 from app.router import gemini_routes, openai_routes
-from app.service.key.key_manager import get_key_manager_instance
+from app.service.chat.context_cache import context_cache
+from app.service.chat.response_cache import get_response_cache
+from app.service.embedding.embedding_cache import get_embedding_cache
+from app.service.image.image_limiter import image_generation_limiter
+from app.service.key.key_manager import KeyManager, get_key_manager_instance
 
 logger = get_routes_logger()
 
 # 配置Jinja2模板
 templates = Jinja2Templates(directory="app/templates")
 
+security_service = SecurityService(settings.ALLOWED_TOKENS, settings.AUTH_TOKEN, token_store=get_token_store())
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
 
 def setup_routers(app: FastAPI) -> None:
     """
@@ -35,6 +47,9 @@ def setup_routers(app: FastAPI) -> None:
     # 添加健康检查路由
     setup_health_routes(app)
 
+    # 添加指标路由
+    setup_metrics_routes(app)
+
 
 def setup_page_routes(app: FastAPI) -> None:
     """
@@ -118,3 +133,113 @@ def setup_health_routes(app: FastAPI) -> None:
         """健康检查端点"""
         logger.info("Health check endpoint called")
         return {"status": "healthy"}
+
+
+def key_pool_gauges(key_manager: KeyManager):
+    """密钥池仪表: 各状态的密钥数，以及按密钥哈希区分的在途数、成功率与失败次数"""
+    stats = key_manager.get_key_stats()
+    disabled = set(key_manager.get_disabled_keys())
+    cooling = sum(1 for key, item in stats.items() if key not in disabled and item["cooldown_remaining"] > 0)
+    yield "gemini_balance_keys", "Number of API keys by state", [
+        ({"state": "valid"}, len(stats) - len(disabled) - cooling),
+        ({"state": "cooling"}, cooling),
+        ({"state": "disabled"}, len(disabled)),
+    ]
+    yield "gemini_balance_key_in_flight", "In-flight upstream calls per key", [
+        ({"key": key_hash(key)}, item["in_flight"]) for key, item in stats.items()
+    ]
+    yield "gemini_balance_key_success_rate", "Smoothed upstream success rate per key", [
+        ({"key": key_hash(key)}, item["success_rate"]) for key, item in stats.items()
+    ]
+    yield "gemini_balance_key_failures", "Consecutive failures per key", [
+        ({"key": key_hash(key)}, item["failures"]) for key, item in stats.items()
+    ]
+
+
+def image_limiter_gauges():
+    """图片生成限流器仪表"""
+    stats = image_generation_limiter.stats()
+    for name in ("active", "queue_depth", "rejected"):
+        yield f"gemini_balance_image_generation_{name}", f"Image generation limiter {name}", [({}, stats[name])]
+
+
+def embedding_cache_gauges():
+    """嵌入缓存仪表"""
+    cache = get_embedding_cache()
+    if cache is None:
+        return
+    stats = cache.stats()
+    yield "gemini_balance_embedding_cache_lookups", "Embedding cache lookups by result", [
+        ({"result": "memory_hit"}, stats["memory_hits"]),
+        ({"result": "disk_hit"}, stats["disk_hits"]),
+        ({"result": "miss"}, stats["misses"]),
+    ]
+    yield "gemini_balance_embedding_cache_bytes", "Embedding cache size in bytes by tier", [
+        ({"tier": "memory"}, stats["memory_bytes"]),
+        ({"tier": "disk"}, stats["disk_bytes"]),
+    ]
+
+
+def response_cache_gauges():
+    """响应缓存仪表"""
+    cache = get_response_cache()
+    if cache is None:
+        return
+    stats = cache.stats()
+    yield "gemini_balance_response_cache_requests", "Response cache lookups by result", [
+        ({"result": "hit"}, stats["hits"]),
+        ({"result": "miss"}, stats["misses"]),
+        ({"result": "coalesced"}, stats["coalesced"]),
+        ({"result": "attached"}, stats["attached"]),
+        ({"result": "bypassed"}, stats["bypassed"]),
+    ]
+    yield "gemini_balance_response_cache_bytes", "Response cache size in bytes", [({}, stats["bytes"])]
+
+
+def context_cache_gauges():
+    """上下文缓存仪表"""
+    if not context_cache.enabled:
+        return
+    stats = context_cache.stats()
+    yield "gemini_balance_context_cache_events", "Context cache events by type", [
+        ({"event": name}, stats[name]) for name in ("hits", "created", "failed", "evicted")
+    ]
+    yield "gemini_balance_context_cache_entries", "Live cachedContents across all keys", [({}, stats["entries"])]
+
+
+def admission_gauges():
+    """准入控制仪表: 全局与各租户的在途数、排队数与拒绝数"""
+    stats = admission_controller.stats()
+    tenants = stats["tenants"]
+    yield "gemini_balance_admission_active", "Admitted in-flight requests per tenant", [
+        ({"tenant": name}, item["active"]) for name, item in tenants.items()
+    ]
+    yield "gemini_balance_admission_queued", "Queued requests per tenant", [
+        ({"tenant": name}, item["queued"]) for name, item in tenants.items()
+    ]
+    yield "gemini_balance_admission_rejected", "Requests rejected with 429 per tenant", [
+        ({"tenant": name}, item["rejected"]) for name, item in tenants.items()
+    ]
+
+
+registry.register_collector(admission_gauges)
+registry.register_collector(image_limiter_gauges)
+registry.register_collector(embedding_cache_gauges)
+registry.register_collector(response_cache_gauges)
+registry.register_collector(context_cache_gauges)
+
+
+def setup_metrics_routes(app: FastAPI) -> None:
+    """
+    设置指标相关的路由
+
+    Args:
+        app: FastAPI应用程序实例
+    """
+
+    @app.get("/metrics")
+    async def metrics(_=Depends(security_service.verify_auth_token)):
+        """以 Prometheus 文本格式导出指标，只有使用 AUTH_TOKEN 才能访问"""
+        key_manager = await get_key_manager_instance()
+        body = registry.render(key_pool_gauges(key_manager))
+        return Response(content=body, media_type=PROMETHEUS_CONTENT_TYPE)
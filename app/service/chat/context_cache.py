@@ -0,0 +1,330 @@
+"""
+上下文缓存模块
+
+Agent 类客户端每一轮都会重发相同的长系统提示与工具定义。构建 payload 后按级计算稳定前缀
+（systemInstruction + tools + 前若干条 contents）的哈希；某一级前缀重复出现且估算 token 数达到
+CONTEXT_CACHE_MIN_TOKENS 时，在后台为当前密钥创建 Gemini cachedContents，之后使用该密钥的
+请求改为引用缓存、只发送其余的 contents，减少输入 token 与首字延迟。
+
+cachedContents 属于创建它的密钥（项目），因此按密钥分别管理: 每个密钥最多保留
+CONTEXT_CACHE_MAX_PER_KEY 个缓存（LRU），被淘汰的缓存在上游删除；临近过期时仍被使用的缓存
+自动延长 TTL。引用的缓存在上游已失效时丢弃该缓存并用完整 payload 重发，不会计入密钥失败。
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Awaitable, Dict, Hashable, List, Optional, Set
+
+import httpx
+
+from app.config.config import settings
+from app.exception.exceptions import UpstreamError
+from app.log.logger import get_context_cache_logger
+from app.service.client.api_client import GeminiApiClient
+from app.utils.json_codec import dumps_bytes
+
+logger = get_context_cache_logger()
+
+# 放入缓存的 payload 字段；引用缓存的请求不能再携带这些字段
+_PREFIX_FIELDS = ("systemInstruction", "tools", "toolConfig")
+# 估算 token 数时每个 token 对应的 JSON 字节数
+_BYTES_PER_TOKEN = 4
+# 距离过期不足该时间（秒）的缓存不再引用，避免请求到达上游时缓存恰好过期
+_EXPIRY_MARGIN = 30.0
+# 创建失败后同一密钥再次尝试前的等待时间（秒）
+_FAILURE_RETRY_INTERVAL = 300.0
+# 记录出现次数的前缀哈希上限
+_MAX_TRACKED_PREFIXES = 4096
+# 引用的缓存失效（已删除或不属于该密钥）时上游返回的状态码；400 多为请求本身的参数错误，
+# 重发完整请求只会再失败一次，不按缓存失效处理
+_STALE_CACHE_STATUS = (403, 404)
+
+
+class PrefixPlan:
+    """一次请求的逐级前缀哈希；第 i 级前缀包含前 i 条 contents（不含最后一条）
+
+    Args:
+        model: 模型名
+        hashes: 各级前缀的哈希
+        tokens: 各级前缀的估算 token 数
+        candidate: 重复出现且足够长的最长一级，可为其创建缓存
+    """
+
+    __slots__ = ("model", "hashes", "tokens", "candidate")
+
+    def __init__(self, model: str, hashes: List[bytes], tokens: List[int], candidate: Optional[int]):
+        self.model = model
+        self.hashes = hashes
+        self.tokens = tokens
+        self.candidate = candidate
+
+
+class CachedPrefix:
+    """某个密钥下已创建的 cachedContents，tokens 为上游统计的 token 数，只用于日志"""
+
+    __slots__ = ("name", "level", "tokens", "expires_at")
+
+    def __init__(self, name: str, level: int, tokens: int, expires_at: float):
+        self.name = name
+        self.level = level
+        self.tokens = tokens
+        self.expires_at = expires_at
+
+
+class ContextCacheManager:
+    """按密钥管理 Gemini cachedContents 的创建、引用、续期与淘汰
+
+    Args:
+        api_client: 上游客户端
+        enabled: 是否启用
+        min_tokens: 前缀估算 token 数达到该值才创建缓存
+        min_repeats: 前缀出现该次数后才创建缓存
+        ttl: 缓存有效期（秒）
+        max_per_key: 每个密钥最多保留的缓存数
+    """
+
+    def __init__(
+        self,
+        api_client: GeminiApiClient,
+        enabled: bool,
+        min_tokens: int,
+        min_repeats: int,
+        ttl: int,
+        max_per_key: int,
+    ):
+        self.api_client = api_client
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.min_repeats = max(1, min_repeats)
+        self.ttl = ttl
+        self.max_per_key = max(1, max_per_key)
+        self._entries: Dict[str, "OrderedDict[bytes, CachedPrefix]"] = {}
+        self._seen: "OrderedDict[bytes, int]" = OrderedDict()
+        self._pending: Set[Hashable] = set()
+        self._backoff: Dict[Hashable, float] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.created = 0
+        self.failed = 0
+        self.evicted = 0
+
+    def plan(self, model: str, payload: Dict[str, Any]) -> Optional[PrefixPlan]:
+        """计算各级前缀的哈希并记录出现次数；前缀不够长或未启用时返回 None"""
+        contents = payload.get("contents") or []
+        if not self.enabled or not contents or payload.get("cachedContent"):
+            return None
+        base = dumps_bytes({field: payload[field] for field in _PREFIX_FIELDS if payload.get(field)})
+        hasher = hashlib.sha256(model.encode("utf-8"))
+        hasher.update(base)
+        size = len(base)
+        hashes: List[bytes] = []
+        tokens: List[int] = []
+        for level in range(len(contents)):
+            if level:
+                content = dumps_bytes(contents[level - 1])
+                hasher.update(content)
+                size += len(content)
+            hashes.append(hasher.copy().digest())
+            tokens.append(size // _BYTES_PER_TOKEN)
+        if tokens[-1] < self.min_tokens:
+            return None
+
+        candidate = None
+        for level, digest in enumerate(hashes):
+            if tokens[level] < self.min_tokens:
+                continue
+            count = self._seen.pop(digest, 0) + 1
+            self._seen[digest] = count
+            if count >= self.min_repeats:
+                candidate = level
+        while len(self._seen) > _MAX_TRACKED_PREFIXES:
+            self._seen.popitem(last=False)
+        return PrefixPlan(model, hashes, tokens, candidate)
+
+    def apply(self, plan: PrefixPlan, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """返回发给该密钥的 payload: 有可用缓存时引用最长的缓存，需要时在后台创建更长的缓存"""
+        now = time.monotonic()
+        best: Optional[CachedPrefix] = None
+        entries = self._entries.get(api_key)
+        if entries:
+            for level in range(len(plan.hashes) - 1, -1, -1):
+                digest = plan.hashes[level]
+                entry = entries.get(digest)
+                if entry is None:
+                    continue
+                if entry.expires_at - _EXPIRY_MARGIN <= now:
+                    del entries[digest]
+                    continue
+                entries.move_to_end(digest)
+                best = entry
+                break
+
+        candidate = plan.candidate
+        # 已有缓存时，只有未缓存的部分也足够长才创建更长的缓存
+        # 两者都是估算值，不能与上游统计的 token 数相减
+        if candidate is not None and (
+            best is None or plan.tokens[candidate] - plan.tokens[best.level] >= self.min_tokens
+        ):
+            self._schedule_create(plan, candidate, payload, api_key)
+        if best is None:
+            return payload
+
+        self.hits += 1
+        if best.expires_at - now < self.ttl / 2:
+            self._schedule_extend(api_key, best)
+        request = {key: value for key, value in payload.items() if key not in _PREFIX_FIELDS}
+        request["contents"] = payload["contents"][best.level:]
+        request["cachedContent"] = best.name
+        return request
+
+    def _spawn(self, coroutine: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _schedule_create(self, plan: PrefixPlan, level: int, payload: Dict[str, Any], api_key: str) -> None:
+        digest = plan.hashes[level]
+        now = time.monotonic()
+        if (api_key, digest) in self._pending:
+            return
+        if self._backoff.get(digest, 0.0) > now or self._backoff.get((api_key, digest), 0.0) > now:
+            return
+        body: Dict[str, Any] = {field: payload[field] for field in _PREFIX_FIELDS if payload.get(field)}
+        if level:
+            body["contents"] = payload["contents"][:level]
+        body["ttl"] = f"{int(self.ttl)}s"
+        self._pending.add((api_key, digest))
+        self._spawn(self._create(api_key, plan.model, digest, level, plan.tokens[level], body))
+
+    async def _create(
+        self, api_key: str, model: str, digest: bytes, level: int, tokens: int, body: Dict[str, Any]
+    ) -> None:
+        try:
+            result = await self.api_client.create_cached_content(body, model, api_key)
+        except (UpstreamError, httpx.HTTPError) as e:
+            self.failed += 1
+            now = time.monotonic()
+            if isinstance(e, UpstreamError) and e.is_client_error:
+                # 前缀不满足缓存条件（如 token 数不足、模型不支持），所有密钥都不再尝试
+                self._backoff[digest] = now + self.ttl
+            else:
+                self._backoff[(api_key, digest)] = now + _FAILURE_RETRY_INTERVAL
+            if len(self._backoff) > _MAX_TRACKED_PREFIXES:
+                self._backoff = {key: until for key, until in self._backoff.items() if until > now}
+            logger.warning(f"Failed to create context cache for model {model} with API key {api_key}: {str(e)}")
+            return
+        finally:
+            self._pending.discard((api_key, digest))
+
+        usage = result.get("usageMetadata") or {}
+        entry = CachedPrefix(
+            result["name"], level, usage.get("totalTokenCount", tokens), time.monotonic() + self.ttl
+        )
+        entries = self._entries.setdefault(api_key, OrderedDict())
+        entries[digest] = entry
+        self.created += 1
+        logger.info(f"Created context cache {entry.name} ({entry.tokens} tokens) for model {model}")
+        while len(entries) > self.max_per_key:
+            _, evicted = entries.popitem(last=False)
+            self.evicted += 1
+            self._spawn(self._delete(api_key, evicted))
+
+    def _schedule_extend(self, api_key: str, entry: CachedPrefix) -> None:
+        # 先更新本地过期时间，避免同一缓存被重复续期
+        entry.expires_at = time.monotonic() + self.ttl
+        self._spawn(self._extend(api_key, entry))
+
+    async def _extend(self, api_key: str, entry: CachedPrefix) -> None:
+        try:
+            await self.api_client.update_cached_content(entry.name, {"ttl": f"{int(self.ttl)}s"}, api_key)
+        except (UpstreamError, httpx.HTTPError) as e:
+            logger.warning(f"Failed to extend context cache {entry.name}: {str(e)}")
+            # 上游可能仍保留该缓存，与 LRU 淘汰一样在上游删除，避免计费到 TTL 结束
+            self._discard(api_key, entry.name, delete=not (isinstance(e, UpstreamError) and e.status_code == 404))
+
+    async def _delete(self, api_key: str, entry: CachedPrefix) -> None:
+        try:
+            await self.api_client.delete_cached_content(entry.name, api_key)
+        except (UpstreamError, httpx.HTTPError) as e:
+            # 删除失败时缓存会在 TTL 到期后由上游清理
+            logger.warning(f"Failed to delete context cache {entry.name}: {str(e)}")
+
+    def _discard(self, api_key: str, name: str, delete: bool) -> None:
+        """不再引用该缓存；delete 为 True 时同时在上游删除"""
+        entries = self._entries.get(api_key)
+        if not entries:
+            return
+        for digest, entry in list(entries.items()):
+            if entry.name == name:
+                del entries[digest]
+                if delete:
+                    self._spawn(self._delete(api_key, entry))
+
+    def _reject(self, api_key: str, name: str, error: UpstreamError) -> None:
+        logger.warning(f"Context cache {name} rejected by upstream: {str(error)}")
+        self._discard(api_key, name, delete=error.status_code != 404)
+
+    async def generate_content(
+        self,
+        api_client: GeminiApiClient,
+        plan: Optional[PrefixPlan],
+        payload: Dict[str, Any],
+        model: str,
+        api_key: str,
+    ) -> Dict[str, Any]:
+        """非流式请求，引用的缓存已失效时用完整 payload 重发"""
+        request = self.apply(plan, payload, api_key) if plan is not None else payload
+        if request is payload:
+            return await api_client.generate_content(payload, model, api_key)
+        try:
+            return await api_client.generate_content(request, model, api_key)
+        except UpstreamError as e:
+            if e.status_code not in _STALE_CACHE_STATUS:
+                raise
+            self._reject(api_key, request["cachedContent"], e)
+        return await api_client.generate_content(payload, model, api_key)
+
+    async def stream_generate_content(
+        self,
+        api_client: GeminiApiClient,
+        plan: Optional[PrefixPlan],
+        payload: Dict[str, Any],
+        model: str,
+        api_key: str,
+    ) -> AsyncGenerator[str, None]:
+        """流式请求，引用的缓存在首行之前被拒绝时用完整 payload 重发"""
+        request = self.apply(plan, payload, api_key) if plan is not None else payload
+        if request is not payload:
+            started = False
+            try:
+                async for line in api_client.stream_generate_content(request, model, api_key):
+                    started = True
+                    yield line
+                return
+            except UpstreamError as e:
+                if started or e.status_code not in _STALE_CACHE_STATUS:
+                    raise
+                self._reject(api_key, request["cachedContent"], e)
+        async for line in api_client.stream_generate_content(payload, model, api_key):
+            yield line
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "created": self.created,
+            "failed": self.failed,
+            "evicted": self.evicted,
+            "entries": sum(len(entries) for entries in self._entries.values()),
+        }
+
+
+# 默认的上下文缓存管理器实例，所有聊天服务共享
+context_cache = ContextCacheManager(
+    GeminiApiClient(settings.BASE_URL),
+    enabled=settings.CONTEXT_CACHE_ENABLED,
+    min_tokens=settings.CONTEXT_CACHE_MIN_TOKENS,
+    min_repeats=settings.CONTEXT_CACHE_MIN_REPEATS,
+    ttl=settings.CONTEXT_CACHE_TTL,
+    max_per_key=settings.CONTEXT_CACHE_MAX_PER_KEY,
+)
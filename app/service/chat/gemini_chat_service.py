@@ -1,15 +1,28 @@
 # app/services/chat_service.py
 
-import json
-from typing import Any, AsyncGenerator, Dict, List
+from typing import Any, AsyncGenerator, Dict, List, Optional
 
 from app.config.config import settings
+from app.core.metrics import stage_timer
 from app.domain.gemini_models import GeminiRequest
-from app.handler.response_handler import GeminiResponseHandler
+from app.handler.chunk_template import GeminiChunkTemplate
+from app.handler.hedge_handler import request_hedger
+from app.handler.response_handler import GeminiResponseHandler, upload_inline_images
 from app.handler.stream_optimizer import gemini_optimizer
+from app.handler.stream_retry import (
+    ABORT,
+    RESUME,
+    StreamProgress,
+    build_resume_payload,
+    gemini_error_body,
+    next_action,
+)
 from app.log.logger import get_gemini_logger
+from app.service.chat.context_cache import context_cache
+from app.service.chat.response_cache import get_response_cache
 from app.service.client.api_client import GeminiApiClient
 from app.service.key.key_manager import KeyManager
+from app.utils.json_codec import dumps, loads
 
 logger = get_gemini_logger()
 
@@ -124,70 +137,162 @@ class GeminiChatService:
             return parts[0].get("text", "")
         return ""
 
-    def _create_char_response(
-        self, original_response: Dict[str, Any], text: str
-    ) -> Dict[str, Any]:
-        """创建包含指定文本的响应"""
-        response_copy = json.loads(json.dumps(original_response))  # 深拷贝
-        if response_copy.get("candidates") and response_copy["candidates"][0].get(
-            "content", {}
-        ).get("parts"):
-            response_copy["candidates"][0]["content"]["parts"][0]["text"] = text
-        return response_copy
-
     async def generate_content(
-        self, model: str, request: GeminiRequest, api_key: str
+        self,
+        model: str,
+        request: GeminiRequest,
+        api_key: str,
+        cache_control: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """生成内容"""
-        payload = _build_payload(model, request)
-        response = await self.api_client.generate_content(payload, model, api_key)
-        return self.response_handler.handle_response(response, model, stream=False)
+        """生成内容，启用响应缓存时确定性请求优先读取缓存"""
+        with stage_timer("build_payload", model):
+            payload = _build_payload(model, request)
+            prefix = context_cache.plan(model, payload)
+
+        async def attempt(key: str) -> Dict[str, Any]:
+            with self.key_manager.track(key, model) as usage:
+                response = await context_cache.generate_content(
+                    self.api_client, prefix, payload, model, key
+                )
+                usage.update_tokens(response)
+            return response
+
+        async def fetch() -> Dict[str, Any]:
+            # 启用对冲时，主请求过慢会换密钥再发一次，取先返回的结果
+            response = await request_hedger.run(self.key_manager, model, api_key, attempt)
+            await upload_inline_images(response)
+            return response
+
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            response = await response_cache.get_or_fetch(model, payload, fetch, cache_control)
+        else:
+            response = await fetch()
+        with stage_timer("response_handling", model):
+            return self.response_handler.handle_response(response, model, stream=False)
+
+    async def verify_key(self, api_key: str) -> Dict[str, Any]:
+        """用一次最小的生成请求验证密钥是否可用，失败时抛出上游错误
+
+        只要求输出 1 个 token 以降低探测成本，并直接返回上游原始响应，
+        避免响应处理对空内容（如思考模型被截断）报错。
+        """
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": "hi"}]}],
+            "generationConfig": {"maxOutputTokens": 1},
+        }
+        with self.key_manager.track(api_key, settings.TEST_MODEL):
+            return await self.api_client.generate_content(
+                payload, settings.TEST_MODEL, api_key
+            )
 
     async def stream_generate_content(
-        self, model: str, request: GeminiRequest, api_key: str
+        self,
+        model: str,
+        request: GeminiRequest,
+        api_key: str,
+        stream_mode: Optional[str] = None,
+        cache_control: Optional[str] = None,
     ) -> AsyncGenerator[str, None]:
         """流式生成内容"""
+        async for chunk in gemini_optimizer.coalesce_stream(
+            self._stream_generate_content(model, request, api_key, stream_mode, cache_control),
+            stream_mode,
+        ):
+            yield chunk
+
+    async def _stream_generate_content(
+        self,
+        model: str,
+        request: GeminiRequest,
+        api_key: str,
+        stream_mode: Optional[str] = None,
+        cache_control: Optional[str] = None,
+    ) -> AsyncGenerator[str, None]:
+        """流式生成内容
+
+        启用响应缓存时，确定性请求回放已完成的相同流，或加入正在进行的相同流而不另开上游连接。
+        """
+        with stage_timer("build_payload", model):
+            payload = _build_payload(model, request)
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            chunks = response_cache.stream(
+                model, payload, lambda: self._stream_chunks(model, payload, api_key), cache_control
+            )
+        else:
+            chunks = self._stream_chunks(model, payload, api_key)
+        try:
+            async for chunk in chunks:
+                with stage_timer("response_handling", model):
+                    response_data = self.response_handler.handle_response(
+                        chunk, model, stream=True
+                    )
+                text = self._extract_text_from_response(response_data)
+
+                # 如果有文本内容，使用流式输出优化器处理
+                if text:
+                    # 每个上游块只序列化一次，拆分输出时只拼接转义后的文本
+                    template = GeminiChunkTemplate(response_data, text)
+                    async for optimized_chunk in gemini_optimizer.optimize_stream_output(
+                        text,
+                        lambda t: t,
+                        template.content,
+                        stream_mode,
+                    ):
+                        yield optimized_chunk
+                else:
+                    # 如果没有文本内容（如工具调用等），整块输出
+                    yield "data: " + dumps(response_data) + "\n\n"
+        except Exception as e:
+            yield "data: " + dumps(gemini_error_body(e)) + "\n\n"
+
+    async def _stream_chunks(
+        self, model: str, payload: Dict[str, Any], api_key: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """逐个产出上游数据块，添加重试逻辑
+
+        首个数据块之前失败时换密钥透明重试；已产出内容后失败时按 STREAM_RETRY_POLICY
+        续写，不会从头重新生成导致客户端收到重复内容。放弃重试时抛出最后一次的异常。
+        """
+        with stage_timer("build_payload", model):
+            prefix = context_cache.plan(model, payload)
         retries = 0
-        max_retries = 3
-        payload = _build_payload(model, request)
-        while retries < max_retries:
+        max_retries = settings.STREAM_MAX_RETRIES
+        progress = StreamProgress()
+        request_payload = payload
+        while True:
             try:
-                async for line in self.api_client.stream_generate_content(
-                    payload, model, api_key
-                ):
-                    # print(line)
-                    if line.startswith("data:"):
-                        line = line[6:]
-                        response_data = self.response_handler.handle_response(
-                            json.loads(line), model, stream=True
-                        )
-                        text = self._extract_text_from_response(response_data)
-
-                        # 如果有文本内容，使用流式输出优化器处理
-                        if text:
-                            # 使用流式输出优化器处理文本输出
-                            async for (
-                                optimized_chunk
-                            ) in gemini_optimizer.optimize_stream_output(
-                                text,
-                                lambda t: self._create_char_response(response_data, t),
-                                lambda c: "data: " + json.dumps(c) + "\n\n",
-                            ):
-                                yield optimized_chunk
-                        else:
-                            # 如果没有文本内容（如工具调用等），整块输出
-                            yield "data: " + json.dumps(response_data) + "\n\n"
+                with self.key_manager.track(api_key, model) as usage:
+                    async for line in context_cache.stream_generate_content(
+                        self.api_client, prefix, request_payload, model, api_key
+                    ):
+                        usage.mark()
+                        if line.startswith("data:"):
+                            chunk = loads(line[6:])
+                            usage.update_tokens(chunk)
+                            # 先上传图片再记录进度，上传失败时该数据块未发送给客户端，仍可透明重试
+                            await upload_inline_images(chunk)
+                            progress.record(chunk)
+                            yield chunk
                 logger.info("Streaming completed successfully")
-                break
+                return
             except Exception as e:
                 retries += 1
                 logger.warning(
                     f"Streaming API call failed with error: {str(e)}. Attempt {retries} of {max_retries}"
                 )
-                api_key = await self.key_manager.handle_api_failure(api_key)
-                logger.info(f"Switched to new API key: {api_key}")
-                if retries >= max_retries:
-                    logger.error(
-                        f"Max retries ({max_retries}) reached for streaming. Raising error"
-                    )
-                    break
+                api_key = await self.key_manager.handle_api_failure(
+                    api_key, error=e, model=model
+                )
+                action = next_action(e, progress, settings.STREAM_RETRY_POLICY)
+                if action != ABORT and retries < max_retries:
+                    if action == RESUME:
+                        # 已产出的文本作为前缀续写，客户端不会收到重复内容
+                        request_payload = build_resume_payload(payload, progress.text)
+                        logger.info(f"Resuming stream after {len(progress.text)} chars with API key: {api_key}")
+                    else:
+                        logger.info(f"Switched to new API key: {api_key}")
+                    continue
+                logger.error(f"Streaming aborted after {retries} attempts ({action})")
+                raise
@@ -1,18 +1,31 @@
 # app/services/chat_service.py
 
-import json
 from copy import deepcopy
 from typing import Any, AsyncGenerator, Dict, List, Optional, Union
 
 from app.config.config import settings
+from app.core.metrics import stage_timer
 from app.domain.openai_models import ChatRequest, ImageGenerationRequest
+from app.handler.chunk_template import OpenAIChunkTemplate
+from app.handler.hedge_handler import request_hedger
 from app.handler.message_converter import OpenAIMessageConverter
-from app.handler.response_handler import OpenAIResponseHandler
+from app.handler.response_handler import OpenAIResponseHandler, upload_inline_images
 from app.handler.stream_optimizer import openai_optimizer
+from app.handler.stream_retry import (
+    ABORT,
+    RESUME,
+    StreamProgress,
+    build_resume_payload,
+    next_action,
+    openai_error_body,
+)
 from app.log.logger import get_openai_logger
+from app.service.chat.context_cache import context_cache
+from app.service.chat.response_cache import get_response_cache
 from app.service.client.api_client import GeminiApiClient
 from app.service.image.image_create_service import ImageCreateService
 from app.service.key.key_manager import KeyManager
+from app.utils.json_codec import dumps, loads
 
 logger = get_openai_logger()
 
@@ -149,113 +162,173 @@ class OpenAIChatService:
         self.key_manager = key_manager
         self.image_create_service = ImageCreateService()
 
-    def _extract_text_from_openai_chunk(self, chunk: Dict[str, Any]) -> str:
-        """从OpenAI响应块中提取文本内容"""
-        if not chunk.get("choices"):
-            return ""
-
-        choice = chunk["choices"][0]
-        if "delta" in choice and "content" in choice["delta"]:
-            return choice["delta"]["content"]
-        return ""
-
-    def _create_char_openai_chunk(
-        self, original_chunk: Dict[str, Any], text: str
-    ) -> Dict[str, Any]:
-        """创建包含指定文本的OpenAI响应块"""
-        chunk_copy = json.loads(json.dumps(original_chunk))  # 深拷贝
-        if chunk_copy.get("choices") and "delta" in chunk_copy["choices"][0]:
-            chunk_copy["choices"][0]["delta"]["content"] = text
-        return chunk_copy
-
     async def create_chat_completion(
         self,
         request: ChatRequest,
         api_key: str,
+        stream_mode: Optional[str] = None,
+        cache_control: Optional[str] = None,
     ) -> Union[Dict[str, Any], AsyncGenerator[str, None]]:
         """创建聊天完成"""
         # 转换消息格式
-        messages, instruction = self.message_converter.convert(request.messages)
+        with stage_timer("convert", request.model):
+            messages, instruction = await self.message_converter.convert(request.messages)
 
         # 构建请求payload
-        payload = _build_payload(request, messages, instruction)
+        with stage_timer("build_payload", request.model):
+            payload = _build_payload(request, messages, instruction)
 
         if request.stream:
-            return self._handle_stream_completion(request.model, payload, api_key)
-        return await self._handle_normal_completion(request.model, payload, api_key)
+            return openai_optimizer.coalesce_stream(
+                self._handle_stream_completion(
+                    request.model, payload, api_key, stream_mode, cache_control
+                ),
+                stream_mode,
+            )
+        return await self._handle_normal_completion(
+            request.model, payload, api_key, cache_control
+        )
 
     async def _handle_normal_completion(
-        self, model: str, payload: Dict[str, Any], api_key: str
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        api_key: str,
+        cache_control: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """处理普通聊天完成"""
-        response = await self.api_client.generate_content(payload, model, api_key)
-        return self.response_handler.handle_response(
-            response, model, stream=False, finish_reason="stop"
-        )
+        """处理普通聊天完成，启用响应缓存时确定性请求优先读取缓存"""
+        with stage_timer("build_payload", model):
+            prefix = context_cache.plan(model, payload)
+
+        async def attempt(key: str) -> Dict[str, Any]:
+            with self.key_manager.track(key, model) as usage:
+                response = await context_cache.generate_content(
+                    self.api_client, prefix, payload, model, key
+                )
+                usage.update_tokens(response)
+            return response
+
+        async def fetch() -> Dict[str, Any]:
+            # 启用对冲时，主请求过慢会换密钥再发一次，取先返回的结果
+            response = await request_hedger.run(self.key_manager, model, api_key, attempt)
+            await upload_inline_images(response)
+            return response
+
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            response = await response_cache.get_or_fetch(model, payload, fetch, cache_control)
+        else:
+            response = await fetch()
+        with stage_timer("response_handling", model):
+            return self.response_handler.handle_response(
+                response, model, stream=False, finish_reason="stop"
+            )
 
     async def _handle_stream_completion(
-        self, model: str, payload: Dict[str, Any], api_key: str
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        api_key: str,
+        stream_mode: Optional[str] = None,
+        cache_control: Optional[str] = None,
     ) -> AsyncGenerator[str, None]:
-        """处理流式聊天完成，添加重试逻辑"""
+        """处理流式聊天完成
+
+        启用响应缓存时，确定性请求回放已完成的相同流，或加入正在进行的相同流而不另开上游连接。
+        """
+        # 整个流共用一个模板，外层字段只序列化一次
+        template = OpenAIChunkTemplate(model)
+        tool_call_flag = False
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            chunks = response_cache.stream(
+                model, payload, lambda: self._stream_chunks(model, payload, api_key), cache_control
+            )
+        else:
+            chunks = self._stream_chunks(model, payload, api_key)
+        try:
+            async for chunk in chunks:
+                with stage_timer("response_handling", model):
+                    delta = self.response_handler.handle_stream_delta(chunk, model)
+                if delta.get("tool_calls"):
+                    # 工具调用整块输出
+                    tool_call_flag = True
+                    yield template.chunk(delta)
+                elif delta.get("content"):
+                    # 使用流式输出优化器处理文本输出
+                    async for optimized_chunk in openai_optimizer.optimize_stream_output(
+                        delta["content"],
+                        lambda t: t,
+                        template.content,
+                        stream_mode,
+                    ):
+                        yield optimized_chunk
+                else:
+                    yield template.chunk(delta)
+        except Exception as e:
+            yield f"data: {dumps(openai_error_body(e))}\n\n"
+            yield "data: [DONE]\n\n"
+            return
+        if tool_call_flag:
+            yield template.finish("tool_calls")
+        else:
+            yield template.finish("stop")
+        yield "data: [DONE]\n\n"
+
+    async def _stream_chunks(
+        self, model: str, payload: Dict[str, Any], api_key: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """逐个产出上游数据块，添加重试逻辑
+
+        首个数据块之前失败时换密钥透明重试；已产出内容后失败时按 STREAM_RETRY_POLICY
+        续写，不会从头重新生成导致客户端收到重复内容。放弃重试时抛出最后一次的异常。
+        """
+        with stage_timer("build_payload", model):
+            prefix = context_cache.plan(model, payload)
         retries = 0
-        max_retries = 3
-        while retries < max_retries:
+        max_retries = settings.STREAM_MAX_RETRIES
+        progress = StreamProgress()
+        request_payload = payload
+        while True:
             try:
-                tool_call_flag = False
-                async for line in self.api_client.stream_generate_content(
-                    payload, model, api_key
-                ):
-                    # print(line)
-                    if line.startswith("data:"):
-                        chunk = json.loads(line[6:])
-                        openai_chunk = self.response_handler.handle_response(
-                            chunk, model, stream=True, finish_reason=None
-                        )
-                        if openai_chunk:
-                            # 提取文本内容
-                            text = self._extract_text_from_openai_chunk(openai_chunk)
-                            if text:
-                                # 使用流式输出优化器处理文本输出
-                                async for (
-                                    optimized_chunk
-                                ) in openai_optimizer.optimize_stream_output(
-                                    text,
-                                    lambda t: self._create_char_openai_chunk(
-                                        openai_chunk, t
-                                    ),
-                                    lambda c: f"data: {json.dumps(c)}\n\n",
-                                ):
-                                    yield optimized_chunk
-                            else:
-                                # 如果没有文本内容（如工具调用等），整块输出
-                                if "tool_calls" in json.dumps(openai_chunk):
-                                    tool_call_flag = True
-                                yield f"data: {json.dumps(openai_chunk)}\n\n"
-                if tool_call_flag:
-                    yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='tool_calls'))}\n\n"
-                else:
-                    yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='stop'))}\n\n"
-                yield "data: [DONE]\n\n"
+                with self.key_manager.track(api_key, model) as usage:
+                    async for line in context_cache.stream_generate_content(
+                        self.api_client, prefix, request_payload, model, api_key
+                    ):
+                        usage.mark()
+                        if line.startswith("data:"):
+                            chunk = loads(line[6:])
+                            usage.update_tokens(chunk)
+                            # 先上传图片再记录进度，上传失败时该数据块未发送给客户端，仍可透明重试
+                            await upload_inline_images(chunk)
+                            progress.record(chunk)
+                            yield chunk
                 logger.info("Streaming completed successfully")
-                break  # 成功后退出循环
+                return
             except Exception as e:
                 retries += 1
                 logger.warning(
                     f"Streaming API call failed with error: {str(e)}. Attempt {retries} of {max_retries}"
                 )
-                api_key = await self.key_manager.handle_api_failure(api_key)
-                logger.info(f"Switched to new API key: {api_key}")
-                if retries >= max_retries:
-                    logger.error(
-                        f"Max retries ({max_retries}) reached for streaming. Raising error"
-                    )
-                    yield f"data: {json.dumps({'error': 'Streaming failed after retries'})}\n\n"
-                    yield "data: [DONE]\n\n"
-                    break
+                api_key = await self.key_manager.handle_api_failure(
+                    api_key, error=e, model=model
+                )
+                action = next_action(e, progress, settings.STREAM_RETRY_POLICY)
+                if action != ABORT and retries < max_retries:
+                    if action == RESUME:
+                        # 已产出的文本作为前缀续写，客户端不会收到重复内容
+                        request_payload = build_resume_payload(payload, progress.text)
+                        logger.info(f"Resuming stream after {len(progress.text)} chars with API key: {api_key}")
+                    else:
+                        logger.info(f"Switched to new API key: {api_key}")
+                    continue
+                logger.error(f"Streaming aborted after {retries} attempts ({action})")
+                raise
 
     async def create_image_chat_completion(
         self,
         request: ChatRequest,
+        stream_mode: Optional[str] = None,
     ) -> Union[Dict[str, Any], AsyncGenerator[str, None]]:
         """
         使用圖像生成服務創建聊天完成
@@ -268,34 +341,29 @@ class OpenAIChatService:
         )
 
         if request.stream:
-            return self._handle_stream_image_completion(request.model, image_res)
+            return openai_optimizer.coalesce_stream(
+                self._handle_stream_image_completion(
+                    request.model, image_res, stream_mode
+                ),
+                stream_mode,
+            )
         else:
             return self._handle_normal_image_completion(request.model, image_res)
 
     async def _handle_stream_image_completion(
-        self, model: str, image_data: str
+        self, model: str, image_data: str, stream_mode: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
+        template = OpenAIChunkTemplate(model)
         if image_data:
-            openai_chunk = self.response_handler.handle_image_chat_response(
-                image_data, model, stream=True, finish_reason=None
-            )
-            if openai_chunk:
-                # 提取文本内容
-                text = self._extract_text_from_openai_chunk(openai_chunk)
-                if text:
-                    # 使用流式输出优化器处理文本输出
-                    async for (
-                        optimized_chunk
-                    ) in openai_optimizer.optimize_stream_output(
-                        text,
-                        lambda t: self._create_char_openai_chunk(openai_chunk, t),
-                        lambda c: f"data: {json.dumps(c)}\n\n",
-                    ):
-                        yield optimized_chunk
-                else:
-                    # 如果没有文本内容（如图片URL等），整块输出
-                    yield f"data: {json.dumps(openai_chunk)}\n\n"
-        yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='stop'))}\n\n"
+            # 使用流式输出优化器处理文本输出
+            async for optimized_chunk in openai_optimizer.optimize_stream_output(
+                image_data,
+                lambda t: t,
+                template.content,
+                stream_mode,
+            ):
+                yield optimized_chunk
+        yield template.finish("stop")
         yield "data: [DONE]\n\n"
         logger.info("Image chat streaming completed successfully")
 
@@ -0,0 +1,270 @@
+"""
+响应缓存模块
+
+对确定性请求（generationConfig.temperature 为 0）按构建好的上游 payload 精确匹配缓存上游响应。
+缓存键为模型名与规范化 payload（去掉值为 null 的字段与 VOLATILE_FIELDS）的 SHA-256；
+条目带 TTL，按序列化后的字节数做 LRU 淘汰。相同请求并发到达时只向上游发送一次（singleflight）。
+流式请求保存完整的上游数据块序列，之后相同的请求直接回放；上游流尚未结束时到达的相同请求
+加入该流（先回放已产生的数据块，再跟随新数据块），不另开上游连接。
+
+客户端可通过请求头 Cache-Control 控制缓存:
+    no-store: 不读也不写缓存
+    no-cache: 跳过缓存直接请求上游，结果写入缓存
+    max-age=N: 只接受 N 秒内写入的条目
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.config.config import settings
+from app.log.logger import get_response_cache_logger
+from app.utils.cache import ByteSizeLRUCache
+from app.utils.json_codec import dumps_bytes, loads
+from app.utils.singleflight import SingleFlight
+
+logger = get_response_cache_logger()
+
+# 不影响生成结果、或随密钥变化的顶层字段，不参与缓存键
+VOLATILE_FIELDS = frozenset(["cachedContent", "labels"])
+
+
+def _strip_nulls(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _strip_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_strip_nulls(item) for item in value]
+    return value
+
+
+def cache_key(model: str, payload: Dict[str, Any]) -> bytes:
+    """缓存键: 模型名与规范化 payload 的 SHA-256"""
+    model = model[len("models/"):] if model.startswith("models/") else model
+    canonical = _strip_nulls({k: v for k, v in payload.items() if k not in VOLATILE_FIELDS})
+    body = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{model}\0{body}".encode("utf-8")).digest()
+
+
+def is_deterministic(payload: Dict[str, Any]) -> bool:
+    config = payload.get("generationConfig") or {}
+    return config.get("temperature") == 0
+
+
+def parse_cache_control(value: Optional[str]) -> Tuple[bool, bool, Optional[float]]:
+    """解析 Cache-Control 请求头，返回 (no_store, no_cache, max_age)"""
+    no_store = no_cache = False
+    max_age = None
+    for directive in (value or "").lower().split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name == "no-store":
+            no_store = True
+        elif name == "no-cache":
+            no_cache = True
+        elif name == "max-age":
+            try:
+                max_age = max(0.0, float(argument.strip('" ')))
+            except ValueError:
+                pass
+    return no_store, no_cache, max_age
+
+
+class StreamBroadcast:
+    """一次上游流的扇出
+
+    已产生的数据块按顺序保存（序列化后，每个订阅者解析出独立的对象），后加入的订阅者先回放
+    已有数据块再跟随新数据块。最后一个订阅者离开时取消上游流，与未启用缓存时客户端断开的行为一致。
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.abandoned = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    index += 1
+                    yield loads(self.chunks[index - 1])
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done and self.task is not None:
+                self.abandoned = True
+                self.task.cancel()
+
+
+class ResponseCache:
+    """确定性请求的上游响应缓存
+
+    Args:
+        max_bytes: 缓存容量（按序列化后的响应字节数计算）
+        ttl: 条目有效期（秒）
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.ttl = ttl
+        # 非流式条目为响应字节串，流式条目为数据块字节串的元组
+        self.entries: ByteSizeLRUCache[Tuple[float, Any]] = ByteSizeLRUCache(max_bytes)
+        self.flights: SingleFlight[bytes] = SingleFlight()
+        self.streams: Dict[Hashable, StreamBroadcast] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.attached = 0
+
+    def _lookup(self, key: Hashable, max_age: Optional[float]) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, body = entry
+        age = time.monotonic() - stored_at
+        if age >= self.ttl:
+            self.entries.pop(key)
+            return None
+        if max_age is not None and age > max_age:
+            return None
+        return body
+
+    async def get_or_fetch(
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        fetch: Callable[[], Awaitable[Dict[str, Any]]],
+        cache_control: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """返回缓存的响应，未命中时调用 fetch 请求上游；非确定性请求直接调用 fetch"""
+        no_store, no_cache, max_age = parse_cache_control(cache_control)
+        if no_store or not is_deterministic(payload):
+            self.bypassed += 1
+            return await fetch()
+
+        key = cache_key(model, payload)
+        if not no_cache:
+            body = self._lookup(key, max_age)
+            if body is not None:
+                self.hits += 1
+                logger.info(f"Response cache hit for model {model}")
+                # 每次返回新的对象，响应处理可以随意修改
+                return loads(body)
+        self.misses += 1
+
+        async def load() -> bytes:
+            response = await fetch()
+            body = dumps_bytes(response)
+            # 被安全策略拦截等没有候选结果的响应不缓存
+            if response.get("candidates"):
+                self.entries.put(key, (time.monotonic(), body), len(body))
+            return body
+
+        return loads(await self.flights.do(key, load, share_errors=False))
+
+    async def _produce(
+        self, key: Hashable, broadcast: StreamBroadcast, source: AsyncIterator[Dict[str, Any]]
+    ) -> None:
+        try:
+            async for chunk in source:
+                broadcast.append(dumps_bytes(chunk))
+        except BaseException as e:
+            # 上游错误交给订阅者处理，不写入缓存
+            broadcast.finish(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            broadcast.finish()
+            if broadcast.chunks:
+                self.entries.put(key, (time.monotonic(), tuple(broadcast.chunks)), broadcast.size)
+        finally:
+            if self.streams.get(key) is broadcast:
+                del self.streams[key]
+
+    async def stream(
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        source: Callable[[], AsyncIterator[Dict[str, Any]]],
+        cache_control: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """逐个产出上游数据块: 回放缓存的流、加入进行中的相同流，或调用 source 开启新的上游流"""
+        no_store, no_cache, max_age = parse_cache_control(cache_control)
+        if no_store or not is_deterministic(payload):
+            self.bypassed += 1
+            async for chunk in source():
+                yield chunk
+            return
+
+        key = ("stream", cache_key(model, payload))
+        if not no_cache:
+            chunks = self._lookup(key, max_age)
+            if chunks is not None:
+                self.hits += 1
+                logger.info(f"Replaying cached stream for model {model}")
+                for chunk in chunks:
+                    yield loads(chunk)
+                return
+        self.misses += 1
+
+        broadcast = self.streams.get(key)
+        # 所有订阅者都已离开的流正在取消，不能再加入
+        if broadcast is None or broadcast.abandoned:
+            broadcast = self.streams[key] = StreamBroadcast()
+            broadcast.task = asyncio.ensure_future(self._produce(key, broadcast, source()))
+        else:
+            self.attached += 1
+            logger.info(f"Attaching to in-progress stream for model {model}")
+        async for chunk in broadcast.subscribe():
+            yield chunk
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "coalesced": self.flights.shared,
+            "attached": self.attached,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.entries.total_bytes,
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """按配置创建共享的响应缓存，未启用时返回 None"""
+    global _response_cache
+    if _response_cache is None and settings.RESPONSE_CACHE_ENABLED:
+        _response_cache = ResponseCache(
+            max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+            ttl=settings.RESPONSE_CACHE_TTL,
+        )
+    return _response_cache
@@ -1,10 +1,79 @@
 # app/services/chat/api_client.py
 
-from typing import Dict, Any, AsyncGenerator
+from typing import Dict, Any, AsyncGenerator, Optional
+import time
+from email.utils import parsedate_to_datetime
 import httpx
 from abc import ABC, abstractmethod
 
 from app.core.constants import DEFAULT_TIMEOUT
+from app.exception.exceptions import UpstreamError
+from app.service.client.http_client import get_http_client
+from app.utils.json_codec import dumps_bytes, loads
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数与HTTP日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_duration(value: Any) -> Optional[float]:
+    """解析 google.protobuf.Duration 的JSON表示（如 38s、1.5s）"""
+    if not isinstance(value, str) or not value.endswith("s"):
+        return None
+    try:
+        return float(value[:-1])
+    except ValueError:
+        return None
+
+
+def build_upstream_error(status_code: int, headers: httpx.Headers, content: bytes) -> UpstreamError:
+    """根据上游响应构造带分类信息的 UpstreamError
+
+    从 Retry-After 头以及错误详情中的 RetryInfo / QuotaFailure / ErrorInfo 提取冷却时长、
+    触发的配额与错误原因，供密钥管理器决定冷却范围。
+    """
+    detail = content.decode("utf-8", errors="replace")
+    retry_after = _parse_retry_after(headers.get("retry-after"))
+    reason = quota_id = quota_model = None
+    try:
+        error = loads(content).get("error", {})
+    except Exception:
+        error = {}
+    for item in error.get("details") or []:
+        if not isinstance(item, dict):
+            continue
+        detail_type = item.get("@type", "")
+        if detail_type.endswith("google.rpc.RetryInfo"):
+            delay = _parse_duration(item.get("retryDelay"))
+            if delay is not None:
+                retry_after = max(retry_after or 0.0, delay)
+        elif detail_type.endswith("google.rpc.QuotaFailure"):
+            for violation in item.get("violations") or []:
+                quota_id = quota_id or violation.get("quotaId")
+                dimensions = violation.get("quotaDimensions") or {}
+                quota_model = quota_model or dimensions.get("model")
+        elif detail_type.endswith("google.rpc.ErrorInfo"):
+            reason = reason or item.get("reason")
+    return UpstreamError(
+        status_code,
+        detail,
+        retry_after=retry_after,
+        reason=reason,
+        quota_id=quota_id,
+        quota_model=quota_model,
+    )
 
 
 class ApiClient(ABC):
@@ -38,24 +107,48 @@ class GeminiApiClient(ApiClient):
         timeout = httpx.Timeout(self.timeout, read=self.timeout)
         model = self._get_real_model(model)
 
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            url = f"{self.base_url}/models/{model}:generateContent?key={api_key}"
-            response = await client.post(url, json=payload)
-            if response.status_code != 200:
-                error_content = response.text
-                raise Exception(f"API call failed with status code {response.status_code}, {error_content}")
-            return response.json()
+        client = get_http_client()
+        url = f"{self.base_url}/models/{model}:generateContent?key={api_key}"
+        response = await client.post(
+            url, content=dumps_bytes(payload), headers=JSON_HEADERS, timeout=timeout
+        )
+        if response.status_code != 200:
+            raise build_upstream_error(response.status_code, response.headers, response.content)
+        return loads(response.content)
 
     async def stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> AsyncGenerator[str, None]:
         timeout = httpx.Timeout(self.timeout, read=self.timeout)
         model = self._get_real_model(model)
         
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
-            async with client.stream(method="POST", url=url, json=payload) as response:
-                if response.status_code != 200:
-                    error_content = await response.aread()
-                    error_msg = error_content.decode("utf-8")
-                    raise Exception(f"API call failed with status code {response.status_code}, {error_msg}")
-                async for line in response.aiter_lines():
-                    yield line
+        client = get_http_client()
+        url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+        async with client.stream(
+            method="POST", url=url, content=dumps_bytes(payload), headers=JSON_HEADERS, timeout=timeout
+        ) as response:
+            if response.status_code != 200:
+                error_content = await response.aread()
+                raise build_upstream_error(response.status_code, response.headers, error_content)
+            async for line in response.aiter_lines():
+                yield line
+
+    async def _request_json(self, method: str, url: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+        content = dumps_bytes(payload) if payload is not None else None
+        response = await get_http_client().request(
+            method, url, content=content, headers=JSON_HEADERS, timeout=timeout
+        )
+        if response.status_code != 200:
+            raise build_upstream_error(response.status_code, response.headers, response.content)
+        return loads(response.content) if response.content else {}
+
+    async def create_cached_content(self, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+        """创建 cachedContents，返回包含 name 与 expireTime 的缓存对象"""
+        payload = {**payload, "model": f"models/{self._get_real_model(model)}"}
+        return await self._request_json("POST", f"{self.base_url}/cachedContents?key={api_key}", payload)
+
+    async def update_cached_content(self, name: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """更新 cachedContents（如 ttl）"""
+        return await self._request_json("PATCH", f"{self.base_url}/{name}?key={api_key}", payload)
+
+    async def delete_cached_content(self, name: str, api_key: str) -> None:
+        await self._request_json("DELETE", f"{self.base_url}/{name}?key={api_key}")
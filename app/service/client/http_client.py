@@ -0,0 +1,76 @@
+# app/service/client/http_client.py
+
+from typing import Optional
+
+import httpx
+
+from app.config.config import settings
+from app.core.constants import DEFAULT_TIMEOUT
+from app.log.logger import get_http_client_logger
+
+logger = get_http_client_logger()
+
+_shared_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """检查是否安装了HTTP/2所需的h2依赖"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    根据配置创建一个带连接池的 httpx.AsyncClient
+
+    Returns:
+        httpx.AsyncClient: 新建的客户端实例
+    """
+    http2 = settings.HTTP2_ENABLED
+    if http2 and not _http2_available():
+        logger.warning("HTTP/2 is enabled but 'h2' is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(DEFAULT_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+    logger.info(
+        f"Creating shared HTTP client (http2={http2}, max_connections={limits.max_connections}, "
+        f"max_keepalive={limits.max_keepalive_connections}, keepalive_expiry={limits.keepalive_expiry}s)"
+    )
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+
+async def init_http_client() -> httpx.AsyncClient:
+    """在应用启动时创建共享的上游连接池"""
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = create_http_client()
+    return _shared_client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取应用级共享的 httpx.AsyncClient
+
+    正常情况下由 lifespan 创建；在脚本或测试中未经过 lifespan 时按需创建。
+    """
+    global _shared_client
+    if _shared_client is None or _shared_client.is_closed:
+        _shared_client = create_http_client()
+    return _shared_client
+
+
+async def close_http_client() -> None:
+    """在应用关闭时释放共享连接池"""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+        logger.info("Shared HTTP client closed")
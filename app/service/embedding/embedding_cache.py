@@ -0,0 +1,235 @@
+"""
+嵌入向量缓存模块
+
+按 (模型, 规范化文本的 SHA-256) 缓存嵌入向量，向量以 float32 数组存储（每维 4 字节，
+约为 JSON 浮点列表的五分之一）。内存层为按字节数限制的 LRU；可选的磁盘层把向量追加写入
+数据文件并通过 mmap 读取，索引记录追加写入单独的文件，重启后重新加载即可继续命中。
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import unicodedata
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.config.config import settings
+from app.log.logger import get_embeddings_logger
+from app.utils.cache import ByteSizeLRUCache
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不支持多进程共享写入
+    fcntl = None
+
+logger = get_embeddings_logger()
+
+# 索引记录: 32 字节摘要 + 8 字节数据偏移 + 4 字节维度
+_RECORD = struct.Struct("<32sQI")
+_FLOAT_SIZE = array("f").itemsize
+
+
+def normalize_model(model: str) -> str:
+    return model[len("models/"):] if model.startswith("models/") else model
+
+
+def cache_key(model: str, text: str) -> bytes:
+    """缓存键: 模型名与 NFC 规范化、去除首尾空白后的文本的 SHA-256"""
+    normalized = unicodedata.normalize("NFC", text).strip()
+    return hashlib.sha256(f"{normalize_model(model)}\0{normalized}".encode("utf-8")).digest()
+
+
+class MmapVectorStore:
+    """追加写入、mmap 读取的磁盘向量存储
+
+    数据文件只追加 float32 向量，索引文件只追加定长记录；启动时丢弃写到一半的记录。
+    多个 worker 共享同一目录时写入通过文件锁串行化，其它进程写入的条目在本进程下一次写入时可见。
+    达到 max_bytes 后不再写入新条目。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._data = open(os.path.join(directory, "vectors.f32"), "a+b")
+        self._index = open(os.path.join(directory, "vectors.idx"), "a+b")
+        self._offsets: Dict[bytes, Tuple[int, int]] = {}
+        self._index_pos = 0
+        self._map: Optional[mmap.mmap] = None
+        self._map_size = 0
+        self._lock = threading.Lock()
+        self._full = False
+        with self._locked():
+            self._load_index()
+            if os.fstat(self._index.fileno()).st_size > self._index_pos:
+                # 截掉崩溃时写到一半的索引记录，保证后续追加的记录对齐
+                self._index.truncate(self._index_pos)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def size(self) -> int:
+        return os.fstat(self._data.fileno()).st_size
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._index.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._index.fileno(), fcntl.LOCK_UN)
+
+    def _load_index(self) -> None:
+        """读取索引文件中尚未加载的记录"""
+        self._index.seek(self._index_pos)
+        raw = self._index.read()
+        usable = len(raw) - len(raw) % _RECORD.size
+        data_size = self.size
+        for digest, offset, dim in _RECORD.iter_unpack(raw[:usable]):
+            if offset + dim * _FLOAT_SIZE <= data_size:
+                self._offsets[digest] = (offset, dim)
+        self._index_pos += usable
+
+    def _view(self, end: int) -> Optional[mmap.mmap]:
+        if end > self._map_size:
+            size = self.size
+            if size < end:
+                return None
+            # 数据文件增长后重新映射
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._data.fileno(), size, access=mmap.ACCESS_READ)
+            self._map_size = size
+        return self._map
+
+    def get(self, digest: bytes) -> Optional[array]:
+        entry = self._offsets.get(digest)
+        if entry is None:
+            return None
+        offset, dim = entry
+        end = offset + dim * _FLOAT_SIZE
+        view = self._view(end)
+        if view is None:
+            return None
+        vector = array("f")
+        vector.frombytes(view[offset:end])
+        return vector
+
+    def put_many(self, items: List[Tuple[bytes, array]]) -> int:
+        """追加写入尚未存储的向量，返回写入条数"""
+        with self._locked():
+            self._load_index()
+            data_size = self.size
+            chunks: List[bytes] = []
+            records: List[bytes] = []
+            written: Dict[bytes, Tuple[int, int]] = {}
+            for digest, vector in items:
+                if digest in self._offsets or digest in written:
+                    continue
+                size = len(vector) * _FLOAT_SIZE
+                if data_size + size > self.max_bytes:
+                    if not self._full:
+                        logger.warning(f"Embedding disk cache reached {self.max_bytes} bytes, new entries are not persisted")
+                        self._full = True
+                    break
+                chunks.append(vector.tobytes())
+                records.append(_RECORD.pack(digest, data_size, len(vector)))
+                written[digest] = (data_size, len(vector))
+                data_size += size
+            if records:
+                # 先写数据再写索引，中途崩溃时只会留下没有索引的数据
+                self._data.write(b"".join(chunks))
+                self._data.flush()
+                self._index.write(b"".join(records))
+                self._index.flush()
+                self._index_pos += len(records) * _RECORD.size
+                self._offsets.update(written)
+            return len(records)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+        self._data.close()
+        self._index.close()
+
+
+class EmbeddingCache:
+    """内存 LRU + 可选磁盘层的两级嵌入向量缓存
+
+    Args:
+        memory_bytes: 内存层容量（字节）
+        directory: 磁盘层目录，为空时只使用内存层
+        disk_max_bytes: 磁盘层数据文件的最大字节数
+    """
+
+    def __init__(self, memory_bytes: int, directory: str = "", disk_max_bytes: int = 0):
+        self.memory: ByteSizeLRUCache[array] = ByteSizeLRUCache(memory_bytes)
+        self.disk = MmapVectorStore(directory, disk_max_bytes) if directory else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> Optional[array]:
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self.memory.put(key, vector, len(vector) * _FLOAT_SIZE)
+                return vector
+        self.misses += 1
+        return None
+
+    async def put_many(self, items: List[Tuple[bytes, array]]) -> None:
+        for key, vector in items:
+            self.memory.put(key, vector, len(vector) * _FLOAT_SIZE)
+        if self.disk is not None and items:
+            try:
+                await asyncio.to_thread(self.disk.put_many, items)
+            except OSError as e:
+                logger.error(f"Failed to persist embeddings: {str(e)}")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.total_bytes,
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "disk_bytes": self.disk.size if self.disk is not None else 0,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """按配置创建共享的嵌入缓存，未启用时返回 None"""
+    global _embedding_cache
+    if _embedding_cache is None and settings.EMBEDDING_CACHE_ENABLED:
+        _embedding_cache = EmbeddingCache(
+            memory_bytes=settings.EMBEDDING_CACHE_MEMORY_BYTES,
+            directory=settings.EMBEDDING_CACHE_DIR,
+            disk_max_bytes=settings.EMBEDDING_CACHE_DISK_MAX_BYTES,
+        )
+    return _embedding_cache
@@ -1,25 +1,191 @@
-from typing import List, Union
+import asyncio
+from array import array
+from typing import Dict, List, Optional, Tuple, Union
 
+import httpx
 import openai
-from openai.types import CreateEmbeddingResponse
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.create_embedding_response import Usage
 
+from app.config.config import settings
+from app.exception.exceptions import UpstreamError
 from app.log.logger import get_embeddings_logger
+from app.service.client.api_client import build_upstream_error
+from app.service.client.http_client import get_http_client
+from app.service.embedding.embedding_cache import EmbeddingCache, cache_key
+from app.service.key.key_manager import KeyManager
 
 logger = get_embeddings_logger()
 
 
+def split_batches(items: List, batch_size: int) -> List[Tuple[int, List]]:
+    """按批次上限均匀切分输入，返回 (起始下标, 批次) 列表
+
+    批次数取满足上限的最小值，各批次大小相差不超过 1（如 101 条切成 51+50 而非 100+1），
+    并发执行时各批次耗时接近，总耗时不被最大的批次拖长。
+    """
+    batch_size = max(1, batch_size)
+    count = -(-len(items) // batch_size)
+    batches = []
+    start = 0
+    for i in range(count):
+        size = len(items) // count + (1 if i < len(items) % count else 0)
+        batches.append((start, items[start:start + size]))
+        start += size
+    return batches
+
+
 class EmbeddingService:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, cache: Optional[EmbeddingCache] = None):
         self.base_url = base_url
+        self.cache = cache
+        self._client: Optional[openai.AsyncOpenAI] = None
+        # 创建 _client 时使用的共享连接池，连接池被替换（如重新创建）后需要重建客户端
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self, api_key: str) -> openai.AsyncOpenAI:
+        """复用同一个 AsyncOpenAI 客户端（及共享连接池），按请求替换密钥"""
+        http_client = get_http_client()
+        if self._client is None or self._http_client is not http_client:
+            # 重试与换密钥由这里处理，关闭 SDK 在同一密钥上的自动重试
+            self._client = openai.AsyncOpenAI(
+                api_key=api_key, base_url=self.base_url, http_client=http_client, max_retries=0
+            )
+            self._http_client = http_client
+        return self._client.with_options(api_key=api_key)
+
+    async def _embed_batch(
+        self,
+        input_text: Union[str, List[str]],
+        model: str,
+        api_key: str,
+        key_manager: Optional[KeyManager],
+    ) -> CreateEmbeddingResponse:
+        """请求一个批次，失败时由密钥管理器分类处理并换密钥重试"""
+        max_retries = settings.EMBEDDING_MAX_RETRIES if key_manager else 1
+        for attempt in range(1, max_retries + 1):
+            try:
+                if key_manager is None:
+                    return await self._get_client(api_key).embeddings.create(input=input_text, model=model)
+                with key_manager.track(api_key, model) as usage:
+                    response = await self._get_client(api_key).embeddings.create(input=input_text, model=model)
+                    if response.usage is not None:
+                        usage.tokens = response.usage.total_tokens
+                return response
+            except openai.APIStatusError as e:
+                error = build_upstream_error(e.status_code, e.response.headers, e.response.content)
+            except openai.APIError as e:
+                error = e
+            logger.warning(
+                f"Embedding batch failed with API key {api_key}: {str(error)}. Attempt {attempt} of {max_retries}"
+            )
+            if key_manager is None:
+                raise error
+            new_key = await key_manager.handle_api_failure(api_key, error=error, model=model)
+            # 请求本身有误时换密钥重试没有意义
+            if attempt == max_retries or (isinstance(error, UpstreamError) and error.is_client_error):
+                raise error
+            api_key = new_key
 
     async def create_embedding(
-        self, input_text: Union[str, List[str]], model: str, api_key: str
+        self,
+        input_text: Union[str, List[str]],
+        model: str,
+        api_key: str,
+        key_manager: Optional[KeyManager] = None,
     ) -> CreateEmbeddingResponse:
-        """Create embeddings using OpenAI API"""
-        try:
-            client = openai.OpenAI(api_key=api_key, base_url=self.base_url)
-            response = client.embeddings.create(input=input_text, model=model)
+        """Create embeddings using OpenAI API
+
+        启用缓存时先按文本查找缓存，只把未命中的文本（去重后）发往上游，再按原始顺序组装结果。
+        """
+        if self.cache is None:
+            return await self._create_embedding(input_text, model, api_key, key_manager)
+
+        texts = [input_text] if isinstance(input_text, str) else list(input_text)
+        keys = [cache_key(model, text) for text in texts]
+        vectors: List[Optional[array]] = [self.cache.get(key) for key in keys]
+        missing: Dict[bytes, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if not missing:
+            logger.info(f"Embedding cache served all {len(texts)} inputs")
+            return self._build_response(vectors, model, None)
+
+        response = await self._create_embedding(list(missing.values()), model, api_key, key_manager)
+        items = sorted(response.data, key=lambda embedding: embedding.index)
+        fresh = {key: array("f", item.embedding) for key, item in zip(missing, items)}
+        await self.cache.put_many(list(fresh.items()))
+        if len(missing) == len(texts):
+            # 全部未命中且没有重复文本时直接返回上游响应
             return response
+        logger.info(f"Embedding cache hit {len(texts) - len(missing)} of {len(texts)} inputs")
+        vectors = [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
+        return self._build_response(vectors, response.model or model, response.usage)
+
+    @staticmethod
+    def _build_response(
+        vectors: List[array], model: str, usage: Optional[Usage]
+    ) -> CreateEmbeddingResponse:
+        return CreateEmbeddingResponse(
+            data=[
+                Embedding(embedding=vector.tolist(), index=index, object="embedding")
+                for index, vector in enumerate(vectors)
+            ],
+            model=model,
+            object="list",
+            usage=usage or Usage(prompt_tokens=0, total_tokens=0),
+        )
+
+    async def _create_embedding(
+        self,
+        input_text: Union[str, List[str]],
+        model: str,
+        api_key: str,
+        key_manager: Optional[KeyManager],
+    ) -> CreateEmbeddingResponse:
+        """列表输入按 EMBEDDING_BATCH_SIZE 切分，各批次从密钥管理器取不同的密钥并发请求，
+        结果按原始顺序合并；首个批次使用传入的 api_key。
+        """
+        try:
+            if isinstance(input_text, str) or len(input_text) <= settings.EMBEDDING_BATCH_SIZE:
+                return await self._embed_batch(input_text, model, api_key, key_manager)
+
+            batches = split_batches(input_text, settings.EMBEDDING_BATCH_SIZE)
+            semaphore = asyncio.Semaphore(max(1, settings.EMBEDDING_CONCURRENCY))
+
+            async def run_batch(index: int, batch: List[str]) -> CreateEmbeddingResponse:
+                async with semaphore:
+                    key = api_key
+                    if index > 0 and key_manager is not None:
+                        key = await key_manager.get_next_working_key(model)
+                    return await self._embed_batch(batch, model, key, key_manager)
+
+            logger.info(f"Splitting {len(input_text)} inputs into {len(batches)} embedding batches")
+            responses = await asyncio.gather(
+                *[run_batch(index, batch) for index, (_, batch) in enumerate(batches)]
+            )
+            return self._merge(responses, [start for start, _ in batches], model)
         except Exception as e:
             logger.error(f"Error creating embedding: {str(e)}")
             raise
+
+    @staticmethod
+    def _merge(
+        responses: List[CreateEmbeddingResponse], offsets: List[int], model: str
+    ) -> CreateEmbeddingResponse:
+        """按批次起始下标重排各批次结果并累加用量"""
+        data: List[Embedding] = []
+        prompt_tokens = total_tokens = 0
+        for response, offset in zip(responses, offsets):
+            for item in sorted(response.data, key=lambda embedding: embedding.index):
+                data.append(item.model_copy(update={"index": offset + item.index}))
+            if response.usage is not None:
+                prompt_tokens += response.usage.prompt_tokens or 0
+                total_tokens += response.usage.total_tokens or 0
+        return CreateEmbeddingResponse(
+            data=data,
+            model=responses[0].model or model,
+            object="list",
+            usage=Usage(prompt_tokens=prompt_tokens, total_tokens=total_tokens),
+        )
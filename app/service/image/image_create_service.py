@@ -10,7 +10,8 @@ from app.config.config import settings
 from app.core.constants import VALID_IMAGE_RATIOS
 from app.domain.openai_models import ImageGenerationRequest
 from app.log.logger import get_image_create_logger
-from app.utils.uploader import ImageUploaderFactory
+from app.utils.uploader import upload_images
+from app.service.image.image_limiter import image_generation_limiter
 from app.service.key.key_manager import get_key_manager_instance
 
 logger = get_image_create_logger()
@@ -24,15 +25,11 @@ class ImageCreateService:
     async def get_paid_key(self, request_id=None):
         """從鍵管理器獲取付費鍵"""
         key_manager = await get_key_manager_instance()
-<<<<<<< HEAD
-        paid_key = await key_manager.get_paid_key()
+        paid_key = await key_manager.get_paid_key(request_id=request_id)
         if paid_key:
             # 增加調用計數
             await key_manager.increment_paid_key_usage(paid_key)
         return paid_key
-=======
-        return await key_manager.get_paid_key(request_id=request_id)
->>>>>>> e037c4c27fccf4abbe91c3a32b3af5094eade273
 
     def parse_prompt_parameters(self, prompt: str) -> tuple:
         """从prompt中解析参数
@@ -103,63 +100,52 @@ class ImageCreateService:
             self.aspect_ratio = prompt_ratio
 
         try:
-            response = client.models.generate_images(
-                model=self.image_model,
-                prompt=request.prompt,
-                config=types.GenerateImagesConfig(
-                    number_of_images=request.n,
-                    output_mime_type="image/png",
-                    aspect_ratio=self.aspect_ratio,
-                    safety_filter_level="BLOCK_LOW_AND_ABOVE",
-                    person_generation="ALLOW_ADULT",
-                    # language="auto"
-                ),
-            )
+            # 使用 SDK 的异步接口，生成期间不阻塞事件循环；并发数与排队长度由限流器控制
+            async with image_generation_limiter.slot(paid_key):
+                try:
+                    response = await client.aio.models.generate_images(
+                        model=self.image_model,
+                        prompt=request.prompt,
+                        config=types.GenerateImagesConfig(
+                            number_of_images=request.n,
+                            output_mime_type="image/png",
+                            aspect_ratio=self.aspect_ratio,
+                            safety_filter_level="BLOCK_LOW_AND_ABOVE",
+                            person_generation="ALLOW_ADULT",
+                            # language="auto"
+                        ),
+                    )
+                finally:
+                    await client.aio.aclose()
 
             if response.generated_images:
-                images_data = []
-                for index, generated_image in enumerate(response.generated_images):
-                    image_data = generated_image.image.image_bytes
-                    image_uploader = None
-
-                    if request.response_format == "b64_json":
-                        base64_image = base64.b64encode(image_data).decode("utf-8")
-                        images_data.append(
-                            {"b64_json": base64_image, "revised_prompt": request.prompt}
-                        )
-                    else:
-                        current_date = time.strftime("%Y/%m/%d")
-                        filename = f"{current_date}/{uuid.uuid4().hex[:8]}.png"
-
-                        if settings.UPLOAD_PROVIDER == "smms":
-                            image_uploader = ImageUploaderFactory.create(
-                                provider=settings.UPLOAD_PROVIDER,
-                                api_key=settings.SMMS_SECRET_TOKEN,
-                            )
-                        elif settings.UPLOAD_PROVIDER == "picgo":
-                            image_uploader = ImageUploaderFactory.create(
-                                provider=settings.UPLOAD_PROVIDER,
-                                api_key=settings.PICGO_API_KEY,
-                            )
-                        elif settings.UPLOAD_PROVIDER == "cloudflare_imgbed":
-                            image_uploader = ImageUploaderFactory.create(
-                                provider=settings.UPLOAD_PROVIDER,
-                                base_url=settings.CLOUDFLARE_IMGBED_URL,
-                                auth_code=settings.CLOUDFLARE_IMGBED_AUTH_CODE,
-                            )
-                        else:
-                            raise ValueError(
-                                f"Unsupported upload provider: {settings.UPLOAD_PROVIDER}"
-                            )
-
-                        upload_response = image_uploader.upload(image_data, filename)
-
-                        images_data.append(
-                            {
-                                "url": f"{upload_response.data.url}",
-                                "revised_prompt": request.prompt,
-                            }
-                        )
+                images = [
+                    generated_image.image.image_bytes
+                    for generated_image in response.generated_images
+                ]
+                if request.response_format == "b64_json":
+                    images_data = [
+                        {
+                            "b64_json": base64.b64encode(image_data).decode("utf-8"),
+                            "revised_prompt": request.prompt,
+                        }
+                        for image_data in images
+                    ]
+                else:
+                    current_date = time.strftime("%Y/%m/%d")
+                    files = [
+                        (image_data, f"{current_date}/{uuid.uuid4().hex[:8]}.png")
+                        for image_data in images
+                    ]
+                    # 所有图片并发上传，耗时约等于一次上传
+                    upload_responses = await upload_images(files)
+                    images_data = [
+                        {
+                            "url": f"{upload_response.data.url}",
+                            "revised_prompt": request.prompt,
+                        }
+                        for upload_response in upload_responses
+                    ]
 
                 response_data = {
                     "created": int(time.time()),  # Current timestamp
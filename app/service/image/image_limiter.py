@@ -0,0 +1,184 @@
+"""
+图片生成并发控制模块
+
+Imagen 单次调用通常需要 5~15 秒，这里限制同时进行的生成数（全局与每个付费密钥），
+超出的请求按到达顺序排队；队列已满或排队超时时返回 503 并通过 Retry-After
+告知客户端稍后重试，避免请求无限堆积。同时统计排队等待时间。
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+from app.config.config import settings
+from app.exception.exceptions import ServiceUnavailableError
+from app.log.logger import get_image_create_logger
+from app.utils.latency import LatencyWindow
+
+logger = get_image_create_logger()
+
+
+class _Waiter:
+    __slots__ = ("api_key", "future")
+
+    def __init__(self, api_key: str, future: asyncio.Future):
+        self.api_key = api_key
+        self.future = future
+
+
+class ImageGenerationLimiter:
+    """图片生成的并发上限、有界等待队列与排队时间统计
+
+    Args:
+        max_concurrency: 全局同时进行的图片生成数
+        per_key_concurrency: 每个付费密钥同时进行的图片生成数
+        max_queue: 最多排队等待的请求数，超出时直接拒绝
+        queue_timeout: 单个请求最长排队时间（秒），超时后拒绝
+        window: 计算排队时间分位数所保留的样本数
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_key_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        window: int = 200,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_key_concurrency = max(1, per_key_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._key_active: Dict[str, int] = {}
+        self._waiters: Deque[_Waiter] = deque()
+        self._wait_times = LatencyWindow(window)
+        self._service_time = 0.0
+        self.total_requests = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _can_run(self, api_key: str) -> bool:
+        return (
+            self.active < self.max_concurrency
+            and self._key_active.get(api_key, 0) < self.per_key_concurrency
+        )
+
+    def _grant(self, api_key: str) -> None:
+        self.active += 1
+        self._key_active[api_key] = self._key_active.get(api_key, 0) + 1
+
+    def _release(self, api_key: str) -> None:
+        self.active -= 1
+        remaining = self._key_active.get(api_key, 0) - 1
+        if remaining > 0:
+            self._key_active[api_key] = remaining
+        else:
+            self._key_active.pop(api_key, None)
+        self._wake()
+
+    def _wake(self) -> None:
+        """按到达顺序放行可以运行的等待者；密钥已满的等待者不阻塞其他密钥"""
+        for waiter in list(self._waiters):
+            if self.active >= self.max_concurrency:
+                break
+            if waiter.future.done() or not self._can_run(waiter.api_key):
+                continue
+            self._waiters.remove(waiter)
+            self._grant(waiter.api_key)
+            waiter.future.set_result(None)
+
+    def retry_after(self) -> int:
+        """按平均生成耗时与当前排队长度估算的重试等待秒数"""
+        service_time = self._service_time or 10.0
+        rounds = (self.queue_depth + self.max_concurrency) / self.max_concurrency
+        return max(1, math.ceil(service_time * rounds))
+
+    def _reject(self, reason: str) -> ServiceUnavailableError:
+        self.rejected += 1
+        retry_after = self.retry_after()
+        logger.warning(f"Image generation rejected: {reason}, retry after {retry_after}s")
+        return ServiceUnavailableError(
+            f"Image generation is busy ({reason}), please retry later",
+            retry_after=retry_after,
+        )
+
+    async def _acquire(self, api_key: str) -> None:
+        # 仍在排队的请求都是被全局或其密钥的上限挡住的，能运行时不会越过同一密钥的请求
+        if self._can_run(api_key):
+            self._grant(api_key)
+            return
+        if self.queue_depth >= self.max_queue:
+            raise self._reject("queue is full")
+        waiter = _Waiter(api_key, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已被放行但调用方随即超时或断开，归还名额
+                self._release(api_key)
+            else:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(f"queued for more than {self.queue_timeout}s") from None
+            raise
+
+    def _record_wait(self, wait: float) -> None:
+        self.total_requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._wait_times.add(wait)
+
+    def _record_service_time(self, elapsed: float) -> None:
+        if self._service_time:
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        else:
+            self._service_time = elapsed
+
+    @asynccontextmanager
+    async def slot(self, api_key: str) -> AsyncIterator[None]:
+        """获取一个生成名额，无法在限定时间内获得时抛出 ServiceUnavailableError"""
+        start = time.monotonic()
+        await self._acquire(api_key)
+        wait = time.monotonic() - start
+        self._record_wait(wait)
+        if wait >= 1.0:
+            logger.info(f"Image generation waited {wait:.2f}s in queue")
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_service_time(time.monotonic() - start)
+            self._release(api_key)
+
+    def stats(self) -> Dict[str, float]:
+        """当前并发、排队情况与排队时间统计"""
+        has_samples = bool(self._wait_times.samples)
+        return {
+            "active": self.active,
+            "queue_depth": self.queue_depth,
+            "total_requests": self.total_requests,
+            "rejected": self.rejected,
+            "avg_wait_seconds": round(self.total_wait / self.total_requests, 3)
+            if self.total_requests
+            else 0.0,
+            "p95_wait_seconds": round(self._wait_times.percentile(95), 3) if has_samples else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+        }
+
+
+# 默认的图片生成限流器实例，所有图片生成请求共享
+image_generation_limiter = ImageGenerationLimiter(
+    max_concurrency=settings.IMAGE_GEN_MAX_CONCURRENCY,
+    per_key_concurrency=settings.IMAGE_GEN_PER_KEY_CONCURRENCY,
+    max_queue=settings.IMAGE_GEN_MAX_QUEUE,
+    queue_timeout=settings.IMAGE_GEN_QUEUE_TIMEOUT,
+)
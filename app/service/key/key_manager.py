@@ -1,21 +1,60 @@
 import asyncio
-from itertools import cycle
-from typing import Dict, List
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
 
 from app.config.config import settings
+from app.core.metrics import record_upstream, stage_timer
+from app.exception.exceptions import UpstreamError
 from app.log.logger import get_key_manager_logger
+from app.service.key.key_scheduler import KeyScheduler, KeyUsage
+from app.service.key.rate_limiter import RateLimiter
+from app.service.key.state_backend import create_state_backend
+from app.service.key.state_sync import KeyStateSync
 
 logger = get_key_manager_logger()
 
 
+def _normalize_model(model: Optional[str]) -> Optional[str]:
+    """去掉搜索/绘图模型的后缀，配额按上游真实模型计算"""
+    if not model:
+        return None
+    if model.endswith("-search"):
+        model = model[:-7]
+    if model.endswith("-image"):
+        model = model[:-6]
+    return model
+
+
 class KeyManager:
     def __init__(self, api_keys: list):
         self.api_keys = api_keys
-        self.key_cycle = cycle(api_keys)
-        self.key_cycle_lock = asyncio.Lock()
         self.failure_count_lock = asyncio.Lock()
-        self.key_failure_counts: Dict[str, int] = {key: 0 for key in api_keys}
         self.MAX_FAILURES = settings.MAX_FAILURES
+        # 按健康度调度普通密钥，取代原来的 cycle 轮询
+        self.scheduler = KeyScheduler(
+            api_keys,
+            max_failures=self.MAX_FAILURES,
+            alpha=settings.KEY_EWMA_ALPHA,
+            cooldown_base=settings.KEY_COOLDOWN_BASE,
+            cooldown_max=settings.KEY_COOLDOWN_MAX,
+            limiter=RateLimiter(
+                rpm=settings.KEY_RPM_LIMIT,
+                tpm=settings.KEY_TPM_LIMIT,
+                model_limits=settings.MODEL_RATE_LIMITS,
+            ),
+        )
+        self.rate_limit_cooldown = settings.RATE_LIMIT_COOLDOWN
+        # 多进程/多副本部署时通过共享后端同步失败次数、冷却期、付费密钥用量与轮询位置
+        backend = create_state_backend(
+            settings.KEY_STATE_BACKEND,
+            sqlite_path=settings.KEY_STATE_SQLITE_PATH,
+            redis_url=settings.KEY_STATE_REDIS_URL,
+        )
+        self.state_sync: Optional[KeyStateSync] = (
+            KeyStateSync(backend, self.scheduler, settings.KEY_STATE_FLUSH_INTERVAL)
+            if backend.shared
+            else None
+        )
         self.paid_key = settings.PAID_KEY
         
         # 使用索引而不是循環器來實現順序輪詢
@@ -31,15 +70,12 @@ class KeyManager:
             self.paid_key_index = -1
             self.paid_key_lock = None
             self.paid_key_failure_counts = {}
-<<<<<<< HEAD
             self.paid_key_usage_counts = {}
             if isinstance(self.paid_key, str) and self.paid_key:
                 self.paid_key_usage_counts[self.paid_key] = 0
-=======
-        
+
         # 為了確保同一個請求使用同一個密鑰，使用字典記錄已分配的密鑰
         self.request_key_map = {}
->>>>>>> e037c4c27fccf4abbe91c3a32b3af5094eade273
 
     async def get_paid_key(self, request_id=None) -> str:
         """
@@ -48,13 +84,6 @@ class KeyManager:
         Args:
             request_id: 可選的請求 ID，用於確保同一請求獲取相同的密鑰
         """
-<<<<<<< HEAD
-        selected_key = ""
-        # 如果付費鍵是列表並且有設置輪詢器，則使用輪詢方式獲取
-        if self.paid_key_cycle is not None:
-            async with self.paid_key_cycle_lock:
-                selected_key = next(self.paid_key_cycle)
-=======
         # 如果提供了請求 ID 且已經為該請求分配了密鑰，則返回之前分配的密鑰
         if request_id and request_id in self.request_key_map:
             key = self.request_key_map[request_id]
@@ -71,6 +100,13 @@ class KeyManager:
                         self.request_key_map[request_id] = key
                     return key
                 
+                if self.state_sync is not None:
+                    # 從共享後端預留的區間中取輪詢位置，多個進程共同按順序輪詢
+                    try:
+                        self.paid_key_index = await self.state_sync.next_rotation("paid_key") % len(self.paid_key)
+                    except Exception as e:
+                        # 共享後端不可用時沿用本地輪詢位置，不影響請求
+                        logger.warning(f"Failed to reserve shared paid key rotation, using local index: {str(e)}")
                 # 獲取當前索引對應的密鑰
                 key = self.paid_key[self.paid_key_index]
                 # 更新索引，到達列表尾部時重置為0
@@ -82,16 +118,12 @@ class KeyManager:
                     
                 logger.info(f"使用付費密鑰: {key}，下一個索引位置: {self.paid_key_index}")
                 return key
->>>>>>> e037c4c27fccf4abbe91c3a32b3af5094eade273
         # 兼容原來的字符串類型
         elif isinstance(self.paid_key, str):
-            selected_key = self.paid_key
+            return self.paid_key
         # 如果付費鍵是空列表，返回空字符串
         else:
             return ""
-            
-<<<<<<< HEAD
-        return selected_key
 
     async def increment_paid_key_usage(self, key: str) -> None:
         """
@@ -106,6 +138,8 @@ class KeyManager:
             else:
                 # 如果是第一次使用這個密鑰，初始化計數器
                 self.paid_key_usage_counts[key] = 1
+            if self.state_sync is not None:
+                self.state_sync.record_usage(key)
                 
         logger.info(f"Paid key {key} usage count: {self.paid_key_usage_counts.get(key, 0)}")
 
@@ -113,77 +147,158 @@ class KeyManager:
         """
         獲取所有付費密鑰的使用統計
         """
+        if self.state_sync is not None:
+            # 共享後端中記錄的是所有進程的累計用量
+            shared = await self.state_sync.get_paid_keys_usage()
+            return {key: shared.get(key, 0) for key in self.paid_key_usage_counts} | shared
         async with self.failure_count_lock:
             # 返回一個副本以避免並發修改問題
             return dict(self.paid_key_usage_counts)
-=======
+
     def release_paid_key(self, request_id):
         """釋放與請求相關聯的付費密鑰"""
         if request_id in self.request_key_map:
             del self.request_key_map[request_id]
             logger.info(f"釋放請求 {request_id} 的付費密鑰")
->>>>>>> e037c4c27fccf4abbe91c3a32b3af5094eade273
+
+    @property
+    def key_failure_counts(self) -> Dict[str, int]:
+        """各密钥的连续失败次数"""
+        return {key: stats.failures for key, stats in self.scheduler.stats.items()}
 
     async def get_next_key(self) -> str:
         """获取下一个API key"""
-        async with self.key_cycle_lock:
-            return next(self.key_cycle)
+        return self.scheduler.acquire()
 
     async def is_key_valid(self, key: str) -> bool:
-        """检查key是否有效"""
-        async with self.failure_count_lock:
-            return self.key_failure_counts[key] < self.MAX_FAILURES
+        """检查key是否有效（未被禁用且不在冷却期）"""
+        return self.scheduler.is_available(key)
 
     async def reset_failure_counts(self):
         """重置所有key的失败计数"""
-        async with self.failure_count_lock:
-            for key in self.key_failure_counts:
-                self.key_failure_counts[key] = 0
+        self.scheduler.reset()
 
-    async def get_next_working_key(self) -> str:
-        """获取下一可用的API key"""
-        initial_key = await self.get_next_key()
-        current_key = initial_key
+    async def get_next_working_key(self, model: Optional[str] = None) -> str:
+        """获取下一可用的API key
 
-        while True:
-            if await self.is_key_valid(current_key):
-                return current_key
+        调度器直接从可用密钥堆中选出健康度最高的密钥，跳过冷却中或配额耗尽的密钥；
+        指定 model 时同时考虑该模型上的配额与冷却期。
+        没有可用密钥时返回最早恢复的密钥。
+        """
+        model = _normalize_model(model)
+        with stage_timer("key_acquire", model):
+            return self.scheduler.acquire(model)
 
-            current_key = await self.get_next_key()
-            if current_key == initial_key:
-                # await self.reset_failure_counts() 取消重置
-                return current_key
+    @contextmanager
+    def track(self, api_key: str, model: Optional[str] = None) -> Iterator[KeyUsage]:
+        """跟踪一次上游调用的在途数、延迟与token用量，用法: with key_manager.track(api_key, model) as usage: ...
 
-    async def handle_api_failure(self, api_key: str) -> str:
-        """处理API调用失败"""
-        async with self.failure_count_lock:
-            self.key_failure_counts[api_key] += 1
-            if self.key_failure_counts[api_key] >= self.MAX_FAILURES:
-                logger.warning(
-                    f"API key {api_key} has failed {self.MAX_FAILURES} times"
-                )
+        正常退出时记录成功指标，失败由 handle_api_failure 记录。
+        """
+        model = _normalize_model(model)
+        with self.scheduler.track(api_key, model) as usage:
+            yield usage
+        record_upstream(model, api_key, "success", usage.latency if usage.latency is not None else usage.elapsed())
+
+    async def handle_api_failure(
+        self,
+        api_key: str,
+        error: Optional[Exception] = None,
+        model: Optional[str] = None,
+    ) -> str:
+        """处理API调用失败
+
+        根据上游错误分类处理：
+        - 429: 按 Retry-After / RetryInfo 冷却密钥，配额按模型计算时只在该模型上冷却，不计入失败次数
+        - 密钥无效/无权限: 直接禁用密钥
+        - 其它客户端错误: 请求本身有误，不影响密钥状态
+        - 其它错误: 计入连续失败次数并按指数退避冷却
+        """
+        model = _normalize_model(model)
+        record_upstream(model, api_key, str(error.status_code) if isinstance(error, UpstreamError) else "error")
+        if isinstance(error, UpstreamError):
+            if error.is_rate_limited:
+                self.cooldown_rate_limited(api_key, error, model)
+                return await self.get_next_working_key(model)
+            if error.is_key_error:
+                self.scheduler.disable(api_key)
+                logger.warning(f"API key {api_key} is invalid ({error.reason or error.status_code}), disabled")
+                return await self.get_next_working_key(model)
+            if error.is_client_error:
+                return api_key
+
+        failures = self.scheduler.record_failure(api_key)
+        if failures >= self.MAX_FAILURES:
+            logger.warning(
+                f"API key {api_key} has failed {self.MAX_FAILURES} times"
+            )
+
+        return await self.get_next_working_key(model)
+
+    def cooldown_rate_limited(self, api_key: str, error: UpstreamError, model: Optional[str] = None) -> None:
+        """按 Retry-After / RetryInfo 冷却被限流的密钥，配额按模型计算时只在该模型上冷却
+
+        只更新该密钥的状态，不选取下一个密钥。
+        """
+        model = _normalize_model(model)
+        cooldown = error.retry_after if error.retry_after is not None else self.rate_limit_cooldown
+        quota_model = error.quota_model or model
+        per_model = error.quota_model or (error.quota_id and "PerModel" in error.quota_id)
+        if per_model and quota_model:
+            self.scheduler.cooldown_model(api_key, quota_model, cooldown)
+            logger.warning(f"API key {api_key} rate limited on model {quota_model}, cooling down for {cooldown:.1f}s")
+        else:
+            self.scheduler.cooldown(api_key, cooldown)
+            logger.warning(f"API key {api_key} rate limited, cooling down for {cooldown:.1f}s")
 
-        return await self.get_next_working_key()
+    def decay_failure_counts(self) -> int:
+        """按时间衰减未禁用密钥的失败次数，返回受影响的密钥数"""
+        return self.scheduler.decay()
+
+    def get_disabled_keys(self) -> List[str]:
+        """获取因失败次数过多而被禁用的密钥"""
+        return self.scheduler.disabled_keys()
+
+    def restore_key(self, api_key: str) -> None:
+        """恢复密钥：清零失败次数、冷却期与限流状态"""
+        self.scheduler.reset(api_key)
+        logger.info(f"API key {api_key} restored")
 
     def get_fail_count(self, key: str) -> int:
         """获取指定密钥的失败次数"""
-        return self.key_failure_counts.get(key, 0)
+        stats = self.scheduler.stats.get(key)
+        return stats.failures if stats else 0
 
     async def get_keys_by_status(self) -> dict:
         """获取分类后的API key列表，包括失败次数"""
+        if self.state_sync is not None:
+            await self.state_sync.sync()
         valid_keys = {}
         invalid_keys = {}
 
-        async with self.failure_count_lock:
-            for key in self.api_keys:
-                fail_count = self.key_failure_counts[key]
-                if fail_count < self.MAX_FAILURES:
-                    valid_keys[key] = fail_count
-                else:
-                    invalid_keys[key] = fail_count
+        for key in self.api_keys:
+            fail_count = self.get_fail_count(key)
+            if fail_count < self.MAX_FAILURES:
+                valid_keys[key] = fail_count
+            else:
+                invalid_keys[key] = fail_count
 
         return {"valid_keys": valid_keys, "invalid_keys": invalid_keys}
 
+    async def start_state_sync(self) -> None:
+        """加载共享的密钥状态并启动后台同步"""
+        if self.state_sync is not None:
+            await self.state_sync.start()
+
+    async def stop_state_sync(self) -> None:
+        """停止后台同步并写出尚未同步的状态"""
+        if self.state_sync is not None:
+            await self.state_sync.stop()
+
+    def get_key_stats(self) -> Dict[str, dict]:
+        """获取各密钥的调度统计（成功率、延迟、在途数、冷却剩余时间）"""
+        return {key: stats.to_dict() for key, stats in self.scheduler.stats.items()}
+
 
 _singleton_instance = None
 _singleton_lock = asyncio.Lock()
@@ -0,0 +1,102 @@
+# app/service/key/key_recovery.py
+
+import asyncio
+from typing import Dict, Optional
+
+from app.config.config import settings
+from app.exception.exceptions import UpstreamError
+from app.log.logger import get_key_recovery_logger
+from app.service.chat.gemini_chat_service import GeminiChatService
+from app.service.key.key_manager import KeyManager
+
+logger = get_key_recovery_logger()
+
+_recovery_task: Optional[asyncio.Task] = None
+
+
+class KeyRecovery:
+    """密钥自动恢复
+
+    周期性地衰减未禁用密钥的失败次数，并以有限并发探测被禁用的密钥，
+    探测成功的密钥自动回到调度池，无需重启或人工重置。
+    """
+
+    def __init__(self, key_manager: KeyManager, interval: float, concurrency: int):
+        self.key_manager = key_manager
+        self.interval = interval
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.chat_service = GeminiChatService(settings.BASE_URL, key_manager)
+
+    async def _probe(self, api_key: str) -> bool:
+        async with self.semaphore:
+            try:
+                await self.chat_service.verify_key(api_key)
+            except UpstreamError as e:
+                if e.is_rate_limited:
+                    # 密钥本身可用，只是暂时限流：恢复后按 429 规则冷却该密钥，
+                    # 不经过 handle_api_failure，避免选取下一个密钥而消耗其他密钥的配额
+                    self.key_manager.restore_key(api_key)
+                    self.key_manager.cooldown_rate_limited(api_key, e, model=settings.TEST_MODEL)
+                    return True
+                logger.info(f"API key {api_key} is still unavailable: {e.status_code}")
+                return False
+            except Exception as e:
+                logger.info(f"API key {api_key} probe failed: {str(e)}")
+                return False
+        self.key_manager.restore_key(api_key)
+        return True
+
+    async def run_once(self) -> Dict[str, int]:
+        """执行一轮失败衰减与恢复探测"""
+        decayed = self.key_manager.decay_failure_counts()
+        disabled = self.key_manager.get_disabled_keys()
+        restored = 0
+        if disabled:
+            results = await asyncio.gather(*(self._probe(key) for key in disabled))
+            restored = sum(results)
+        if decayed or disabled:
+            logger.info(
+                f"Key recovery round: decayed={decayed}, probed={len(disabled)}, restored={restored}"
+            )
+        return {"decayed": decayed, "probed": len(disabled), "restored": restored}
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Key recovery round failed: {str(e)}")
+
+
+async def start_key_recovery(key_manager: KeyManager) -> Optional[asyncio.Task]:
+    """在应用启动时创建后台恢复任务"""
+    global _recovery_task
+    if not settings.KEY_RECOVERY_ENABLED:
+        logger.info("Key recovery is disabled")
+        return None
+    if _recovery_task is None or _recovery_task.done():
+        recovery = KeyRecovery(
+            key_manager,
+            interval=settings.KEY_RECOVERY_INTERVAL,
+            concurrency=settings.KEY_RECOVERY_CONCURRENCY,
+        )
+        _recovery_task = asyncio.create_task(recovery.run())
+        logger.info(
+            f"Key recovery started (interval={settings.KEY_RECOVERY_INTERVAL}s, "
+            f"concurrency={settings.KEY_RECOVERY_CONCURRENCY})"
+        )
+    return _recovery_task
+
+
+async def stop_key_recovery() -> None:
+    """在应用关闭时取消后台恢复任务"""
+    global _recovery_task
+    if _recovery_task is not None:
+        _recovery_task.cancel()
+        try:
+            await _recovery_task
+        except asyncio.CancelledError:
+            pass
+        _recovery_task = None
+        logger.info("Key recovery stopped")
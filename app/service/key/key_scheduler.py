@@ -0,0 +1,396 @@
+"""
+API密钥调度模块
+
+按健康度为每个密钥打分并通过小顶堆选出最优密钥：
+- 成功率、延迟采用指数加权移动平均（EWMA），近期表现权重更高
+- 记录每个密钥的在途请求数，优先选择负载更低的密钥
+- 失败后进入按连续失败次数指数增长的冷却期，冷却结束自动回到可选集合
+- 连续失败达到 MAX_FAILURES 的密钥被禁用，不参与调度
+- 可选的 RateLimiter 提供 RPM/TPM 令牌桶与按模型的冷却期，耗尽配额的密钥在请求前就被跳过
+
+所有操作都是同步的，在单个事件循环中天然串行执行，热路径上无需加锁。
+堆采用惰性删除：密钥状态变化时压入新条目并递增版本号，弹出时丢弃过期条目。
+"""
+import heapq
+import itertools
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.service.key.rate_limiter import RateLimiter
+
+# 尚无延迟样本时使用的先验延迟（秒）
+LATENCY_PRIOR = 1.0
+# 打分的最小单位（秒），开销低于该值的密钥视为同一档
+COST_UNIT = 0.1
+# 分档的对数底：开销相差不足该倍数的密钥大多落在同一档，避免延迟抖动把流量集中到个别密钥
+COST_BUCKET_BASE = 4
+# 成功率下限，避免打分时除零
+MIN_SUCCESS_RATE = 0.05
+
+
+class KeyStats:
+    """单个密钥的运行时统计"""
+
+    __slots__ = (
+        "key",
+        "success_rate",
+        "latency",
+        "in_flight",
+        "failures",
+        "cooldown_until",
+        "last_used",
+        "version",
+    )
+
+    def __init__(self, key: str):
+        self.key = key
+        self.success_rate = 1.0
+        self.latency: Optional[float] = None
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.last_used = 0
+        self.version = 0
+
+    def cost(self) -> float:
+        """预期完成一次成功请求的开销：延迟 × (在途数 + 1) / 成功率"""
+        latency = self.latency if self.latency is not None else LATENCY_PRIOR
+        return latency * (self.in_flight + 1) / max(self.success_rate, MIN_SUCCESS_RATE)
+
+    def bucket(self) -> int:
+        """按开销的对数分档，同一档内的密钥按最近最少使用顺序轮询"""
+        cost = self.cost()
+        if cost <= COST_UNIT:
+            return 0
+        return int(math.log(cost / COST_UNIT, COST_BUCKET_BASE))
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "success_rate": round(self.success_rate, 4),
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "in_flight": self.in_flight,
+            "failures": self.failures,
+            "cooldown_remaining": round(max(self.cooldown_until - time.monotonic(), 0.0), 3),
+        }
+
+
+class KeyScheduler:
+    """基于健康度打分的密钥调度器，选择操作为 O(log n)"""
+
+    def __init__(
+        self,
+        keys: List[str],
+        max_failures: int,
+        alpha: float = 0.3,
+        cooldown_base: float = 1.0,
+        cooldown_max: float = 60.0,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.max_failures = max_failures
+        self.limiter = limiter
+        self.alpha = alpha
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self.stats: Dict[str, KeyStats] = {key: KeyStats(key) for key in keys}
+        # 可选密钥堆: (分档, 最近使用序号, 密钥, 版本)
+        self._ready: List[Tuple[int, int, str, int]] = []
+        # 冷却中密钥堆: (冷却截止时间, 密钥, 版本)
+        self._cooling: List[Tuple[float, str, int]] = []
+        self._sequence = itertools.count(1)
+        # 失败次数或冷却期变化时的回调: listener(key, delta)，delta 为 None 表示写入绝对值
+        self.listener: Optional[Callable[[str, Optional[int]], None]] = None
+        for stats in self.stats.values():
+            self._push(stats)
+
+    def _notify(self, key: str, delta: Optional[int]) -> None:
+        if self.listener is not None:
+            self.listener(key, delta)
+
+    def _push(self, stats: KeyStats, now: Optional[float] = None) -> None:
+        """密钥状态变化后重新入堆，旧条目随版本号失效"""
+        stats.version += 1
+        if stats.failures >= self.max_failures:
+            return
+        if now is None:
+            now = time.monotonic()
+        if stats.cooldown_until > now:
+            heapq.heappush(self._cooling, (stats.cooldown_until, stats.key, stats.version))
+        else:
+            heapq.heappush(
+                self._ready, (stats.bucket(), stats.last_used, stats.key, stats.version)
+            )
+        # 过期条目过多时整体重建，保证堆大小与密钥数同阶
+        if len(self._ready) + len(self._cooling) > 4 * len(self.stats) + 64:
+            self._rebuild(now)
+
+    def _rebuild(self, now: float) -> None:
+        # 原地替换，选择过程中持有的堆引用依然有效
+        ready = []
+        cooling = []
+        for stats in self.stats.values():
+            if stats.failures >= self.max_failures:
+                continue
+            if stats.cooldown_until > now:
+                cooling.append((stats.cooldown_until, stats.key, stats.version))
+            else:
+                ready.append((stats.bucket(), stats.last_used, stats.key, stats.version))
+        heapq.heapify(ready)
+        heapq.heapify(cooling)
+        self._ready[:] = ready
+        self._cooling[:] = cooling
+
+    def _promote_cooled(self, now: float) -> None:
+        """把冷却结束的密钥移回可选堆"""
+        cooling = self._cooling
+        while cooling and cooling[0][0] <= now:
+            _, key, version = heapq.heappop(cooling)
+            stats = self.stats[key]
+            if version == stats.version:
+                self._push(stats, now)
+
+    def acquire(self, model: Optional[str] = None) -> Optional[str]:
+        """选出当前最优的可用密钥
+
+        指定 model 时会跳过在该模型上冷却或配额耗尽的密钥；密钥级令牌桶耗尽时
+        直接把密钥转入冷却堆，等到令牌补足再回到可选集合。
+        没有可用密钥时退而求其次：优先返回最早可用的密钥，
+        全部被禁用时返回失败次数最少的密钥，保持与旧版轮询一致的“总有返回值”语义。
+        """
+        if not self.stats:
+            return None
+        now = time.monotonic()
+        self._promote_cooled(now)
+        ready = self._ready
+        limiter = self.limiter
+        # 只在当前模型上不可用的密钥暂时取出，选择结束后原样放回
+        skipped: List[Tuple[float, Tuple[int, int, str, int]]] = []
+        chosen = None
+        while ready:
+            entry = heapq.heappop(ready)
+            stats = self.stats[entry[2]]
+            if entry[3] != stats.version:
+                continue
+            if limiter is not None:
+                key_wait = limiter.key_wait(stats.key, now)
+                if key_wait > 0:
+                    # 令牌桶是进程内的，由此产生的冷却不同步到共享状态
+                    self.cooldown(stats.key, key_wait, notify=False)
+                    continue
+                model_wait = limiter.model_wait(stats.key, model, now)
+                if model_wait > 0:
+                    skipped.append((model_wait, entry))
+                    continue
+            chosen = stats
+            break
+        if chosen is None and skipped:
+            # 所有可选密钥都在该模型上受限时，选择最早恢复的那个
+            index = min(range(len(skipped)), key=lambda i: skipped[i][0])
+            chosen = self.stats[skipped.pop(index)[1][2]]
+        for _, entry in skipped:
+            heapq.heappush(ready, entry)
+        if chosen is None:
+            chosen = self._fallback(now)
+        else:
+            self._mark_used(chosen, now)
+        if limiter is not None:
+            limiter.consume_request(chosen.key, model, now)
+        return chosen.key
+
+    def _fallback(self, now: float) -> KeyStats:
+        cooling = self._cooling
+        while cooling:
+            _, key, version = cooling[0]
+            stats = self.stats[key]
+            if version == stats.version:
+                self._mark_used(stats, now)
+                return stats
+            heapq.heappop(cooling)
+        stats = min(self.stats.values(), key=lambda s: (s.failures, s.last_used))
+        stats.last_used = next(self._sequence)
+        return stats
+
+    def _mark_used(self, stats: KeyStats, now: float) -> None:
+        stats.last_used = next(self._sequence)
+        self._push(stats, now)
+
+    def is_available(self, key: str) -> bool:
+        """密钥未被禁用且不在冷却期内"""
+        stats = self.stats.get(key)
+        if stats is None:
+            return False
+        return stats.failures < self.max_failures and stats.cooldown_until <= time.monotonic()
+
+    def record_start(self, key: str) -> None:
+        stats = self.stats.get(key)
+        if stats is None:
+            return
+        stats.in_flight += 1
+        self._push(stats)
+
+    def record_release(self, key: str) -> None:
+        stats = self.stats.get(key)
+        if stats is None:
+            return
+        stats.in_flight = max(stats.in_flight - 1, 0)
+        self._push(stats)
+
+    def record_success(self, key: str, latency: float) -> None:
+        """记录一次成功调用，更新成功率与延迟的EWMA并清零连续失败次数
+
+        冷却期不因成功而提前结束：并发请求中较早发出的成功不代表密钥已从限流中恢复。
+        """
+        stats = self.stats.get(key)
+        if stats is None:
+            return
+        alpha = self.alpha
+        stats.success_rate += alpha * (1.0 - stats.success_rate)
+        if stats.latency is None:
+            stats.latency = latency
+        else:
+            stats.latency += alpha * (latency - stats.latency)
+        if stats.failures:
+            stats.failures = 0
+            self._notify(key, None)
+        self._push(stats)
+
+    def record_failure(self, key: str, cooldown: Optional[float] = None) -> int:
+        """记录一次失败调用，返回连续失败次数
+
+        未指定冷却时长时，按连续失败次数指数退避：cooldown_base * 2^(failures-1)，上限 cooldown_max。
+        """
+        stats = self.stats.get(key)
+        if stats is None:
+            return 0
+        stats.success_rate -= self.alpha * stats.success_rate
+        stats.failures += 1
+        if cooldown is None:
+            cooldown = min(self.cooldown_base * (2 ** (stats.failures - 1)), self.cooldown_max)
+        now = time.monotonic()
+        stats.cooldown_until = max(stats.cooldown_until, now + cooldown)
+        self._push(stats, now)
+        self._notify(key, 1)
+        return stats.failures
+
+    def cooldown(self, key: str, seconds: float, notify: bool = True) -> None:
+        """让密钥冷却指定时长，不计入失败次数"""
+        stats = self.stats.get(key)
+        if stats is None:
+            return
+        now = time.monotonic()
+        stats.cooldown_until = max(stats.cooldown_until, now + seconds)
+        self._push(stats, now)
+        if notify:
+            self._notify(key, 0)
+
+    def cooldown_model(self, key: str, model: str, seconds: float) -> None:
+        """让密钥只在指定模型上冷却，其它模型照常调度"""
+        if self.limiter is None:
+            self.cooldown(key, seconds)
+            return
+        self.limiter.block_model(key, model, seconds)
+
+    def disable(self, key: str) -> None:
+        """直接禁用密钥（如上游判定密钥无效）"""
+        stats = self.stats.get(key)
+        if stats is None:
+            return
+        stats.failures = max(stats.failures, self.max_failures)
+        self._push(stats)
+        self._notify(key, None)
+
+    def decay(self, amount: int = 1) -> int:
+        """把未被禁用的密钥的连续失败次数各减少 amount，返回受影响的密钥数
+
+        被禁用的密钥不参与衰减，需要通过恢复探测成功后重置。
+        """
+        decayed = 0
+        for stats in self.stats.values():
+            if 0 < stats.failures < self.max_failures:
+                stats.failures = max(stats.failures - amount, 0)
+                self._push(stats)
+                # 多个进程各自衰减同一份共享计数时按绝对值写入，避免重复扣减
+                self._notify(stats.key, None)
+                decayed += 1
+        return decayed
+
+    def disabled_keys(self) -> List[str]:
+        """连续失败次数达到上限而被禁用的密钥"""
+        return [key for key, stats in self.stats.items() if stats.failures >= self.max_failures]
+
+    def reset(self, key: Optional[str] = None) -> None:
+        """清零指定密钥（默认全部）的失败次数与冷却期"""
+        if key is None:
+            targets = list(self.stats.values())
+        elif key in self.stats:
+            targets = [self.stats[key]]
+        else:
+            return
+        for stats in targets:
+            stats.failures = 0
+            stats.cooldown_until = 0.0
+            stats.success_rate = 1.0
+            stats.version += 1
+            self._notify(stats.key, None)
+        if self.limiter is not None:
+            self.limiter.reset(key)
+        self._rebuild(time.monotonic())
+
+    def apply_shared_state(self, key: str, failures: int, cooldown_until: float) -> None:
+        """应用从共享存储同步来的失败次数与冷却截止时间（单调时钟），不触发回调"""
+        stats = self.stats.get(key)
+        if stats is None:
+            return
+        if failures == stats.failures and cooldown_until <= stats.cooldown_until:
+            return
+        stats.failures = failures
+        stats.cooldown_until = max(stats.cooldown_until, cooldown_until)
+        self._push(stats)
+
+    @contextmanager
+    def track(self, key: str, model: Optional[str] = None) -> Iterator["KeyUsage"]:
+        """跟踪一次上游调用：进入时计入在途请求，正常退出时记录成功与延迟
+
+        异常退出只释放在途计数，失败由 handle_api_failure 统一记录，避免重复计数。
+        流式调用可在收到首个数据块时调用 usage.mark()，以首字节时间作为延迟样本；
+        调用 usage.update_tokens(response) 记录 token 用量，退出时计入 TPM 配额。
+        """
+        usage = KeyUsage()
+        self.record_start(key)
+        try:
+            yield usage
+        except BaseException:
+            self.record_release(key)
+            raise
+        stats = self.stats.get(key)
+        if stats is not None:
+            stats.in_flight = max(stats.in_flight - 1, 0)
+        self.record_success(key, usage.latency if usage.latency is not None else usage.elapsed())
+        if self.limiter is not None and usage.tokens:
+            self.limiter.consume_tokens(key, model, usage.tokens)
+
+
+class KeyUsage:
+    """一次上游调用的计时句柄"""
+
+    __slots__ = ("start", "latency", "tokens")
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.latency: Optional[float] = None
+        self.tokens = 0
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def mark(self) -> None:
+        """记录首字节时间，只有第一次调用生效"""
+        if self.latency is None:
+            self.latency = self.elapsed()
+
+    def update_tokens(self, response: Dict[str, Any]) -> None:
+        """从 Gemini 响应的 usageMetadata 中读取累计 token 用量"""
+        usage_metadata = response.get("usageMetadata")
+        if usage_metadata:
+            self.tokens = usage_metadata.get("totalTokenCount", self.tokens)
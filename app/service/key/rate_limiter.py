@@ -0,0 +1,152 @@
+"""
+密钥限流模块
+
+为每个密钥（以及密钥+模型组合）维护 RPM/TPM 令牌桶和基于时间的冷却期，
+调度器据此在发出请求前跳过暂时耗尽配额的密钥，而不是等上游返回 429 再重试。
+"""
+import time
+from typing import Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """按固定速率补充的令牌桶，允许透支（TPM 只能在响应后才知道实际消耗）"""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: int, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float, amount: float = 1.0) -> float:
+        """距离桶内至少有 amount 个令牌还需等待的秒数"""
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, now: float, amount: float = 1.0) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """按密钥与密钥+模型维护 RPM/TPM 令牌桶与冷却期
+
+    Args:
+        rpm: 每个密钥每分钟请求数上限，0 表示不限制
+        tpm: 每个密钥每分钟 token 数上限，0 表示不限制
+        model_limits: 按模型配置的每个密钥限额，如 {"gemini-2.0-flash-exp": {"rpm": 10, "tpm": 4000000}}
+    """
+
+    def __init__(
+        self,
+        rpm: int = 0,
+        tpm: int = 0,
+        model_limits: Optional[Dict[str, Dict[str, int]]] = None,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model_limits = model_limits or {}
+        self._key_buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._model_buckets: Dict[Tuple[str, str], Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._model_cooldowns: Dict[Tuple[str, str], float] = {}
+
+    def _get_key_buckets(self, key: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        buckets = self._key_buckets.get(key)
+        if buckets is None:
+            buckets = (
+                TokenBucket(self.rpm) if self.rpm > 0 else None,
+                TokenBucket(self.tpm) if self.tpm > 0 else None,
+            )
+            self._key_buckets[key] = buckets
+        return buckets
+
+    def _get_model_buckets(self, key: str, model: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        buckets = self._model_buckets.get((key, model))
+        if buckets is None:
+            limits = self.model_limits.get(model, {})
+            rpm = limits.get("rpm", 0)
+            tpm = limits.get("tpm", 0)
+            buckets = (
+                TokenBucket(rpm) if rpm > 0 else None,
+                TokenBucket(tpm) if tpm > 0 else None,
+            )
+            self._model_buckets[(key, model)] = buckets
+        return buckets
+
+    @staticmethod
+    def _buckets_wait(buckets: Tuple[Optional[TokenBucket], Optional[TokenBucket]], now: float) -> float:
+        wait = 0.0
+        for bucket in buckets:
+            if bucket is not None:
+                wait = max(wait, bucket.wait_time(now))
+        return wait
+
+    def key_wait(self, key: str, now: float) -> float:
+        """密钥级令牌桶还需等待的秒数"""
+        if not self.rpm and not self.tpm:
+            return 0.0
+        return self._buckets_wait(self._get_key_buckets(key), now)
+
+    def model_wait(self, key: str, model: Optional[str], now: float) -> float:
+        """密钥+模型级冷却期与令牌桶还需等待的秒数"""
+        if not model:
+            return 0.0
+        wait = 0.0
+        deadline = self._model_cooldowns.get((key, model))
+        if deadline is not None:
+            if deadline > now:
+                wait = deadline - now
+            else:
+                del self._model_cooldowns[(key, model)]
+        if model in self.model_limits:
+            wait = max(wait, self._buckets_wait(self._get_model_buckets(key, model), now))
+        return wait
+
+    def consume_request(self, key: str, model: Optional[str], now: float) -> None:
+        """选中密钥时扣减一次请求配额"""
+        if self.rpm:
+            self._get_key_buckets(key)[0].consume(now)
+        if model and model in self.model_limits:
+            rpm_bucket = self._get_model_buckets(key, model)[0]
+            if rpm_bucket is not None:
+                rpm_bucket.consume(now)
+
+    def consume_tokens(self, key: str, model: Optional[str], tokens: int) -> None:
+        """响应返回后按实际 token 用量扣减 TPM 配额"""
+        if tokens <= 0:
+            return
+        now = time.monotonic()
+        if self.tpm:
+            self._get_key_buckets(key)[1].consume(now, tokens)
+        if model and model in self.model_limits:
+            tpm_bucket = self._get_model_buckets(key, model)[1]
+            if tpm_bucket is not None:
+                tpm_bucket.consume(now, tokens)
+
+    def block_model(self, key: str, model: str, seconds: float) -> None:
+        """让密钥在指定模型上冷却一段时间，不影响其它模型"""
+        deadline = time.monotonic() + seconds
+        current = self._model_cooldowns.get((key, model), 0.0)
+        self._model_cooldowns[(key, model)] = max(current, deadline)
+
+    def reset(self, key: Optional[str] = None) -> None:
+        """清除指定密钥（默认全部）的冷却期与令牌桶"""
+        if key is None:
+            self._key_buckets.clear()
+            self._model_buckets.clear()
+            self._model_cooldowns.clear()
+            return
+        self._key_buckets.pop(key, None)
+        for pair in [pair for pair in self._model_buckets if pair[0] == key]:
+            del self._model_buckets[pair]
+        for pair in [pair for pair in self._model_cooldowns if pair[0] == key]:
+            del self._model_cooldowns[pair]
@@ -0,0 +1,293 @@
+"""
+密钥状态存储后端
+
+多 worker / 多副本部署时，失败次数、冷却截止时间、付费密钥使用次数与轮询位置
+需要在进程间共享。状态统一按“哈希表(name) -> 字段(field) -> 数值”存储：
+- memory: 进程内字典，默认，单进程部署无需共享
+- sqlite: 单机多进程共享，基于 SQLite 的原子 UPSERT
+- redis: 多机共享，使用内置的最小 RESP 客户端，兼容任何 Redis 协议服务
+"""
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlparse
+
+from app.log.logger import get_key_manager_logger
+
+logger = get_key_manager_logger()
+
+STATE_BACKENDS = ["memory", "sqlite", "redis"]
+
+
+class StateBackend(ABC):
+    """状态存储后端基类，所有写操作都是原子的"""
+
+    # 是否在进程间共享；非共享后端不需要同步任务
+    shared = True
+
+    @abstractmethod
+    async def incr_fields(self, name: str, deltas: Dict[str, int]) -> None:
+        """批量原子自增"""
+
+    @abstractmethod
+    async def set_fields(self, name: str, mapping: Dict[str, float]) -> None:
+        """批量写入"""
+
+    @abstractmethod
+    async def get_fields(self, name: str) -> Dict[str, float]:
+        """读取整个哈希表"""
+
+    @abstractmethod
+    async def incr(self, name: str, field: str, amount: int = 1) -> int:
+        """原子自增单个字段并返回自增后的值"""
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """进程内状态存储"""
+
+    shared = False
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, float]] = {}
+
+    async def incr_fields(self, name: str, deltas: Dict[str, int]) -> None:
+        table = self._data.setdefault(name, {})
+        for field, delta in deltas.items():
+            table[field] = table.get(field, 0) + delta
+
+    async def set_fields(self, name: str, mapping: Dict[str, float]) -> None:
+        self._data.setdefault(name, {}).update(mapping)
+
+    async def get_fields(self, name: str) -> Dict[str, float]:
+        return dict(self._data.get(name, {}))
+
+    async def incr(self, name: str, field: str, amount: int = 1) -> int:
+        table = self._data.setdefault(name, {})
+        table[field] = table.get(field, 0) + amount
+        return int(table[field])
+
+
+class SQLiteStateBackend(StateBackend):
+    """基于 SQLite 的单机多进程共享存储
+
+    使用 WAL 模式与 UPSERT 保证并发进程间的原子自增；阻塞的数据库调用放到线程池中执行。
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS key_state ("
+                "name TEXT NOT NULL, field TEXT NOT NULL, value REAL NOT NULL, "
+                "PRIMARY KEY (name, field))"
+            )
+
+    def _executemany(self, sql: str, rows: List[Tuple]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def incr_fields(self, name: str, deltas: Dict[str, int]) -> None:
+        if not deltas:
+            return
+        rows = [(name, field, delta) for field, delta in deltas.items()]
+        await asyncio.to_thread(
+            self._executemany,
+            "INSERT INTO key_state (name, field, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(name, field) DO UPDATE SET value = value + excluded.value",
+            rows,
+        )
+
+    async def set_fields(self, name: str, mapping: Dict[str, float]) -> None:
+        if not mapping:
+            return
+        rows = [(name, field, value) for field, value in mapping.items()]
+        await asyncio.to_thread(
+            self._executemany,
+            "INSERT INTO key_state (name, field, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(name, field) DO UPDATE SET value = excluded.value",
+            rows,
+        )
+
+    def _get_fields(self, name: str) -> Dict[str, float]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, value FROM key_state WHERE name = ?", (name,)
+            ).fetchall()
+        return {field: value for field, value in rows}
+
+    async def get_fields(self, name: str) -> Dict[str, float]:
+        return await asyncio.to_thread(self._get_fields, name)
+
+    def _incr(self, name: str, field: str, amount: int) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO key_state (name, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, field) DO UPDATE SET value = value + excluded.value "
+                "RETURNING value",
+                (name, field, amount),
+            ).fetchone()
+        return int(row[0])
+
+    async def incr(self, name: str, field: str, amount: int = 1) -> int:
+        return await asyncio.to_thread(self._incr, name, field, amount)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisError(Exception):
+    """Redis 服务返回的错误"""
+
+
+class RedisStateBackend(StateBackend):
+    """基于 Redis 协议（RESP）的多机共享存储
+
+    只实现所需的少量命令（HINCRBY / HSET / HGETALL），同一批命令以流水线方式发送；
+    单条命令在服务端原子执行。连接断开时在下一次调用自动重连。
+    """
+
+    def __init__(self, url: str, prefix: str = "gemini_balance:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        path = (parsed.path or "/").lstrip("/")
+        self.db = int(path) if path else 0
+        self.prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected Redis reply: {line!r}")
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        handshake = []
+        if self.password:
+            if self.username:
+                handshake.append(("AUTH", self.username, self.password))
+            else:
+                handshake.append(("AUTH", self.password))
+        if self.db:
+            handshake.append(("SELECT", self.db))
+        if handshake:
+            for reply in await self._send(handshake):
+                if isinstance(reply, RedisError):
+                    raise reply
+
+    async def _send(self, commands: Sequence[Tuple]) -> List:
+        self._writer.write(b"".join(self._encode(*command) for command in commands))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    async def execute(self, commands: Sequence[Tuple]) -> List:
+        """以流水线方式执行一批命令，返回各命令的结果"""
+        async with self._lock:
+            try:
+                if self._writer is None or self._writer.is_closing():
+                    await self._connect()
+                replies = await self._send(commands)
+            except BaseException:
+                # 包括写出后被取消的情况: 连接上可能还有未读取的回复，
+                # 继续使用会让之后的命令读到错位的回复，必须断开
+                await self._disconnect()
+                raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def _disconnect(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def incr_fields(self, name: str, deltas: Dict[str, int]) -> None:
+        if deltas:
+            key = self.prefix + name
+            await self.execute([("HINCRBY", key, field, int(delta)) for field, delta in deltas.items()])
+
+    async def set_fields(self, name: str, mapping: Dict[str, float]) -> None:
+        if mapping:
+            args = [item for pair in mapping.items() for item in pair]
+            await self.execute([("HSET", self.prefix + name, *args)])
+
+    async def get_fields(self, name: str) -> Dict[str, float]:
+        (reply,) = await self.execute([("HGETALL", self.prefix + name)])
+        reply = reply or []
+        return {reply[i]: float(reply[i + 1]) for i in range(0, len(reply), 2)}
+
+    async def incr(self, name: str, field: str, amount: int = 1) -> int:
+        (reply,) = await self.execute([("HINCRBY", self.prefix + name, field, int(amount))])
+        return int(reply)
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._disconnect()
+
+
+def create_state_backend(backend: str, sqlite_path: str = "", redis_url: str = "") -> StateBackend:
+    """按配置创建状态存储后端，未知类型回退到进程内存储"""
+    backend = (backend or "memory").lower()
+    if backend == "sqlite":
+        logger.info(f"Using SQLite key state backend: {sqlite_path}")
+        return SQLiteStateBackend(sqlite_path)
+    if backend == "redis":
+        logger.info(f"Using Redis key state backend: {urlparse(redis_url).hostname}")
+        return RedisStateBackend(redis_url)
+    if backend != "memory":
+        logger.warning(f"Unknown key state backend '{backend}', falling back to memory")
+    return MemoryStateBackend()
@@ -0,0 +1,155 @@
+"""
+密钥状态同步模块
+
+调度器的热路径只读写进程内状态；状态变化先记入本地缓冲，
+由后台任务按 KEY_STATE_FLUSH_INTERVAL 批量写入共享后端（write-behind），
+并在同一轮中拉取其它进程写入的失败次数与冷却期，实现最终一致的共享视图。
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from app.log.logger import get_key_manager_logger
+from app.service.key.key_scheduler import KeyScheduler
+from app.service.key.state_backend import StateBackend
+
+logger = get_key_manager_logger()
+
+# 共享存储中的哈希表名
+FAILURES = "failures"
+COOLDOWNS = "cooldowns"
+PAID_KEY_USAGE = "paid_key_usage"
+ROTATION = "rotation"
+# 每次从共享存储预留的轮询位置数
+ROTATION_BATCH = 64
+
+
+class KeyStateSync:
+    """调度器状态与共享存储之间的批量同步"""
+
+    def __init__(self, backend: StateBackend, scheduler: KeyScheduler, interval: float):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.interval = interval
+        self._failure_deltas: Dict[str, int] = {}
+        self._failure_values: Dict[str, int] = {}
+        self._cooldowns: Dict[str, float] = {}
+        self._usage: Dict[str, int] = {}
+        # 轮询名 -> [下一个位置, 预留区间末尾]
+        self._rotations: Dict[str, List[int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._sync_lock = asyncio.Lock()
+        scheduler.listener = self._on_change
+
+    def _on_change(self, key: str, delta: Optional[int]) -> None:
+        """调度器状态变化回调，只写本地缓冲"""
+        stats = self.scheduler.stats[key]
+        if delta is None:
+            self._failure_values[key] = stats.failures
+            self._failure_deltas.pop(key, None)
+        elif delta:
+            self._failure_deltas[key] = self._failure_deltas.get(key, 0) + delta
+        # 冷却期以墙上时间存储，便于跨进程/跨主机比较
+        remaining = stats.cooldown_until - time.monotonic()
+        self._cooldowns[key] = time.time() + remaining if remaining > 0 else 0.0
+
+    def record_usage(self, key: str, amount: int = 1) -> None:
+        """记录付费密钥使用次数，随下一次刷新批量写入"""
+        self._usage[key] = self._usage.get(key, 0) + amount
+
+    async def flush(self) -> None:
+        """把本地缓冲批量写入共享存储，失败时放回缓冲等待下次重试"""
+        values, self._failure_values = self._failure_values, {}
+        deltas, self._failure_deltas = self._failure_deltas, {}
+        cooldowns, self._cooldowns = self._cooldowns, {}
+        usage, self._usage = self._usage, {}
+        if not (values or deltas or cooldowns or usage):
+            return
+        try:
+            # 先写绝对值再叠加增量，与本地事件发生的先后顺序一致
+            await self.backend.set_fields(FAILURES, values)
+            await self.backend.incr_fields(FAILURES, deltas)
+            await self.backend.set_fields(COOLDOWNS, cooldowns)
+            await self.backend.incr_fields(PAID_KEY_USAGE, usage)
+        except Exception as e:
+            logger.warning(f"Failed to flush key state: {str(e)}")
+            for key, value in values.items():
+                self._failure_values.setdefault(key, value)
+            for key, delta in deltas.items():
+                if key not in self._failure_values:
+                    self._failure_deltas[key] = self._failure_deltas.get(key, 0) + delta
+            for key, deadline in cooldowns.items():
+                self._cooldowns.setdefault(key, deadline)
+            for key, amount in usage.items():
+                self._usage[key] = self._usage.get(key, 0) + amount
+
+    async def refresh(self) -> None:
+        """拉取共享存储中的失败次数与冷却期并应用到本地调度器"""
+        failures = await self.backend.get_fields(FAILURES)
+        cooldowns = await self.backend.get_fields(COOLDOWNS)
+        now_wall = time.time()
+        now_monotonic = time.monotonic()
+        for key in self.scheduler.stats:
+            if key in self._failure_values:
+                # 本地有尚未写出的绝对值，以本地为准
+                continue
+            shared = max(int(failures.get(key, 0)), 0) + self._failure_deltas.get(key, 0)
+            deadline = cooldowns.get(key, 0.0)
+            cooldown_until = now_monotonic + (deadline - now_wall) if deadline > now_wall else 0.0
+            self.scheduler.apply_shared_state(key, shared, cooldown_until)
+
+    async def sync(self) -> None:
+        async with self._sync_lock:
+            await self.flush()
+            await self.refresh()
+
+    async def get_paid_keys_usage(self) -> Dict[str, int]:
+        """所有进程累计的付费密钥使用次数"""
+        await self.flush()
+        usage = await self.backend.get_fields(PAID_KEY_USAGE)
+        return {key: int(value) for key, value in usage.items()}
+
+    async def next_rotation(self, name: str) -> int:
+        """返回本进程的下一个轮询位置
+
+        每次在共享存储上原子地预留 ROTATION_BATCH 个连续位置，用完后再预留，
+        热路径不必每次访问后端；各进程的区间互不重叠，整体仍按顺序均匀轮询。
+        """
+        block = self._rotations.get(name)
+        if block is None or block[0] >= block[1]:
+            end = await self.backend.incr(ROTATION, name, ROTATION_BATCH)
+            block = self._rotations[name] = [end - ROTATION_BATCH, end]
+        position = block[0]
+        block[0] += 1
+        return position
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Key state sync failed: {str(e)}")
+
+    async def start(self) -> None:
+        """加载共享状态并启动后台同步任务"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"Failed to load shared key state: {str(e)}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台同步，写出剩余缓冲并关闭后端"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        finally:
+            await self.backend.close()
@@ -0,0 +1,150 @@
+"""
+模型目录模块
+
+缓存上游模型列表，并预先生成 Gemini 格式与 OpenAI 格式的响应体（含 -search、-image、-chat 变体）
+及其 ETag。缓存超过 TTL 后仍先返回旧数据，同时在后台刷新（stale-while-revalidate）。
+并发的首次加载、后台刷新与主动刷新通过 singleflight 合并为同一次上游拉取；某个密钥拉取失败时
+只记录该密钥的失败并换密钥重试，不会让所有等待中的请求一起失败。
+"""
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict, FrozenSet, Optional
+
+import httpx
+from fastapi import Response
+
+from app.config.config import settings
+from app.core.metrics import set_known_models
+from app.exception.exceptions import ServiceUnavailableError, UpstreamError
+from app.log.logger import get_model_logger
+from app.service.key.key_manager import KeyManager
+from app.service.model.model_service import ModelService
+from app.utils.json_codec import dumps_bytes
+from app.utils.singleflight import SingleFlight
+
+logger = get_model_logger()
+
+# 刷新失败后再次尝试前的等待时间（秒）
+_FAILURE_RETRY_INTERVAL = 30.0
+# 单次刷新最多尝试的密钥数
+_MAX_FETCH_ATTEMPTS = 3
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+class CatalogSnapshot:
+    """某一时刻的模型目录及预先序列化的响应体"""
+
+    __slots__ = ("gemini_body", "gemini_etag", "openai_body", "openai_etag", "model_ids", "fetched_at")
+
+    def __init__(self, gemini_models: Dict[str, Any], openai_models: Dict[str, Any]):
+        self.gemini_body = dumps_bytes(gemini_models)
+        self.gemini_etag = _etag(self.gemini_body)
+        self.openai_body = dumps_bytes(openai_models)
+        self.openai_etag = _etag(self.openai_body)
+        self.model_ids: FrozenSet[str] = frozenset(
+            [model["name"].split("/")[-1] for model in gemini_models.get("models", [])]
+            + [model["id"] for model in openai_models.get("data", [])]
+        )
+        self.fetched_at = time.monotonic()
+
+
+class ModelCatalog:
+    """带 TTL 与后台刷新的模型目录
+
+    Args:
+        model_service: 负责拉取上游模型列表与格式转换
+        ttl: 目录的新鲜期（秒），过期后返回旧数据并在后台刷新
+    """
+
+    def __init__(self, model_service: ModelService, ttl: float):
+        self.model_service = model_service
+        self.ttl = ttl
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._flights: SingleFlight[CatalogSnapshot] = SingleFlight()
+        self._next_refresh = 0.0
+
+    async def _fetch(self, key_manager: KeyManager) -> CatalogSnapshot:
+        api_key = await key_manager.get_next_working_key()
+        for attempt in range(1, _MAX_FETCH_ATTEMPTS + 1):
+            logger.info(f"Refreshing model catalog using API key: {api_key}")
+            try:
+                gemini_models = await self.model_service.fetch_gemini_models(api_key)
+                break
+            except (UpstreamError, httpx.HTTPError) as e:
+                logger.warning(f"Fetching model list with API key {api_key} failed (attempt {attempt}): {str(e)}")
+                # 只记录该密钥的失败（限流冷却、无效禁用），换下一个密钥重试
+                next_key = await key_manager.handle_api_failure(api_key, error=e)
+                if next_key == api_key or (isinstance(e, UpstreamError) and e.is_client_error):
+                    raise ServiceUnavailableError("Failed to fetch model list from upstream") from e
+                api_key = next_key
+        else:
+            raise ServiceUnavailableError("Failed to fetch model list from upstream")
+        openai_models = self.model_service.convert_to_openai_models_format(gemini_models)
+        gemini_models = self.model_service.add_gemini_model_variants(gemini_models)
+        return CatalogSnapshot(gemini_models, openai_models)
+
+    async def _refresh(self, key_manager: KeyManager) -> CatalogSnapshot:
+        try:
+            snapshot = await self._fetch(key_manager)
+        except Exception as e:
+            self._next_refresh = time.monotonic() + min(self.ttl, _FAILURE_RETRY_INTERVAL)
+            logger.error(f"Model catalog refresh failed: {str(e)}")
+            raise
+        self._snapshot = snapshot
+        self._next_refresh = snapshot.fetched_at + self.ttl
+        set_known_models(snapshot.model_ids)
+        return snapshot
+
+    async def refresh(self, key_manager: KeyManager) -> CatalogSnapshot:
+        """立即刷新目录；并发调用共享同一次上游拉取及其结果"""
+        return await self._flights.do("catalog", lambda: self._refresh(key_manager))
+
+    def _start_refresh(self, key_manager: KeyManager) -> asyncio.Task:
+        """在后台启动刷新，已有后台刷新时复用同一任务"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self.refresh(key_manager))
+            # 后台刷新的失败已记录日志，避免 "exception was never retrieved" 警告
+            self._refreshing.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._refreshing
+
+    async def get(self, key_manager: KeyManager) -> CatalogSnapshot:
+        """获取模型目录；首次调用等待上游返回，之后过期时返回旧数据并在后台刷新"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return await self.refresh(key_manager)
+        if time.monotonic() >= self._next_refresh:
+            self._start_refresh(key_manager)
+        return snapshot
+
+    def invalidate(self) -> None:
+        """使目录立即过期，下一次读取时触发刷新"""
+        self._next_refresh = 0.0
+
+    def check_model_support(self, model: str) -> bool:
+        """目录中列出的模型（含变体）直接通过；未列出的模型按配置规则判断"""
+        snapshot = self._snapshot
+        if snapshot is not None and isinstance(model, str) and model.strip() in snapshot.model_ids:
+            return True
+        return self.model_service.check_model_support(model)
+
+
+def etag_response(body: bytes, etag: str, if_none_match: Optional[str]) -> Response:
+    """返回带 ETag 的 JSON 响应，客户端缓存仍有效时返回 304"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# 默认的模型目录实例，OpenAI 与 Gemini 接口共享
+model_catalog = ModelCatalog(
+    ModelService(settings.SEARCH_MODELS, settings.IMAGE_MODELS),
+    ttl=settings.MODEL_CATALOG_TTL,
+)
@@ -1,10 +1,15 @@
+from copy import deepcopy
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional
 
-import requests
+import httpx
 
 from app.config.config import settings
+from app.exception.exceptions import UpstreamError
 from app.log.logger import get_model_logger
+from app.service.client.api_client import build_upstream_error
+from app.service.client.http_client import get_http_client
+from app.utils.json_codec import loads
 
 logger = get_model_logger()
 
@@ -15,38 +20,46 @@ class ModelService:
         self.image_models = image_models
         self.base_url = settings.BASE_URL
         self.filtered_models = settings.FILTERED_MODELS
+        # 集合用于 O(1) 的成员判断，列表保留配置中的顺序
+        self._search_set = frozenset(search_models)
+        self._image_set = frozenset(image_models)
+        self._filtered_set = frozenset(self.filtered_models)
 
-    def get_gemini_models(self, api_key: str) -> Optional[Dict[str, Any]]:
+    async def fetch_gemini_models(self, api_key: str) -> Dict[str, Any]:
+        """拉取上游模型列表并过滤，失败时抛出 UpstreamError 或 httpx.HTTPError"""
         url = f"{self.base_url}/models?key={api_key}"
+        response = await get_http_client().get(url)
+        if response.status_code != 200:
+            raise build_upstream_error(response.status_code, response.headers, response.content)
+        gemini_models = loads(response.content)
 
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                gemini_models = response.json()
-
-                filtered_models_list = []
-                for model in gemini_models.get("models", []):
-                    model_id = model["name"].split("/")[-1]
-                    if model_id not in self.filtered_models:
-                        filtered_models_list.append(model)
-                    else:
-                        logger.info(f"Filtered out model: {model_id}")
-
-                gemini_models["models"] = filtered_models_list
-                return gemini_models
+        filtered_models_list = []
+        for model in gemini_models.get("models", []):
+            model_id = model["name"].split("/")[-1]
+            if model_id not in self._filtered_set:
+                filtered_models_list.append(model)
             else:
-                logger.error(f"Error: {response.status_code}")
-                logger.error(response.text)
-                return None
-        except requests.RequestException as e:
+                logger.info(f"Filtered out model: {model_id}")
+
+        gemini_models["models"] = filtered_models_list
+        return gemini_models
+
+    async def get_gemini_models(self, api_key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.fetch_gemini_models(api_key)
+        except UpstreamError as e:
+            logger.error(f"Error: {e.status_code}")
+            logger.error(e.detail)
+            return None
+        except httpx.HTTPError as e:
             logger.error(f"Request failed: {e}")
             return None
 
-    def get_gemini_openai_models(self, api_key: str) -> Optional[Dict[str, Any]]:
+    async def get_gemini_openai_models(self, api_key: str) -> Optional[Dict[str, Any]]:
         try:
-            gemini_models = self.get_gemini_models(api_key)
+            gemini_models = await self.get_gemini_models(api_key)
             return self.convert_to_openai_models_format(gemini_models)
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Request failed: {e}")
             return None
 
@@ -54,13 +67,15 @@ class ModelService:
         self, gemini_models: Dict[str, Any]
     ) -> Dict[str, Any]:
         openai_format = {"object": "list", "data": [], "success": True}
+        created = int(datetime.now(timezone.utc).timestamp())
+        openai_model = None
 
         for model in gemini_models.get("models", []):
             model_id = model["name"].split("/")[-1]
             openai_model = {
                 "id": model_id,
                 "object": "model",
-                "created": int(datetime.now(timezone.utc).timestamp()),
+                "created": created,
                 "owned_by": "google",
                 "permission": [],
                 "root": model["name"],
@@ -68,21 +83,45 @@ class ModelService:
             }
             openai_format["data"].append(openai_model)
 
-            if model_id in self.search_models:
+            if model_id in self._search_set:
                 search_model = openai_model.copy()
                 search_model["id"] = f"{model_id}-search"
                 openai_format["data"].append(search_model)
-            if model_id in self.image_models:
+            if model_id in self._image_set:
                 image_model = openai_model.copy()
                 image_model["id"] = f"{model_id}-image"
                 openai_format["data"].append(image_model)
 
-        if settings.CREATE_IMAGE_MODEL:
+        if settings.CREATE_IMAGE_MODEL and openai_model is not None:
             image_model = openai_model.copy()
             image_model["id"] = f"{settings.CREATE_IMAGE_MODEL}-chat"
             openai_format["data"].append(image_model)
         return openai_format
 
+    def add_gemini_model_variants(self, gemini_models: Dict[str, Any]) -> Dict[str, Any]:
+        """在 Gemini 格式的模型列表后追加配置的 -search 与 -image 变体"""
+        model_mapping = {
+            x.get("name", "").split("/", maxsplit=1)[-1]: x
+            for x in gemini_models.get("models", [])
+        }
+        variants = []
+        for names, suffix, label in (
+            (self.search_models, "search", "Search"),
+            (self.image_models, "image", "Image"),
+        ):
+            for name in names:
+                model = model_mapping.get(name)
+                if not model:
+                    continue
+                item = deepcopy(model)
+                item["name"] = f"models/{name}-{suffix}"
+                display_name = f'{item.get("displayName")} For {label}'
+                item["displayName"] = display_name
+                item["description"] = display_name
+                variants.append(item)
+        gemini_models["models"] = list(gemini_models.get("models", [])) + variants
+        return gemini_models
+
     def check_model_support(self, model: str) -> bool:
         if not model or not isinstance(model, str):
             return False
@@ -90,9 +129,9 @@ class ModelService:
         model = model.strip()
         if model.endswith("-search"):
             model = model[:-7]
-            return model in self.search_models
+            return model in self._search_set
         if model.endswith("-image"):
             model = model[:-6]
-            return model in self.image_models
+            return model in self._image_set
 
-        return model not in self.filtered_models
+        return model not in self._filtered_set
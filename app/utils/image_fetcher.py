@@ -0,0 +1,132 @@
+"""
+图片下载模块
+
+通过共享连接池异步下载消息中的图片，限制大小与耗时，按文件头识别真实的 MIME 类型，
+并按 URL 缓存 base64 结果，多轮对话每轮重复发送的历史图片不必重新下载。
+"""
+import asyncio
+import base64
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import httpx
+
+from app.config.config import settings
+from app.log.logger import get_image_fetcher_logger
+from app.service.client.http_client import get_http_client
+from app.utils.cache import ByteSizeLRUCache
+
+logger = get_image_fetcher_logger()
+
+# 超过该大小的图片在线程池中编码，避免阻塞事件循环
+_THREAD_ENCODE_THRESHOLD = 1024 * 1024
+
+
+class ImageFetchError(Exception):
+    """图片下载失败"""
+
+
+def sniff_mime_type(data: bytes, content_type: Optional[str] = None) -> str:
+    """根据文件头识别图片类型，无法识别时使用响应头中的类型"""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1"):
+            return "image/heif"
+    if content_type:
+        content_type = content_type.split(";")[0].strip().lower()
+        if content_type.startswith("image/"):
+            return "image/jpeg" if content_type == "image/jpg" else content_type
+    return "image/png"
+
+
+class ImageFetcher:
+    """带大小/时间限制与 LRU 缓存的异步图片下载器
+
+    Args:
+        max_bytes: 单张图片的最大字节数
+        timeout: 单张图片下载的总超时时间（秒）
+        cache_bytes: URL -> base64 缓存的容量（字节），0 表示不缓存
+        concurrency: 同一次请求中并发下载的图片数
+    """
+
+    def __init__(self, max_bytes: int, timeout: float, cache_bytes: int, concurrency: int):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.cache: ByteSizeLRUCache[Tuple[str, str]] = ByteSizeLRUCache(cache_bytes)
+
+    async def _download(self, url: str) -> Tuple[bytes, Optional[str]]:
+        client = get_http_client()
+        async with client.stream(
+            "GET", url, timeout=httpx.Timeout(self.timeout), follow_redirects=True
+        ) as response:
+            if response.status_code != 200:
+                raise ImageFetchError(f"Failed to fetch image: {response.status_code}")
+            length = response.headers.get("content-length")
+            if length and length.isdigit() and int(length) > self.max_bytes:
+                raise ImageFetchError(f"Image too large: {length} bytes")
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ImageFetchError(f"Image too large: more than {self.max_bytes} bytes")
+                chunks.append(chunk)
+            return b"".join(chunks), response.headers.get("content-type")
+
+    async def fetch(self, url: str) -> Tuple[str, str]:
+        """下载图片，返回 (mime_type, base64数据)"""
+        cached = self.cache.get(url)
+        if cached is not None:
+            return cached
+        if not url.startswith(("http://", "https://")):
+            raise ImageFetchError(f"Unsupported image URL: {url[:64]}")
+        try:
+            data, content_type = await asyncio.wait_for(self._download(url), self.timeout)
+        except asyncio.TimeoutError:
+            raise ImageFetchError(f"Timed out fetching image after {self.timeout}s")
+        except httpx.HTTPError as e:
+            raise ImageFetchError(f"Failed to fetch image: {str(e)}") from e
+        mime_type = sniff_mime_type(data, content_type)
+        if len(data) > _THREAD_ENCODE_THRESHOLD:
+            encoded = await asyncio.to_thread(base64.b64encode, data)
+        else:
+            encoded = base64.b64encode(data)
+        result = (mime_type, encoded.decode("ascii"))
+        self.cache.put(url, result, len(result[1]))
+        return result
+
+    async def fetch_many(self, urls: Iterable[str]) -> Dict[str, Union[Tuple[str, str], Exception]]:
+        """并发下载多张图片（相同 URL 只下载一次），失败的 URL 对应异常对象"""
+        unique = list(dict.fromkeys(urls))
+        if not unique:
+            return {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_one(url: str) -> Tuple[str, str]:
+            async with semaphore:
+                return await self.fetch(url)
+
+        results = await asyncio.gather(*[fetch_one(url) for url in unique], return_exceptions=True)
+        for url, result in zip(unique, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to fetch image {url[:128]}: {str(result)}")
+        return dict(zip(unique, results))
+
+
+# 默认的图片下载器实例，缓存在所有请求间共享
+image_fetcher = ImageFetcher(
+    max_bytes=settings.IMAGE_FETCH_MAX_BYTES,
+    timeout=settings.IMAGE_FETCH_TIMEOUT,
+    cache_bytes=settings.IMAGE_CACHE_MAX_BYTES,
+    concurrency=settings.IMAGE_FETCH_CONCURRENCY,
+)
@@ -0,0 +1,95 @@
+"""
+JSON编解码模块
+
+热路径（上游SSE解析、下游SSE序列化、FastAPI响应渲染）统一通过本模块编解码，
+优先使用 orjson，其次 msgspec，二者都不可用时回退到标准库 json。
+"""
+import json
+from typing import Any, Callable, Tuple, Union
+
+from fastapi.responses import JSONResponse
+
+from app.config.config import settings
+from app.log.logger import get_json_codec_logger
+
+logger = get_json_codec_logger()
+
+JSON_CODEC_BACKENDS = ["orjson", "msgspec", "json"]
+
+
+def _load_orjson() -> Tuple[Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]:
+    import orjson
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=option)
+
+    return _dumps, orjson.loads
+
+
+def _load_msgspec() -> Tuple[Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]:
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+    return encoder.encode, decoder.decode
+
+
+def _load_json() -> Tuple[Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    return _dumps, json.loads
+
+
+_LOADERS = {
+    "orjson": _load_orjson,
+    "msgspec": _load_msgspec,
+    "json": _load_json,
+}
+
+
+def _select_backend(preferred: str) -> Tuple[str, Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]:
+    """按配置选择编解码后端，不可用时按 JSON_CODEC_BACKENDS 顺序回退"""
+    preferred = (preferred or "auto").lower()
+    candidates = list(JSON_CODEC_BACKENDS)
+    if preferred in _LOADERS:
+        candidates.remove(preferred)
+        candidates.insert(0, preferred)
+    for name in candidates:
+        try:
+            encoder, decoder = _LOADERS[name]()
+        except ImportError:
+            if name == preferred:
+                logger.warning(f"JSON codec '{name}' is not installed, falling back")
+            continue
+        return name, encoder, decoder
+    # 标准库 json 总是可用，不会走到这里
+    raise RuntimeError("No JSON codec available")
+
+
+BACKEND, _encode, _decode = _select_backend(settings.JSON_CODEC)
+logger.info(f"Using JSON codec backend: {BACKEND}")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """序列化为UTF-8编码的JSON字节串"""
+    return _encode(obj)
+
+
+def dumps(obj: Any) -> str:
+    """序列化为JSON字符串"""
+    return _encode(obj).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    """反序列化JSON字符串或字节串"""
+    return _decode(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """使用当前JSON编解码后端渲染的JSON响应类"""
+
+    def render(self, content: Any) -> bytes:
+        return _encode(content)
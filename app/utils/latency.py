@@ -0,0 +1,22 @@
+"""
+延迟统计工具模块
+"""
+from collections import deque
+from typing import Deque
+
+
+class LatencyWindow:
+    """最近若干个耗时样本（秒），用于计算分位数"""
+
+    __slots__ = ("samples",)
+
+    def __init__(self, size: int):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, pct: float) -> float:
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
@@ -0,0 +1,54 @@
+"""
+请求合并模块
+
+同一键上的并发调用只执行一次，其余调用者等待同一结果。调用在独立任务中执行，
+发起者取消（如客户端断开）不会中断其他等待者，结果仍会写入调用方的缓存。
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """按键合并并发的异步调用"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 异常已交给等待者处理，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def do(
+        self, key: Hashable, fn: Callable[[], Awaitable[T]], share_errors: bool = True
+    ) -> T:
+        """执行 fn 或等待同一键上正在进行的调用
+
+        share_errors 为 False 时，等待者遇到其他调用的异常后自行执行一次 fn，
+        避免一次失败（及其密钥的失败计数）扩散到所有合并的请求。
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            return await asyncio.shield(task)
+        self.shared += 1
+        if share_errors:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+        except Exception:
+            pass
+        return await fn()
@@ -1,7 +1,10 @@
-import requests
+import asyncio
+import httpx
+from app.config.config import settings
 from app.domain.image_models import ImageMetadata, ImageUploader, UploadResponse
+from app.service.client.http_client import get_http_client
 from enum import Enum
-from typing import Optional, Any
+from typing import List, Optional, Any, Tuple
 
 class UploadErrorType(Enum):
     """上传错误类型枚举"""
@@ -81,7 +84,7 @@ class SmMsUploader(ImageUploader):
     def __init__(self, api_key: str):
         self.api_key = api_key
         
-    def upload(self, file: bytes, filename: str) -> UploadResponse:
+    async def upload(self, file: bytes, filename: str) -> UploadResponse:
         try:
             # 准备请求头
             headers = {
@@ -94,7 +97,7 @@ class SmMsUploader(ImageUploader):
             }
             
             # 发送请求
-            response = requests.post(
+            response = await get_http_client().post(
                 self.API_URL,
                 headers=headers,
                 files=files
@@ -128,7 +131,7 @@ class SmMsUploader(ImageUploader):
                 data=image_metadata
             )
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             # 处理网络请求相关错误
             raise UploadError(f"Upload request failed: {str(e)}")
         except (KeyError, ValueError) as e:
@@ -144,7 +147,7 @@ class QiniuUploader(ImageUploader):
         self.access_key = access_key
         self.secret_key = secret_key
         
-    def upload(self, file: bytes, filename: str) -> UploadResponse:
+    async def upload(self, file: bytes, filename: str) -> UploadResponse:
         # 实现七牛云的具体上传逻辑
         pass
     
@@ -163,7 +166,7 @@ class PicGoUploader(ImageUploader):
         self.api_key = api_key
         self.api_url = api_url
         
-    def upload(self, file: bytes, filename: str) -> UploadResponse:
+    async def upload(self, file: bytes, filename: str) -> UploadResponse:
         """
         上传图片到 Chevereto 服务
         
@@ -189,7 +192,7 @@ class PicGoUploader(ImageUploader):
             }
             
             # 发送请求
-            response = requests.post(
+            response = await get_http_client().post(
                 self.api_url,
                 headers=headers,
                 files=files
@@ -233,7 +236,7 @@ class PicGoUploader(ImageUploader):
                 data=image_metadata
             )
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             # 处理网络请求相关错误
             raise UploadError(
                 message=f"Upload request failed: {str(e)}",
@@ -273,7 +276,7 @@ class CloudFlareImgBedUploader(ImageUploader):
         self.auth_code = auth_code
         self.api_url = api_url
         
-    def upload(self, file: bytes, filename: str) -> UploadResponse:
+    async def upload(self, file: bytes, filename: str) -> UploadResponse:
         """
         上传图片到CloudFlare图床
         
@@ -300,7 +303,7 @@ class CloudFlareImgBedUploader(ImageUploader):
             }
             
             # 发送请求
-            response = requests.post(
+            response = await get_http_client().post(
                 request_url,
                 files=files
             )
@@ -347,7 +350,7 @@ class CloudFlareImgBedUploader(ImageUploader):
                 data=image_metadata
             )
             
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             # 处理网络请求相关错误
             raise UploadError(
                 message=f"Upload request failed: {str(e)}",
@@ -391,3 +394,52 @@ class ImageUploaderFactory:
                 credentials["base_url"]
             )
         raise ValueError(f"Unknown provider: {provider}")
+
+
+def get_image_uploader() -> ImageUploader:
+    """按 UPLOAD_PROVIDER 配置创建图床上传器"""
+    if settings.UPLOAD_PROVIDER == "smms":
+        return ImageUploaderFactory.create(
+            provider=settings.UPLOAD_PROVIDER,
+            api_key=settings.SMMS_SECRET_TOKEN,
+        )
+    elif settings.UPLOAD_PROVIDER == "picgo":
+        return ImageUploaderFactory.create(
+            provider=settings.UPLOAD_PROVIDER,
+            api_key=settings.PICGO_API_KEY,
+        )
+    elif settings.UPLOAD_PROVIDER == "cloudflare_imgbed":
+        return ImageUploaderFactory.create(
+            provider=settings.UPLOAD_PROVIDER,
+            base_url=settings.CLOUDFLARE_IMGBED_URL,
+            auth_code=settings.CLOUDFLARE_IMGBED_AUTH_CODE,
+        )
+    raise ValueError(f"Unsupported upload provider: {settings.UPLOAD_PROVIDER}")
+
+
+async def upload_images(
+    files: List[Tuple[bytes, str]],
+    uploader: Optional[ImageUploader] = None,
+    concurrency: Optional[int] = None,
+) -> List[UploadResponse]:
+    """
+    并发上传多张图片，按输入顺序返回上传结果
+
+    Args:
+        files: (图片二进制数据, 文件名) 列表
+        uploader: 图床上传器，默认按配置创建
+        concurrency: 最大并发上传数，默认使用 UPLOAD_CONCURRENCY
+
+    Raises:
+        UploadError: 任意一张图片上传失败时抛出
+    """
+    if not files:
+        return []
+    uploader = uploader or get_image_uploader()
+    semaphore = asyncio.Semaphore(max(1, concurrency or settings.UPLOAD_CONCURRENCY))
+
+    async def upload_one(file: bytes, filename: str) -> UploadResponse:
+        async with semaphore:
+            return await uploader.upload(file, filename)
+
+    return await asyncio.gather(*[upload_one(file, filename) for file, filename in files])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+JSON编解码微基准测试
+
+使用真实形态的 Gemini 流式响应块和 OpenAI 流式响应块，比较各可用后端
+（orjson / msgspec / 标准库 json）的编码与解码吞吐量。
+
+用法:
+    python bench_json_codec.py --iterations 20000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["bench-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["bench-token"]')
+
+from app.utils import json_codec
+
+GEMINI_STREAM_CHUNK = {
+    "candidates": [
+        {
+            "content": {
+                "parts": [{"text": "当然可以！下面是一个使用 Python 实现快速排序的示例：\n\n```python\ndef quick_sort(arr):\n    if len(arr) <= 1:\n        return arr\n"}],
+                "role": "model",
+            },
+            "safetyRatings": [
+                {"category": "HARM_CATEGORY_HATE_SPEECH", "probability": "NEGLIGIBLE"},
+                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "probability": "NEGLIGIBLE"},
+                {"category": "HARM_CATEGORY_HARASSMENT", "probability": "NEGLIGIBLE"},
+                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "probability": "NEGLIGIBLE"},
+            ],
+            "index": 0,
+        }
+    ],
+    "usageMetadata": {"promptTokenCount": 12, "candidatesTokenCount": 48, "totalTokenCount": 60},
+    "modelVersion": "gemini-1.5-flash",
+}
+
+OPENAI_STREAM_CHUNK = {
+    "id": "chatcmpl-0f6a7c1e-5b7e-4a53-9d1c-2a8c0b3e4f5d",
+    "object": "chat.completion.chunk",
+    "created": 1735689600,
+    "model": "gemini-1.5-flash",
+    "choices": [{"index": 0, "delta": {"content": "def quick_sort(arr):\n    if len(arr) <= 1:", "role": "assistant"}, "finish_reason": None}],
+}
+
+
+def _backends():
+    for name in json_codec.JSON_CODEC_BACKENDS:
+        try:
+            encode, decode = json_codec._LOADERS[name]()
+        except ImportError:
+            print(f"跳过未安装的后端: {name}")
+            continue
+        yield name, encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON编解码微基准测试")
+    parser.add_argument("--iterations", type=int, default=20000, help="每项测试的迭代次数")
+    args = parser.parse_args()
+    n = args.iterations
+
+    samples = {
+        "gemini_chunk": (GEMINI_STREAM_CHUNK, json.dumps(GEMINI_STREAM_CHUNK)),
+        "openai_chunk": (OPENAI_STREAM_CHUNK, json.dumps(OPENAI_STREAM_CHUNK)),
+    }
+    print(f"当前生效后端: {json_codec.BACKEND}，迭代次数: {n}")
+    print(f"{'backend':<10}{'sample':<15}{'encode ops/s':>16}{'decode ops/s':>16}")
+    for name, encode, decode in _backends():
+        for sample_name, (obj, text) in samples.items():
+            encode_time = timeit.timeit(lambda: encode(obj), number=n)
+            decode_time = timeit.timeit(lambda: decode(text), number=n)
+            print(f"{name:<10}{sample_name:<15}{n / encode_time:>16,.0f}{n / decode_time:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+流式输出模式基准测试
+
+模拟一个上游SSE流，分别以 drip / passthrough / coalesce 三种模式经过 StreamOptimizer，
+统计首字节时间(TTFB)、末字节时间(TTLB)、写出次数以及每 1k tokens 的 CPU 时间。
+
+用法:
+    python bench_stream_modes.py --tokens 1000 --tokens-per-chunk 20 --interval 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["bench-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["bench-token"]')
+
+from app.core.constants import STREAM_MODES
+from app.handler.stream_optimizer import StreamOptimizer
+
+# 粗略按 1 token ≈ 4 个字符估算
+CHARS_PER_TOKEN = 4
+
+
+async def fake_upstream(total_tokens: int, tokens_per_chunk: int, interval: float):
+    """模拟上游：按固定间隔产出文本块"""
+    chunk_text = "abcd" * tokens_per_chunk
+    for _ in range(0, total_tokens, tokens_per_chunk):
+        if interval:
+            await asyncio.sleep(interval)
+        yield chunk_text
+
+
+def create_chunk(text: str) -> dict:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "gemini-bench",
+        "choices": [{"index": 0, "delta": {"content": text, "role": "assistant"}, "finish_reason": None}],
+    }
+
+
+def format_chunk(chunk: dict) -> str:
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def run_mode(mode: str, args) -> dict:
+    optimizer = StreamOptimizer(mode=mode)
+
+    async def events():
+        async for text in fake_upstream(args.tokens, args.tokens_per_chunk, args.interval):
+            async for item in optimizer.optimize_stream_output(text, create_chunk, format_chunk, mode):
+                yield item
+
+    # 单独测量上游本身的完成时间，作为对比基线
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    ttfb = None
+    writes = 0
+    received = 0
+    async for item in optimizer.coalesce_stream(events(), mode):
+        if ttfb is None:
+            ttfb = time.perf_counter() - start
+        writes += 1
+        received += len(item)
+    ttlb = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    return {
+        "mode": mode,
+        "ttfb": ttfb or 0.0,
+        "ttlb": ttlb,
+        "writes": writes,
+        "bytes": received,
+        "cpu_per_1k": cpu / args.tokens * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="StreamOptimizer 模式基准测试")
+    parser.add_argument("--tokens", type=int, default=1000, help="模拟输出的 token 数")
+    parser.add_argument("--tokens-per-chunk", type=int, default=20, help="每个上游块包含的 token 数")
+    parser.add_argument("--interval", type=float, default=0.02, help="上游块之间的间隔（秒）")
+    parser.add_argument("--modes", nargs="*", default=STREAM_MODES, help="要测试的模式")
+    args = parser.parse_args()
+
+    upstream_ttlb = args.interval * (args.tokens // args.tokens_per_chunk)
+    print(f"上游: {args.tokens} tokens, {args.tokens_per_chunk} tokens/块, 间隔 {args.interval}s, "
+          f"上游完成时间 ≈ {upstream_ttlb:.3f}s")
+    print(f"{'mode':<12}{'TTFB(s)':>10}{'TTLB(s)':>10}{'writes':>10}{'bytes':>12}{'CPU ms/1k tok':>16}")
+    for mode in args.modes:
+        result = await run_mode(mode, args)
+        print(
+            f"{result['mode']:<12}{result['ttfb']:>10.4f}{result['ttlb']:>10.3f}{result['writes']:>10}"
+            f"{result['bytes']:>12}{result['cpu_per_1k'] * 1000:>16.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController
+from app.core.security import SecurityService
+from app.core.token_store import TokenInfo, TokenStore
+from app.exception.exceptions import RateLimitExceededError
+from app.middleware.admission_middleware import AdmissionMiddleware
+
+
+async def _request(controller, info, order, gate):
+    async with controller.admit(info):
+        order.append(info.name)
+        await gate.wait()
+
+
+def test_weighted_fair_queuing():
+    """密鑰池飽和時按權重在租戶之間輪轉放行，批處理租戶不會餓死交互租戶"""
+    print("測試加權公平排隊...")
+
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue=100, queue_timeout=5)
+        batch = TokenInfo(name="batch", weight=1)
+        interactive = TokenInfo(name="interactive", weight=2)
+        order = []
+        gate = asyncio.Event()
+        # 第一個請求佔住名額，隨後批處理租戶先到 6 個，交互租戶後到 3 個
+        tasks = [asyncio.create_task(_request(controller, batch, order, gate))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(_request(controller, batch, order, gate)) for _ in range(6)]
+        tasks += [asyncio.create_task(_request(controller, interactive, order, gate)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert controller.active == 1 and controller.queued == 9
+        gate.set()
+        await asyncio.gather(*tasks)
+        return order, controller
+
+    order, controller = asyncio.run(run())
+    # 交互租戶權重為 2，每輪放行兩個，不必等批處理租戶的隊列清空
+    assert order[:7] == ["batch", "batch", "interactive", "interactive", "batch", "interactive", "batch"], order
+    assert controller.active == 0 and controller.queued == 0
+    print("  ✅ 測試通過: 按權重輪轉放行")
+
+
+def test_tenant_limits_and_retry_after():
+    """RPM 與租戶並發上限，超出時返回 429 與 Retry-After；受限租戶不阻塞其他租戶"""
+    print("測試租戶限額...")
+
+    async def run():
+        controller = AdmissionController(max_concurrency=10, max_queue=1, queue_timeout=0.05)
+        limited = TokenInfo(name="limited", rpm=2, concurrency=1)
+        other = TokenInfo(name="other")
+        gate = asyncio.Event()
+        order = []
+        first = asyncio.create_task(_request(controller, limited, order, gate))
+        await asyncio.sleep(0)
+        # 同一租戶的第二個請求排隊並超時
+        try:
+            await _request(controller, limited, order, gate)
+        except RateLimitExceededError as e:
+            assert e.status_code == 429 and "queued" in e.detail
+        else:
+            raise AssertionError("expected RateLimitExceededError")
+        # 其他租戶不受影響
+        other_task = asyncio.create_task(_request(controller, other, order, gate))
+        await asyncio.sleep(0)
+        assert order == ["limited", "other"]
+        # RPM 已用完，按令牌桶給出準確的等待時間
+        try:
+            await _request(controller, limited, order, gate)
+        except RateLimitExceededError as e:
+            assert "rpm" in e.detail and e.headers["Retry-After"] == "30", e.headers
+        else:
+            raise AssertionError("expected RateLimitExceededError")
+        gate.set()
+        await asyncio.gather(first, other_task)
+        return controller
+
+    controller = asyncio.run(run())
+    stats = controller.stats()
+    assert stats["rejected"] == 2 and stats["tenants"]["limited"]["rejected"] == 2
+    print("  ✅ 測試通過: 超出限額返回 429")
+
+
+def test_middleware():
+    """中間件只限制生成類接口，無效令牌交給認證處理"""
+    print("測試準入中間件...")
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat():
+        return {"ok": True}
+
+    @app.get("/v1/models")
+    async def models():
+        return {"ok": True}
+
+    store = TokenStore(["sk-1"], "sk-admin", default_rpm=1)
+    controller = AdmissionController(max_concurrency=4, max_queue=4, queue_timeout=1)
+    app.add_middleware(AdmissionMiddleware, controller=controller, token_store=store)
+    client = TestClient(app)
+    headers = {"Authorization": "Bearer sk-1"}
+    assert client.post("/v1/chat/completions", headers=headers).status_code == 200
+    response = client.post("/v1/chat/completions", headers=headers)
+    assert response.status_code == 429 and int(response.headers["Retry-After"]) > 0
+    assert response.json()["error"]["code"] == "rate_limit_exceeded"
+    assert client.get("/v1/models", headers=headers).status_code == 200
+    assert client.post("/v1/chat/completions", headers={"Authorization": "Bearer bad"}).status_code == 200
+    assert client.post("/v1/chat/completions", headers={"Authorization": "Bearer sk-admin"}).status_code == 200
+    assert controller.active == 0
+    print("  ✅ 測試通過: 中間件按接口與令牌限流")
+
+
+def test_unlimited_and_rpm_without_middleware():
+    """全局並發默認不限制；關閉準入控制時 RPM 在認證時檢查"""
+    print("測試默認不限制全局並發...")
+
+    async def run():
+        controller = AdmissionController(max_concurrency=0, max_queue=0, queue_timeout=0.05)
+        gate = asyncio.Event()
+        order = []
+        tasks = [asyncio.create_task(_request(controller, TokenInfo(name=f"t{i}"), order, gate)) for i in range(100)]
+        await asyncio.sleep(0)
+        assert controller.active == 100 and controller.queued == 0
+        gate.set()
+        await asyncio.gather(*tasks)
+
+        service = SecurityService([], "sk-admin", token_store=TokenStore(["sk-1"], "sk-admin", default_rpm=1))
+        service.enforce_rpm = True
+        assert await service.verify_authorization("Bearer sk-1") == "sk-1"
+        try:
+            await service.verify_authorization("Bearer sk-1")
+        except RateLimitExceededError as e:
+            assert e.status_code == 429 and int(e.headers["Retry-After"]) > 0
+        else:
+            raise AssertionError("expected RateLimitExceededError")
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 並發不限制，RPM 仍然生效")
+
+
+def main():
+    test_weighted_fair_queuing()
+    test_tenant_limits_and_retry_after()
+    test_middleware()
+    test_unlimited_and_rpm_without_middleware()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from app.handler.chunk_template import GeminiChunkTemplate, OpenAIChunkTemplate
+
+
+def _parse(event: str) -> dict:
+    assert event.startswith("data: ") and event.endswith("\n\n"), repr(event)
+    return json.loads(event[6:])
+
+
+def test_openai_template_matches_chunk_layout():
+    """模板輸出與逐塊構建的字典結構一致，並共用同一個 id"""
+    print("測試 OpenAI 塊模板...")
+    template = OpenAIChunkTemplate("gemini-1.5-flash", chunk_id="chatcmpl-1", created=123)
+    text = 'He said "hi"\n\t\\ 你好  '
+    expected = {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 123,
+        "model": "gemini-1.5-flash",
+        "choices": [{"index": 0, "delta": {"content": text, "role": "assistant"}, "finish_reason": None}],
+    }
+    assert _parse(template.content(text)) == expected
+
+    finish = _parse(template.finish("stop"))
+    assert finish["choices"] == [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+    assert finish["id"] == "chatcmpl-1"
+    assert template.finish("stop") is template.finish("stop")
+
+    tool_delta = {"content": "", "role": "assistant", "tool_calls": [{"index": 0, "id": "call_x"}]}
+    assert _parse(template.chunk(tool_delta))["choices"][0]["delta"] == tool_delta
+    print("  ✅ 測試通過: OpenAI 模板輸出正確")
+
+
+def test_gemini_template_splices_text():
+    """Gemini 模板只替換文本部分，其餘字段保持不變"""
+    print("測試 Gemini 塊模板...")
+    response = {
+        "candidates": [
+            {
+                "content": {"parts": [{"text": "Hello world"}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }
+        ],
+        "usageMetadata": {"totalTokenCount": 7},
+    }
+    template = GeminiChunkTemplate(response, "Hello world")
+
+    whole = _parse(template.content("Hello world"))
+    assert whole == response
+
+    piece = _parse(template.content('wo"r'))
+    assert piece["candidates"][0]["content"]["parts"][0]["text"] == 'wo"r'
+    assert piece["usageMetadata"] == response["usageMetadata"]
+    # 原始響應不應被修改
+    assert response["candidates"][0]["content"]["parts"][0]["text"] == "Hello world"
+    print("  ✅ 測試通過: Gemini 模板輸出正確")
+
+
+def main():
+    test_openai_template_matches_chunk_layout()
+    test_gemini_template_splices_text()
+
+
+if __name__ == "__main__":
+    main()
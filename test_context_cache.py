@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.domain.gemini_models import GeminiRequest
+from app.exception.exceptions import UpstreamError
+from app.service.chat import gemini_chat_service
+from app.service.chat.context_cache import ContextCacheManager
+from app.service.chat.gemini_chat_service import GeminiChatService
+from app.service.client import http_client
+from app.service.client.api_client import GeminiApiClient
+from app.service.key.key_manager import KeyManager
+
+BASE_URL = "https://upstream.test/v1beta"
+SYSTEM_PROMPT = "You are a careful agent. " * 200
+
+
+class FakeUpstream:
+    """模擬 cachedContents 與 generateContent 接口，記錄收到的請求"""
+
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        self.generated = []
+        # 緩存名 -> 引用該緩存時返回的狀態碼
+        self.rejected = {}
+        # 上游統計的緩存 token 數
+        self.cached_tokens = 1500
+
+    def handler(self, request: httpx.Request):
+        path = request.url.path
+        key = request.url.params["key"]
+        body = json.loads(request.content) if request.content else None
+        if path.endswith("/cachedContents"):
+            self.created.append((key, body))
+            name = f"cachedContents/c{len(self.created)}"
+            return httpx.Response(200, json={"name": name, "usageMetadata": {"totalTokenCount": self.cached_tokens}})
+        if "/cachedContents/" in path:
+            target = (key, path.split("/v1beta/")[1])
+            (self.updated if request.method == "PATCH" else self.deleted).append(target)
+            return httpx.Response(200, json={})
+        self.generated.append((key, body))
+        status = self.rejected.get(body.get("cachedContent"))
+        if status:
+            return httpx.Response(status, json={"error": {"code": status, "message": "rejected"}})
+        event = {"candidates": [{"content": {"parts": [{"text": "ok"}], "role": "model"}, "index": 0}]}
+        if path.endswith(":streamGenerateContent"):
+            return httpx.Response(200, content=f"data: {json.dumps(event)}\n\n".encode(), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=event)
+
+
+def _manager(**overrides):
+    options = dict(enabled=True, min_tokens=1000, min_repeats=2, ttl=600, max_per_key=4)
+    options.update(overrides)
+    return ContextCacheManager(GeminiApiClient(BASE_URL), **options)
+
+
+def _request(turns, system=SYSTEM_PROMPT):
+    contents = [
+        {"role": "user" if index % 2 == 0 else "model", "parts": [{"text": f"turn {index}"}]}
+        for index in range(turns)
+    ]
+    return GeminiRequest(contents=contents, systemInstruction={"parts": [{"text": system}]})
+
+
+def _run(manager, run):
+    upstream = FakeUpstream()
+    original = gemini_chat_service.context_cache
+    gemini_chat_service.context_cache = manager
+
+    async def wrapper():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            return await run(upstream)
+        finally:
+            await http_client.close_http_client()
+
+    try:
+        return asyncio.run(wrapper()), upstream
+    finally:
+        gemini_chat_service.context_cache = original
+
+
+async def _settle(manager):
+    while manager._tasks:
+        await asyncio.gather(*manager._tasks)
+
+
+def test_prefix_detection_and_reuse():
+    """前綴重複出現後在後台創建緩存，之後的請求引用緩存並只發送其餘 contents"""
+    print("測試前綴緩存...")
+    manager = _manager()
+
+    async def run(upstream):
+        # 上游統計的 token 數與估算值不同，是否創建更長的緩存只按估算值判斷
+        upstream.cached_tokens = 1
+        service = GeminiChatService(BASE_URL, KeyManager(["k1"]))
+        await service.generate_content("gemini-1.5-flash", _request(1), "k1")
+        await _settle(manager)
+        assert not upstream.created
+        # 第二輪: 系統提示第二次出現，後台創建緩存，本次仍發送完整請求
+        await service.generate_content("gemini-1.5-flash", _request(3), "k1")
+        await _settle(manager)
+        assert len(upstream.created) == 1
+        # 第三輪: 引用緩存
+        await service.generate_content("gemini-1.5-flash", _request(5), "k1")
+        await _settle(manager)
+
+    _, upstream = _run(manager, run)
+    key, body = upstream.created[0]
+    assert key == "k1" and body["model"] == "models/gemini-1.5-flash" and body["ttl"] == "600s"
+    assert body["systemInstruction"]["parts"][0]["text"] == SYSTEM_PROMPT and "contents" not in body
+    assert "cachedContent" not in upstream.generated[1][1]
+    sent = upstream.generated[2][1]
+    assert sent["cachedContent"] == "cachedContents/c1" and "systemInstruction" not in sent
+    assert [content["parts"][0]["text"] for content in sent["contents"]] == [f"turn {i}" for i in range(5)]
+    # 未緩存部分不夠長，不會再創建更長的緩存
+    assert len(upstream.created) == 1
+    stats = manager.stats()
+    assert stats["hits"] == 1 and stats["created"] == 1 and stats["entries"] == 1
+    print("  ✅ 測試通過: 緩存創建與引用正確")
+
+
+def test_stale_cache_falls_back():
+    """上游已刪除的緩存被拒絕時丟棄緩存並用完整請求重發，密鑰不會被禁用"""
+    print("測試緩存失效...")
+    manager = _manager(min_repeats=1)
+
+    async def run(upstream):
+        key_manager = KeyManager(["k1"])
+        service = GeminiChatService(BASE_URL, key_manager)
+        await service.generate_content("gemini-1.5-flash", _request(1), "k1")
+        await _settle(manager)
+        upstream.rejected["cachedContents/c1"] = 403
+        lines = [
+            line async for line in service.stream_generate_content("gemini-1.5-flash", _request(1), "k1", "passthrough")
+        ]
+        await _settle(manager)
+        return key_manager, lines
+
+    (key_manager, lines), upstream = _run(manager, run)
+    assert json.loads(lines[0][6:])["candidates"][0]["content"]["parts"][0]["text"] == "ok"
+    assert upstream.generated[1][1]["cachedContent"] == "cachedContents/c1"
+    assert "cachedContent" not in upstream.generated[2][1] and "systemInstruction" in upstream.generated[2][1]
+    assert "k1" not in key_manager.get_disabled_keys()
+    assert manager.stats()["entries"] == 0
+    # 丟棄的緩存可能仍在上游，同時刪除
+    assert upstream.deleted == [("k1", "cachedContents/c1")]
+    print("  ✅ 測試通過: 失效緩存已丟棄")
+
+
+def test_bad_request_is_not_resent():
+    """引用緩存的請求返回 400 時直接拋出，不用完整請求重發，緩存保留"""
+    print("測試 400 錯誤...")
+    manager = _manager(min_repeats=1)
+
+    async def run(upstream):
+        api_client = GeminiApiClient(BASE_URL)
+        payload = _request(1).model_dump(exclude_none=True)
+        plan = manager.plan("gemini-1.5-flash", payload)
+        await manager.generate_content(api_client, plan, payload, "gemini-1.5-flash", "k1")
+        await _settle(manager)
+        upstream.rejected["cachedContents/c1"] = 400
+        plan = manager.plan("gemini-1.5-flash", payload)
+        try:
+            await manager.generate_content(api_client, plan, payload, "gemini-1.5-flash", "k1")
+        except UpstreamError as e:
+            assert e.status_code == 400
+        else:
+            raise AssertionError("expected UpstreamError")
+        await _settle(manager)
+
+    _, upstream = _run(manager, run)
+    assert len(upstream.generated) == 2 and upstream.generated[1][1]["cachedContent"] == "cachedContents/c1"
+    assert manager.stats()["entries"] == 1 and not upstream.deleted
+    print("  ✅ 測試通過: 參數錯誤不重發")
+
+
+def test_per_key_eviction_and_extend():
+    """緩存按密鑰隔離；超出每個密鑰的上限時刪除最久未使用的緩存；臨近過期時延長 TTL"""
+    print("測試按密鑰淘汰...")
+    manager = _manager(min_repeats=1, max_per_key=1)
+
+    async def run(upstream):
+        service = GeminiChatService(BASE_URL, KeyManager(["k1", "k2"]))
+        await service.generate_content("gemini-1.5-flash", _request(1), "k1")
+        await _settle(manager)
+        # 其他密鑰不能引用 k1 的緩存，為 k2 另行創建
+        await service.generate_content("gemini-1.5-flash", _request(1), "k2")
+        await _settle(manager)
+        assert "cachedContent" not in upstream.generated[1][1] and len(upstream.created) == 2
+        # k1 的第二個前綴淘汰第一個
+        await service.generate_content("gemini-1.5-flash", _request(1, system="Another agent. " * 400), "k1")
+        await _settle(manager)
+        # 臨近過期的緩存被引用時續期
+        entry = next(iter(manager._entries["k2"].values()))
+        entry.expires_at -= 400
+        await service.generate_content("gemini-1.5-flash", _request(1), "k2")
+        await _settle(manager)
+
+    _, upstream = _run(manager, run)
+    assert [key for key, _ in upstream.created] == ["k1", "k2", "k1"]
+    assert upstream.deleted == [("k1", "cachedContents/c1")]
+    assert upstream.updated == [("k2", "cachedContents/c2")]
+    assert upstream.generated[-1][1]["cachedContent"] == "cachedContents/c2"
+    assert manager.stats()["evicted"] == 1 and manager.stats()["entries"] == 2
+    print("  ✅ 測試通過: 按密鑰管理緩存")
+
+
+def test_short_prompts_are_ignored():
+    """前綴不夠長或未啟用時不計算緩存計劃"""
+    print("測試短前綴...")
+    manager = _manager()
+    assert manager.plan("gemini-1.5-flash", {"contents": [{"parts": [{"text": "hi"}]}], "systemInstruction": "short"}) is None
+    disabled = _manager(enabled=False)
+    payload = {"contents": [{"parts": [{"text": "hi"}]}], "systemInstruction": {"parts": [{"text": SYSTEM_PROMPT}]}}
+    assert disabled.plan("gemini-1.5-flash", payload) is None
+    assert manager.plan("gemini-1.5-flash", payload) is not None
+    print("  ✅ 測試通過: 短前綴不使用緩存")
+
+
+def main():
+    test_prefix_detection_and_reuse()
+    test_stale_cache_falls_back()
+    test_bad_request_is_not_resent()
+    test_per_key_eviction_and_extend()
+    test_short_prompts_are_ignored()
+
+
+if __name__ == "__main__":
+    main()
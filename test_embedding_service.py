@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from array import array
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.config.config import settings
+from app.exception.exceptions import UpstreamError
+from app.service.client import http_client
+from app.service.embedding.embedding_cache import EmbeddingCache, cache_key
+from app.service.embedding.embedding_service import EmbeddingService, split_batches
+from app.service.key.key_manager import KeyManager
+
+MODEL = "text-embedding-004"
+
+
+class FakeUpstream:
+    """以輸入文本長度作為向量，記錄每次請求的密鑰與批次，並可按密鑰返回錯誤"""
+
+    def __init__(self, errors=None, delay=0.0):
+        self.errors = errors or {}
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handler(self, request: httpx.Request):
+        key = request.headers["authorization"].split(" ", 1)[1]
+        body = json.loads(request.content)
+        self.requests.append((key, body["input"]))
+        if key in self.errors:
+            return httpx.Response(self.errors[key], json={"error": {"code": self.errors[key], "message": "boom"}})
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        # 倒序返回，驗證合併時按 index 排序
+        data = [
+            {"object": "embedding", "index": i, "embedding": [float(len(text))]}
+            for i, text in reversed(list(enumerate(inputs)))
+        ]
+        return httpx.Response(200, json={
+            "object": "list",
+            "data": data,
+            "model": MODEL,
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        })
+
+
+def _run(upstream, input_text, keys=("k1", "k2", "k3", "k4"), batch_size=3, concurrency=4, cache=None):
+    originals = settings.EMBEDDING_BATCH_SIZE, settings.EMBEDDING_CONCURRENCY
+    settings.EMBEDDING_BATCH_SIZE, settings.EMBEDDING_CONCURRENCY = batch_size, concurrency
+
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            manager = KeyManager(list(keys))
+            service = EmbeddingService("https://upstream.test/v1beta", cache=cache)
+            response = await service.create_embedding(input_text, MODEL, "k1", key_manager=manager)
+            return response, manager
+        finally:
+            await http_client.close_http_client()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        settings.EMBEDDING_BATCH_SIZE, settings.EMBEDDING_CONCURRENCY = originals
+
+
+def test_split_batches():
+    """均勻切分批次"""
+    print("測試批次切分...")
+    assert [len(batch) for _, batch in split_batches(list(range(101)), 100)] == [51, 50]
+    assert [start for start, _ in split_batches(list(range(7)), 3)] == [0, 3, 5]
+    assert split_batches(list(range(3)), 100) == [(0, [0, 1, 2])]
+    print("  ✅ 測試通過: 批次大小均勻")
+
+
+def test_batches_run_concurrently_across_keys():
+    """大列表切分後在多個密鑰上並發請求，結果按原順序合併"""
+    print("測試並發批次...")
+    texts = ["a" * n for n in range(1, 11)]
+    upstream = FakeUpstream(delay=0.05)
+    response, _ = _run(upstream, texts)
+    assert [item.index for item in response.data] == list(range(10))
+    assert [item.embedding[0] for item in response.data] == [float(n) for n in range(1, 11)]
+    assert response.usage.total_tokens == 10
+    assert len(upstream.requests) == 4 and upstream.max_in_flight == 4
+    assert len({key for key, _ in upstream.requests}) == 4, upstream.requests
+    print("  ✅ 測試通過: 批次分佈到多個密鑰並按順序合併")
+
+
+def test_failed_batch_rotates_key():
+    """批次失敗時換密鑰重試，無效密鑰被禁用；請求錯誤不重試"""
+    print("測試批次重試...")
+    upstream = FakeUpstream(errors={"k2": 401})
+    response, manager = _run(upstream, ["x"] * 6, keys=("k1", "k2"))
+    assert len(response.data) == 6
+    assert "k2" in manager.get_disabled_keys()
+    assert [key for key, _ in upstream.requests].count("k1") == 2
+
+    upstream = FakeUpstream(errors={"k1": 400})
+    try:
+        _run(upstream, "hello", keys=("k1", "k2"))
+    except UpstreamError as e:
+        assert e.status_code == 400
+    else:
+        raise AssertionError("expected UpstreamError")
+    assert len(upstream.requests) == 1
+    print("  ✅ 測試通過: 失敗時正確換密鑰")
+
+
+def test_cache_partial_hits():
+    """列表輸入中只有未命中（且去重後）的文本發往上游，結果按原順序組裝"""
+    print("測試嵌入快取部分命中...")
+    cache = EmbeddingCache(memory_bytes=1024 * 1024)
+    upstream = FakeUpstream()
+    _run(upstream, ["a", "bb"], cache=cache)
+
+    response, _ = _run(upstream, [" a", "ccc", "bb", "ccc"], cache=cache)
+    assert upstream.requests[-1][1] == ["ccc"], upstream.requests
+    assert [item.embedding[0] for item in response.data] == [1.0, 3.0, 2.0, 3.0]
+    assert [item.index for item in response.data] == [0, 1, 2, 3]
+
+    requests = len(upstream.requests)
+    response, _ = _run(upstream, "ccc", cache=cache)
+    assert len(upstream.requests) == requests and response.data[0].embedding == [3.0]
+    stats = cache.stats()
+    assert stats["misses"] == 4 and stats["memory_hits"] == 3, stats
+    print("  ✅ 測試通過: 只請求未命中的文本")
+
+
+def test_disk_cache_survives_restart():
+    """磁盤層重啟後仍可命中，寫到一半的索引記錄被丟棄"""
+    print("測試磁盤快取持久化...")
+    with tempfile.TemporaryDirectory() as directory:
+        cache = EmbeddingCache(memory_bytes=1024, directory=directory, disk_max_bytes=1024 * 1024)
+        vectors = [(cache_key(MODEL, f"text {i}"), array("f", [i, i + 0.5, -i])) for i in range(50)]
+        asyncio.run(cache.put_many(vectors))
+        cache.close()
+        with open(os.path.join(directory, "vectors.idx"), "ab") as index:
+            index.write(b"\x00" * 17)
+
+        cache = EmbeddingCache(memory_bytes=1024, directory=directory, disk_max_bytes=1024 * 1024)
+        assert len(cache.disk) == 50
+        assert list(cache.get(cache_key(MODEL, "text 7"))) == [7.0, 7.5, -7.0]
+        assert list(cache.get(cache_key(f"models/{MODEL}", "text 7 "))) == [7.0, 7.5, -7.0]
+        assert cache.get(cache_key("other-model", "text 7")) is None
+        # 截斷記錄之後的寫入仍然有效
+        asyncio.run(cache.put_many([(cache_key(MODEL, "new"), array("f", [1.0]))]))
+        assert cache.disk.get(cache_key(MODEL, "new")) == array("f", [1.0])
+        assert cache.stats()["disk_hits"] == 1
+        cache.close()
+
+        cache = EmbeddingCache(memory_bytes=1024, directory=directory, disk_max_bytes=1024 * 1024)
+        assert len(cache.disk) == 51
+        cache.close()
+    print("  ✅ 測試通過: 重啟後命中")
+
+
+def main():
+    test_split_batches()
+    test_batches_run_concurrently_across_keys()
+    test_failed_batch_rotates_key()
+    test_cache_partial_hits()
+    test_disk_cache_survives_restart()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from app.exception.exceptions import UpstreamError
+from app.handler.hedge_handler import RequestHedger
+from app.service.key.key_manager import KeyManager
+
+MODEL = "gemini-1.5-flash"
+
+
+class FakeUpstream:
+    """按密鑰模擬延遲與錯誤，並記錄被取消的請求"""
+
+    def __init__(self, key_manager, delays, errors=None):
+        self.key_manager = key_manager
+        self.delays = delays
+        self.errors = errors or {}
+        self.calls = []
+        self.cancelled = []
+
+    async def attempt(self, key):
+        self.calls.append(key)
+        with self.key_manager.track(key, MODEL):
+            try:
+                await asyncio.sleep(self.delays.get(key, 0.0))
+            except asyncio.CancelledError:
+                self.cancelled.append(key)
+                raise
+            if key in self.errors:
+                raise self.errors[key]
+            return key
+
+
+def _warm_hedger(max_ratio=1.0):
+    hedger = RequestHedger(enabled=True, percentile=90, min_delay=0.02, max_ratio=max_ratio, min_samples=5)
+    for _ in range(10):
+        hedger.record(MODEL, 0.01)
+    return hedger
+
+
+def test_no_hedge_until_enough_samples():
+    """樣本不足時不對衝"""
+    print("測試樣本不足時不對衝...")
+
+    async def run():
+        manager = KeyManager(["k1", "k2"])
+        upstream = FakeUpstream(manager, {"k1": 0.05})
+        hedger = RequestHedger(enabled=True, min_delay=0.01, max_ratio=1.0, min_samples=5)
+        assert await hedger.run(manager, MODEL, "k1", upstream.attempt) == "k1"
+        assert upstream.calls == ["k1"]
+        assert len(hedger._latencies[MODEL].samples) == 1
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 樣本不足時直接等待主請求")
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    """主請求超過閾值後換密鑰對衝，先返回的勝出，落後的被取消並釋放在途計數"""
+    print("測試對衝請求...")
+
+    async def run():
+        manager = KeyManager(["k1", "k2"])
+        upstream = FakeUpstream(manager, {"k1": 1.0, "k2": 0.01})
+        hedger = _warm_hedger()
+        assert await hedger.run(manager, MODEL, "k1", upstream.attempt) == "k2"
+        assert upstream.calls == ["k1", "k2"] and upstream.cancelled == ["k1"]
+        assert all(stats.in_flight == 0 for stats in manager.scheduler.stats.values())
+        # 被取消的主請求以已等待的時間記入樣本，不低於對衝閾值
+        assert hedger._latencies[MODEL].samples[-1] >= 0.02
+
+        # 主請求在閾值內返回時不對衝
+        upstream = FakeUpstream(manager, {"k1": 0.001})
+        assert await hedger.run(manager, MODEL, "k1", upstream.attempt) == "k1"
+        assert upstream.calls == ["k1"]
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 對衝請求勝出")
+
+
+def test_hedge_budget_caps_extra_requests():
+    """對衝次數不超過請求數的 max_ratio"""
+    print("測試對衝預算...")
+
+    async def run():
+        manager = KeyManager(["k1", "k2"])
+        upstream = FakeUpstream(manager, {"k1": 0.05, "k2": 0.05})
+        hedger = _warm_hedger(max_ratio=0.25)
+        hedger.min_delay = 0.01
+        hedger.record = lambda model, latency: None
+        await asyncio.gather(*[hedger.run(manager, MODEL, "k1", upstream.attempt) for _ in range(8)])
+        hedges = len(upstream.calls) - 8
+        assert hedges == 2, upstream.calls
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 對衝次數受限")
+
+
+def test_failed_primary_falls_back_to_hedge():
+    """主請求失敗時使用對衝結果，並記錄主請求密鑰的失敗；兩者都失敗時拋出主請求錯誤"""
+    print("測試對衝失敗處理...")
+
+    async def run():
+        manager = KeyManager(["k1", "k2"])
+        hedger = _warm_hedger()
+        error = UpstreamError(500, "boom")
+        upstream = FakeUpstream(manager, {"k1": 0.05, "k2": 0.1}, errors={"k1": error})
+        assert await hedger.run(manager, MODEL, "k1", upstream.attempt) == "k2"
+        assert manager.get_fail_count("k1") == 1
+
+        manager = KeyManager(["k1", "k2"])
+        upstream = FakeUpstream(manager, {"k1": 0.05, "k2": 0.06}, errors={"k1": error, "k2": UpstreamError(503, "down")})
+        try:
+            await hedger.run(manager, MODEL, "k1", upstream.attempt)
+        except UpstreamError as e:
+            assert e is error
+        else:
+            raise AssertionError("expected UpstreamError")
+        # 主請求的失敗交給外層重試處理，這裡只記錄對衝密鑰
+        assert manager.get_fail_count("k1") == 0 and manager.get_fail_count("k2") == 1
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 失敗時正確回退")
+
+
+def main():
+    test_no_hedge_until_enough_samples()
+    test_slow_primary_is_hedged_and_cancelled()
+    test_hedge_budget_caps_extra_requests()
+    test_failed_primary_falls_back_to_hedge()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import asyncio
+import base64
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.handler import message_converter
+from app.handler.message_converter import OpenAIMessageConverter
+from app.service.client import http_client
+from app.utils.cache import ByteSizeLRUCache
+from app.utils.image_fetcher import ImageFetcher, ImageFetchError, sniff_mime_type
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 32
+WEBP = b"RIFF\x00\x00\x00\x00WEBPVP8 " + b"\x00" * 32
+
+
+class FakeImageServer:
+    """模擬圖片服務，記錄請求次數與最大並發數"""
+
+    def __init__(self):
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handler(self, request: httpx.Request):
+        path = request.url.path
+        self.requests.append(path)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            self.active -= 1
+        if path == "/cat.jpg":
+            # 響應頭聲明的類型是錯的，以文件頭為準
+            return httpx.Response(200, content=JPEG, headers={"content-type": "image/png"})
+        if path == "/dog.webp":
+            return httpx.Response(200, content=WEBP)
+        if path == "/huge.png":
+            return httpx.Response(200, content=PNG * 1000)
+        if path.startswith("/img"):
+            return httpx.Response(200, content=PNG)
+        return httpx.Response(404)
+
+
+def _run(coro_factory):
+    server = FakeImageServer()
+
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(server.handler))
+        try:
+            return await coro_factory()
+        finally:
+            await http_client.close_http_client()
+
+    return asyncio.run(run()), server
+
+
+def test_byte_size_lru_cache():
+    """按字節數淘汰最久未使用的條目"""
+    print("測試按字節數限制的 LRU 緩存...")
+    cache = ByteSizeLRUCache(max_bytes=10)
+    cache.put("a", "aaaa", 4)
+    cache.put("b", "bbbb", 4)
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc", 4)
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.total_bytes == 8
+    cache.put("huge", "x" * 11, 11)
+    assert "huge" not in cache and len(cache) == 2
+    print("  ✅ 測試通過: LRU 淘汰正確")
+
+
+def test_sniff_mime_type():
+    """按文件頭識別圖片類型"""
+    print("測試 MIME 類型識別...")
+    assert sniff_mime_type(PNG) == "image/png"
+    assert sniff_mime_type(JPEG, "image/png") == "image/jpeg"
+    assert sniff_mime_type(WEBP) == "image/webp"
+    assert sniff_mime_type(b"\x00\x00\x00\x18ftypheic") == "image/heic"
+    assert sniff_mime_type(b"unknown", "image/jpg; charset=binary") == "image/jpeg"
+    print("  ✅ 測試通過: MIME 類型識別正確")
+
+
+def test_fetch_many_is_concurrent_cached_and_bounded():
+    """並發下載、相同 URL 只下載一次、結果被緩存、超限圖片報錯"""
+    print("測試並發下載與緩存...")
+    fetcher = ImageFetcher(max_bytes=1024, timeout=5, cache_bytes=1024 * 1024, concurrency=3)
+    urls = [f"https://img.test/img{i}.png" for i in range(6)] + ["https://img.test/img0.png"]
+
+    async def run():
+        first = await fetcher.fetch_many(urls + ["https://img.test/huge.png", "ftp://img.test/x.png"])
+        second = await fetcher.fetch_many(urls)
+        return first, second
+
+    (first, second), server = _run(run)
+    assert first["https://img.test/img0.png"] == ("image/png", base64.b64encode(PNG).decode())
+    assert isinstance(first["https://img.test/huge.png"], ImageFetchError)
+    assert isinstance(first["ftp://img.test/x.png"], ImageFetchError)
+    assert server.max_active == 3, server.max_active
+    # 7 個唯一 http URL 各請求一次，第二輪全部命中緩存
+    assert len(server.requests) == 7, server.requests
+    assert second == {url: first[url] for url in urls}
+    print("  ✅ 測試通過: 並發下載並緩存結果")
+
+
+def test_converter_fetches_images_concurrently():
+    """消息轉換器並發下載對話中的所有圖片並識別真實類型"""
+    print("測試消息轉換器...")
+    message_converter.image_fetcher.cache.clear()
+    messages = [
+        {"role": "system", "content": "be helpful"},
+        {"role": "user", "content": [
+            {"type": "text", "text": "what is this"},
+            {"type": "image_url", "image_url": {"url": "https://img.test/cat.jpg"}},
+            {"type": "image_url", "image_url": {"url": "data:image/jpg;base64,AAAA"}},
+        ]},
+        {"role": "assistant", "content": "![dog](https://img.test/dog.webp)\n\n![gone](https://img.test/missing.png)"},
+        {"role": "user", "content": "and this?"},
+    ]
+    (result, instruction), server = _run(lambda: OpenAIMessageConverter().convert(messages))
+    assert instruction == {"role": "system", "parts": [{"text": "be helpful"}]}
+    user_parts = result[0]["parts"]
+    assert user_parts[1] == {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(JPEG).decode()}}
+    assert user_parts[2] == {"inline_data": {"mime_type": "image/jpeg", "data": "AAAA"}}
+    model_parts = result[1]["parts"]
+    assert model_parts[0] == {"inlineData": {"mimeType": "image/webp", "data": base64.b64encode(WEBP).decode()}}
+    # 下載失敗的 Markdown 圖片回退為文本
+    assert model_parts[1] == {"text": "![gone](https://img.test/missing.png)"}
+    assert server.max_active == 3
+    print("  ✅ 測試通過: 消息轉換器並發下載圖片")
+
+
+def main():
+    test_byte_size_lru_cache()
+    test_sniff_mime_type()
+    test_fetch_many_is_concurrent_cached_and_bounded()
+    test_converter_fetches_images_concurrently()
+
+
+if __name__ == "__main__":
+    main()
@@ -59,7 +59,8 @@ async def test_image_generation_with_key_rotation():
         # 設置mock客戶端的行為
         client_instance = mock_client.return_value
         models_attr = AsyncMock()
-        client_instance.models = models_attr
+        client_instance.aio = AsyncMock()
+        client_instance.aio.models = models_attr
         
         # 設置模擬的 generate_images 方法
         generate_images_mock = AsyncMock()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from fastapi.testclient import TestClient
+
+from app.config.config import settings
+from app.core.application import create_app
+from app.domain.openai_models import ImageGenerationRequest
+from app.exception.exceptions import ServiceUnavailableError
+from app.service.image import image_create_service
+from app.service.image.image_limiter import ImageGenerationLimiter
+
+
+async def _hold(limiter, key, delay, events):
+    async with limiter.slot(key):
+        events.append(("start", key))
+        await asyncio.sleep(delay)
+    events.append(("end", key))
+
+
+def test_concurrency_caps():
+    """全局與單密鑰並發受限，密鑰已滿的請求不阻塞其他密鑰"""
+    print("測試並發上限...")
+
+    async def run():
+        limiter = ImageGenerationLimiter(max_concurrency=2, per_key_concurrency=1, max_queue=10, queue_timeout=5)
+        events = []
+        tasks = [
+            asyncio.create_task(_hold(limiter, key, 0.05, events))
+            for key in ("k1", "k1", "k2")
+        ]
+        await asyncio.sleep(0.01)
+        # 第二個 k1 排隊，k2 越過它直接運行
+        assert events == [("start", "k1"), ("start", "k2")], events
+        assert limiter.active == 2 and limiter.queue_depth == 1
+        await asyncio.gather(*tasks)
+        assert limiter.active == 0 and limiter.queue_depth == 0
+        stats = limiter.stats()
+        assert stats["total_requests"] == 3 and stats["max_wait_seconds"] >= 0.04, stats
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 並發受限且按密鑰放行")
+
+
+def test_rejects_when_saturated():
+    """隊列已滿或排隊超時時返回 503 與 Retry-After，且名額不洩漏"""
+    print("測試飽和拒絕...")
+
+    async def run():
+        limiter = ImageGenerationLimiter(max_concurrency=1, per_key_concurrency=1, max_queue=1, queue_timeout=0.05)
+        events = []
+        running = asyncio.create_task(_hold(limiter, "k1", 0.2, events))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(_hold(limiter, "k2", 0, events))
+        await asyncio.sleep(0.01)
+
+        try:
+            await _hold(limiter, "k3", 0, events)
+        except ServiceUnavailableError as e:
+            assert e.status_code == 503 and int(e.headers["Retry-After"]) >= 1
+        else:
+            raise AssertionError("expected queue full rejection")
+
+        try:
+            await queued
+        except ServiceUnavailableError as e:
+            assert "queued" in e.detail
+        else:
+            raise AssertionError("expected queue timeout rejection")
+
+        await running
+        assert limiter.rejected == 2 and limiter.active == 0 and limiter.queue_depth == 0
+
+        # 排隊中的請求被取消時從隊列移除
+        running = asyncio.create_task(_hold(limiter, "k1", 0.05, events))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(_hold(limiter, "k1", 0, events))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        await running
+        assert limiter.active == 0 and limiter.queue_depth == 0
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 飽和時拒絕")
+
+
+def test_generation_does_not_block_event_loop():
+    """圖片生成使用 SDK 異步接口，生成期間事件循環仍可處理其他任務"""
+    print("測試不阻塞事件循環...")
+
+    async def slow_generate(**kwargs):
+        await asyncio.sleep(0.2)
+        image = MagicMock()
+        image.image.image_bytes = b"\x89PNG\r\n\x1a\nfake"
+        return MagicMock(generated_images=[image])
+
+    async def run():
+        service = image_create_service.ImageCreateService()
+        service.get_paid_key = AsyncMock(return_value="paid-key")
+        request = ImageGenerationRequest(prompt="a cat", response_format="b64_json")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        key_manager = MagicMock()
+        with patch("google.genai.Client") as client_class, patch.object(
+            image_create_service, "get_key_manager_instance", AsyncMock(return_value=key_manager)
+        ):
+            client_class.return_value.aio = AsyncMock()
+            client_class.return_value.aio.models.generate_images = slow_generate
+            ticking = asyncio.create_task(ticker())
+            start = time.monotonic()
+            response = await service.generate_images(request)
+            ticking.cancel()
+        assert time.monotonic() - start >= 0.2
+        assert ticks >= 10, ticks
+        assert len(response["data"]) == 1 and response["data"][0]["b64_json"]
+        client_class.return_value.aio.aclose.assert_awaited()
+        key_manager.release_paid_key.assert_called_once()
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 事件循環未被阻塞")
+
+
+def test_busy_response_has_retry_after():
+    """接口在繁忙時返回 503 與 Retry-After 頭"""
+    print("測試 503 響應...")
+    app = create_app()
+    client = TestClient(app)
+    busy = ServiceUnavailableError("Image generation is busy", retry_after=12.3)
+    with patch(
+        "app.router.openai_routes.image_create_service.generate_images",
+        AsyncMock(side_effect=busy),
+    ):
+        response = client.post(
+            "/v1/images/generations",
+            json={"prompt": "a cat"},
+            headers={"Authorization": f"Bearer {settings.ALLOWED_TOKENS[0]}"},
+        )
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "13"
+    assert response.json()["error"]["code"] == "service_unavailable"
+    print("  ✅ 測試通過: 返回 503 與 Retry-After")
+
+
+def main():
+    test_concurrency_caps()
+    test_rejects_when_saturated()
+    test_generation_does_not_block_event_loop()
+    test_busy_response_has_retry_after()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from app.exception.exceptions import UpstreamError
+from app.service.key.key_manager import KeyManager
+from app.service.key.key_recovery import KeyRecovery
+
+
+class FakeChatService:
+    """模擬探測：good 可用，limited 被限流，其餘密鑰無效"""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.probed = []
+
+    async def verify_key(self, api_key):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        self.probed.append(api_key)
+        try:
+            await asyncio.sleep(0.01)
+            if api_key.startswith("good"):
+                return {"candidates": []}
+            if api_key == "limited":
+                raise UpstreamError(429, "quota", retry_after=30)
+            raise UpstreamError(400, "bad key", reason="API_KEY_INVALID")
+        finally:
+            self.active -= 1
+
+
+def _disable(manager, key):
+    for _ in range(manager.MAX_FAILURES):
+        manager.scheduler.record_failure(key, cooldown=0)
+
+
+def test_decay_restores_partial_failures():
+    """未禁用密鑰的失敗次數隨時間衰減"""
+    print("測試失敗次數衰減...")
+    manager = KeyManager(["k1", "k2"])
+    manager.scheduler.record_failure("k1", cooldown=0)
+    _disable(manager, "k2")
+    assert manager.decay_failure_counts() == 1
+    assert manager.get_fail_count("k1") == 0
+    # 已禁用的密鑰需要探測成功才能恢復
+    assert manager.get_fail_count("k2") == manager.MAX_FAILURES
+    print("  ✅ 測試通過: 失敗次數按輪衰減")
+
+
+def test_probe_restores_disabled_keys_with_bounded_concurrency():
+    """探測被禁用的密鑰，成功的恢復，並發數受限"""
+    print("測試恢復探測...")
+    keys = [f"good{i}" for i in range(6)] + ["limited", "bad"]
+
+    async def run():
+        manager = KeyManager(keys)
+        for key in keys:
+            _disable(manager, key)
+        recovery = KeyRecovery(manager, interval=60, concurrency=2)
+        fake = FakeChatService()
+        recovery.chat_service = fake
+
+        # 探測不應選取（並消耗）其他可用密鑰
+        async def unexpected(*args, **kwargs):
+            raise AssertionError("recovery probe picked a working key")
+
+        manager.get_next_working_key = unexpected
+        result = await recovery.run_once()
+        return manager, fake, result
+
+    manager, fake, result = asyncio.run(run())
+    assert result == {"decayed": 0, "probed": 8, "restored": 7}, result
+    assert fake.max_active <= 2, fake.max_active
+    assert manager.get_disabled_keys() == ["bad"]
+    # 被限流的密鑰已恢復，但在冷卻期內不會被選中
+    assert manager.get_fail_count("limited") == 0
+    assert not manager.scheduler.is_available("limited")
+    print("  ✅ 測試通過: 探測恢復可用密鑰")
+
+
+def main():
+    test_decay_restores_partial_failures()
+    test_probe_restores_disabled_keys_with_bounded_concurrency()
+
+
+if __name__ == "__main__":
+    main()
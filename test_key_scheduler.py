@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from app.service.key.key_scheduler import KeyScheduler
+
+
+def test_healthy_keys_round_robin():
+    """健康狀況相同的密鑰按順序輪詢"""
+    print("測試健康密鑰輪詢...")
+    scheduler = KeyScheduler(["k1", "k2", "k3"], max_failures=3)
+    picks = [scheduler.acquire() for _ in range(6)]
+    assert picks == ["k1", "k2", "k3", "k1", "k2", "k3"], picks
+    print("  ✅ 測試通過: 輪詢順序正確")
+
+
+def test_failed_key_cools_down_and_returns():
+    """失敗的密鑰進入冷卻期被跳過，冷卻結束後自動恢復"""
+    print("測試失敗冷卻...")
+    scheduler = KeyScheduler(["k1", "k2"], max_failures=3, cooldown_base=0.05)
+    scheduler.record_failure("k1")
+    assert not scheduler.is_available("k1")
+    assert [scheduler.acquire() for _ in range(3)] == ["k2", "k2", "k2"]
+    time.sleep(0.06)
+    assert scheduler.is_available("k1")
+    assert "k1" in {scheduler.acquire() for _ in range(3)}
+    print("  ✅ 測試通過: 冷卻期內跳過，冷卻後恢復")
+
+
+def test_disabled_keys_and_fallback():
+    """達到最大失敗次數的密鑰被禁用；全部不可用時仍返回一個密鑰"""
+    print("測試禁用與兜底...")
+    scheduler = KeyScheduler(["k1", "k2"], max_failures=2, cooldown_base=0)
+    scheduler.record_failure("k1")
+    scheduler.record_failure("k1")
+    assert {scheduler.acquire() for _ in range(4)} == {"k2"}
+    scheduler.record_failure("k2", cooldown=30)
+    # k2 仍在冷卻中但未被禁用，優先於已禁用的 k1
+    assert scheduler.acquire() == "k2"
+    scheduler.record_failure("k2")
+    assert scheduler.acquire() in {"k1", "k2"}
+    scheduler.reset()
+    assert scheduler.is_available("k1") and scheduler.is_available("k2")
+    print("  ✅ 測試通過: 禁用與兜底邏輯正確")
+
+
+def test_in_flight_and_latency_affect_choice():
+    """在途請求多或延遲高的密鑰優先級降低"""
+    print("測試在途數與延遲打分...")
+    scheduler = KeyScheduler(["fast", "slow"], max_failures=3)
+    scheduler.record_success("fast", 0.2)
+    scheduler.record_success("slow", 5.0)
+    assert [scheduler.acquire() for _ in range(3)] == ["fast", "fast", "fast"]
+
+    scheduler = KeyScheduler(["k1", "k2"], max_failures=3)
+    with scheduler.track("k1") as usage:
+        usage.mark()
+        assert scheduler.stats["k1"].in_flight == 1
+        assert scheduler.acquire() == "k2"
+    assert scheduler.stats["k1"].in_flight == 0
+    assert scheduler.stats["k1"].latency is not None
+    try:
+        with scheduler.track("k2"):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    # 異常只釋放在途數，不記錄成功
+    assert scheduler.stats["k2"].in_flight == 0 and scheduler.stats["k2"].latency is None
+    print("  ✅ 測試通過: 在途數與延遲影響選擇")
+
+
+def test_heap_stays_bounded():
+    """惰性刪除的堆在大量狀態更新後仍保持與密鑰數同階"""
+    print("測試堆大小...")
+    keys = [f"k{i}" for i in range(100)]
+    scheduler = KeyScheduler(keys, max_failures=3)
+    for _ in range(10000):
+        key = scheduler.acquire()
+        scheduler.record_start(key)
+        scheduler.record_release(key)
+    assert len(scheduler._ready) + len(scheduler._cooling) <= 4 * len(keys) + 64
+    print("  ✅ 測試通過: 堆大小受控")
+
+
+def main():
+    test_healthy_keys_round_robin()
+    test_failed_key_cools_down_and_returns()
+    test_disabled_keys_and_fallback()
+    test_in_flight_and_latency_affect_choice()
+    test_heap_stays_bounded()
+
+
+if __name__ == "__main__":
+    main()
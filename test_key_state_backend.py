@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+import tempfile
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from app.service.key.key_manager import KeyManager
+from app.service.key.state_backend import (
+    MemoryStateBackend,
+    RedisStateBackend,
+    SQLiteStateBackend,
+)
+from app.service.key.state_sync import ROTATION_BATCH, KeyStateSync
+
+
+class FakeRedisServer:
+    """只實現 AUTH / SELECT / HINCRBY / HSET / HGETALL 的本地 RESP 服務"""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.data = {}
+        self.server = None
+        # 回復前的延遲（秒），用於模擬命令執行中被取消
+        self.delay = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2].decode())
+        return args
+
+    @staticmethod
+    def _bulk(value):
+        data = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def _handle(self, reader, writer):
+        authed = self.password is None
+        while True:
+            command = await self._read_command(reader)
+            if command is None:
+                break
+            name, args = command[0].upper(), command[1:]
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if name == "AUTH":
+                authed = args[-1] == self.password
+                writer.write(b"+OK\r\n" if authed else b"-ERR invalid password\r\n")
+            elif not authed:
+                writer.write(b"-NOAUTH Authentication required.\r\n")
+            elif name == "SELECT":
+                writer.write(b"+OK\r\n")
+            elif name == "HINCRBY":
+                table = self.data.setdefault(args[0], {})
+                table[args[1]] = int(table.get(args[1], 0)) + int(args[2])
+                writer.write(b":%d\r\n" % table[args[1]])
+            elif name == "HSET":
+                table = self.data.setdefault(args[0], {})
+                for i in range(1, len(args), 2):
+                    table[args[i]] = args[i + 1]
+                writer.write(b":%d\r\n" % ((len(args) - 1) // 2))
+            elif name == "HGETALL":
+                table = self.data.get(args[0], {})
+                writer.write(b"*%d\r\n" % (len(table) * 2))
+                for field, value in table.items():
+                    writer.write(self._bulk(field) + self._bulk(value))
+            else:
+                writer.write(b"-ERR unknown command\r\n")
+            await writer.drain()
+        writer.close()
+
+
+async def _exercise_backend(first, second):
+    """兩個實例並發自增同一字段，結果不丟失"""
+    await asyncio.gather(*[first.incr_fields("failures", {"k1": 1}) for _ in range(20)],
+                         *[second.incr_fields("failures", {"k1": 1, "k2": 2}) for _ in range(20)])
+    assert await second.get_fields("failures") == {"k1": 40, "k2": 40}
+    await first.set_fields("cooldowns", {"k1": 12.5, "k2": 0})
+    assert await second.get_fields("cooldowns") == {"k1": 12.5, "k2": 0}
+    positions = await asyncio.gather(*[first.incr("rotation", "paid_key") for _ in range(5)],
+                                     *[second.incr("rotation", "paid_key") for _ in range(5)])
+    assert sorted(positions) == list(range(1, 11)), positions
+
+
+def test_memory_backend():
+    """進程內後端的基本操作"""
+    print("測試 memory 後端...")
+    backend = MemoryStateBackend()
+    asyncio.run(_exercise_backend(backend, backend))
+    assert not backend.shared
+    print("  ✅ 測試通過: memory 後端")
+
+
+def test_sqlite_backend_shared_between_instances():
+    """兩個 SQLite 後端實例共享同一個數據庫文件"""
+    print("測試 sqlite 後端...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state", "key_state.db")
+
+        async def run():
+            first, second = SQLiteStateBackend(path), SQLiteStateBackend(path)
+            try:
+                await _exercise_backend(first, second)
+            finally:
+                await first.close()
+                await second.close()
+
+        asyncio.run(run())
+    print("  ✅ 測試通過: sqlite 後端跨實例原子自增")
+
+
+def test_redis_backend_against_local_server():
+    """Redis 後端通過 RESP 協議與本地服務通信，支持認證與斷線重連"""
+    print("測試 redis 後端...")
+
+    async def run():
+        server = FakeRedisServer(password="secret")
+        port = await server.start()
+        url = f"redis://:secret@127.0.0.1:{port}/1"
+        first, second = RedisStateBackend(url), RedisStateBackend(url)
+        try:
+            await _exercise_backend(first, second)
+            assert "gemini_balance:failures" in server.data
+            # 斷開連接後下一次調用自動重連
+            first._writer.close()
+            await first._writer.wait_closed()
+            assert (await first.get_fields("failures"))["k1"] == 40
+            # 命令已寫出但回復未讀取時被取消，之後的命令不會讀到錯位的回復
+            server.delay = 0.2
+            pending = asyncio.ensure_future(first.get_fields("failures"))
+            await asyncio.sleep(0.05)
+            pending.cancel()
+            try:
+                await pending
+            except asyncio.CancelledError:
+                pass
+            server.delay = 0
+            assert await first.incr("rotation", "other") == 1
+        finally:
+            await first.close()
+            await second.close()
+            await server.stop()
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: redis 後端")
+
+
+def test_key_state_shared_between_managers():
+    """兩個進程（KeyManager）通過共享後端同步失敗次數、冷卻期與付費密鑰輪詢"""
+    print("測試多實例狀態同步...")
+    keys = ["k1", "k2", "k3"]
+    paid_keys = ["p1", "p2", "p3"]
+
+    async def run():
+        backend = MemoryStateBackend()
+        managers = []
+        for _ in range(2):
+            manager = KeyManager(keys)
+            manager.paid_key = paid_keys
+            manager.paid_key_usage_counts = {key: 0 for key in paid_keys}
+            manager.paid_key_lock = asyncio.Lock()
+            manager.state_sync = KeyStateSync(backend, manager.scheduler, interval=60)
+            managers.append(manager)
+        first, second = managers
+
+        # 失敗在兩個實例上分別發生，同步後計數累加
+        first.scheduler.record_failure("k1", cooldown=0)
+        second.scheduler.record_failure("k1", cooldown=0)
+        second.scheduler.record_failure("k2", cooldown=30)
+        await first.state_sync.sync()
+        await second.state_sync.sync()
+        await first.state_sync.sync()
+        assert first.get_fail_count("k1") == 2 and second.get_fail_count("k1") == 2
+        # 冷卻期跨實例生效
+        assert not first.scheduler.is_available("k2")
+
+        # 被禁用的密鑰在另一個實例上也顯示為無效，恢復後同樣同步
+        first.scheduler.disable("k3")
+        await first.state_sync.flush()
+        status = await second.get_keys_by_status()
+        assert status["invalid_keys"] == {"k3": first.MAX_FAILURES}, status
+        second.restore_key("k3")
+        await second.state_sync.flush()
+        assert "k3" in (await first.get_keys_by_status())["valid_keys"]
+
+        # 付費密鑰在兩個實例間均勻輪詢，每個實例按批預留輪詢位置
+        picks = [await managers[i % 2].get_paid_key() for i in range(6)]
+        assert sorted(picks) == sorted(paid_keys * 2), picks
+        assert (await backend.get_fields("rotation"))["paid_key"] == 2 * ROTATION_BATCH
+        for key in picks:
+            await managers[0].increment_paid_key_usage(key)
+        await managers[1].increment_paid_key_usage("p1")
+        await first.state_sync.flush()
+        assert await second.get_paid_keys_usage() == {"p1": 3, "p2": 2, "p3": 2}
+
+        # 共享後端不可用時退回本地輪詢
+        async def unavailable(*args, **kwargs):
+            raise ConnectionError("backend down")
+
+        backend.incr = unavailable
+        first.state_sync._rotations.clear()
+        picks = [await first.get_paid_key() for _ in range(3)]
+        assert sorted(picks) == paid_keys, picks
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 多實例共享密鑰狀態")
+
+
+def main():
+    test_memory_backend()
+    test_sqlite_backend_shared_between_instances()
+    test_redis_backend_against_local_server()
+    test_key_state_shared_between_managers()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import queue
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from fastapi.testclient import TestClient
+
+from app.config.config import settings
+from app.core.application import create_app
+from app.log.logger import (
+    JsonFormatter,
+    Logger,
+    NonBlockingQueueHandler,
+    RequestIdFilter,
+    log_payload,
+    request_id_var,
+)
+
+
+class ListHandler(logging.Handler):
+    """收集日志記錄"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _capture_logger(name, level=logging.DEBUG):
+    logger = logging.getLogger(name)
+    logger.handlers = []
+    logger.propagate = False
+    logger.setLevel(level)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    return logger, handler
+
+
+def test_queue_handler_does_not_block():
+    """隊列滿時丟棄日誌並計數，消息參數在調用方合併"""
+    print("測試非阻塞隊列...")
+    handler = NonBlockingQueueHandler(queue.Queue(2))
+    handler.addFilter(RequestIdFilter())
+    logger, _ = _capture_logger("test_queue")
+    logger.addHandler(handler)
+    token = request_id_var.set("req-1")
+    try:
+        for i in range(5):
+            logger.info("message %s", i)
+    finally:
+        request_id_var.reset(token)
+    assert handler.dropped == 3
+    record = handler.queue.get_nowait()
+    assert record.msg == "message 0" and record.args is None
+    assert record.request_id == "req-1"
+    print("  ✅ 測試通過: 隊列滿時不阻塞")
+
+
+def test_json_formatter():
+    """JSON 格式包含級別、logger、請求ID與異常信息"""
+    print("測試 JSON 格式...")
+    logger, handler = _capture_logger("test_json")
+    logger.addFilter(RequestIdFilter())
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("failed for %s", "model-x")
+    entry = json.loads(JsonFormatter().format(handler.records[0]))
+    assert entry["level"] == "ERROR" and entry["logger"] == "test_json"
+    assert entry["message"] == "failed for model-x"
+    assert entry["request_id"] == "-"
+    assert "ValueError: boom" in entry["exception"]
+    print("  ✅ 測試通過: JSON 字段完整")
+
+
+def test_payload_logging():
+    """請求體只在 DEBUG 級別記錄，base64 只保留長度，超長內容被截斷，可按採樣率跳過"""
+    print("測試請求體日誌...")
+    logger, handler = _capture_logger("test_payload", level=logging.INFO)
+    log_payload(logger, "Request", {"data": "A" * 1000})
+    assert handler.records == []
+
+    logger.setLevel(logging.DEBUG)
+    log_payload(logger, "Request", {"data": "A" * 1000, "text": "hi"})
+    message = handler.records[-1].getMessage()
+    assert "<1000 chars>" in message and '"text": "hi"' in message
+    assert handler.records[-1].funcName == "test_payload_logging"
+
+    original = settings.LOG_PAYLOAD_MAX_CHARS, settings.LOG_PAYLOAD_SAMPLE_RATE
+    try:
+        settings.LOG_PAYLOAD_MAX_CHARS = 10
+        log_payload(logger, "Request", "x" * 50)
+        assert handler.records[-1].getMessage() == "Request: " + "x" * 10 + "...<truncated 40 chars>"
+        settings.LOG_PAYLOAD_SAMPLE_RATE = 0.0
+        count = len(handler.records)
+        log_payload(logger, "Request", "skipped")
+        assert len(handler.records) == count
+    finally:
+        settings.LOG_PAYLOAD_MAX_CHARS, settings.LOG_PAYLOAD_SAMPLE_RATE = original
+    print("  ✅ 測試通過: 請求體按配置記錄")
+
+
+def test_per_logger_level():
+    """LOG_LEVELS 按 logger 名覆蓋 LOG_LEVEL"""
+    print("測試分 logger 日誌級別...")
+    original = settings.LOG_LEVELS
+    try:
+        settings.LOG_LEVELS = {"test_level_debug": "debug"}
+        assert Logger.setup_logger("test_level_debug").level == logging.DEBUG
+        assert Logger.setup_logger("test_level_default").level == logging.getLevelName(settings.LOG_LEVEL.upper())
+        assert isinstance(Logger.setup_logger("test_level_debug").handlers[0], NonBlockingQueueHandler)
+    finally:
+        settings.LOG_LEVELS = original
+    print("  ✅ 測試通過: 級別覆蓋生效")
+
+
+def test_request_id_header():
+    """沿用合法的 X-Request-ID，不合法或缺失時生成新ID"""
+    print("測試請求ID中間件...")
+    client = TestClient(create_app())
+    response = client.get("/health", headers={"X-Request-ID": "abc-123"})
+    assert response.headers["X-Request-ID"] == "abc-123"
+    generated = client.get("/health", headers={"X-Request-ID": "bad id\r\n"}).headers["X-Request-ID"]
+    assert generated != "bad id" and len(generated) == 32
+    assert len(client.get("/health").headers["X-Request-ID"]) == 32
+    print("  ✅ 測試通過: 響應頭帶有請求ID")
+
+
+def main():
+    test_queue_handler_does_not_block()
+    test_json_formatter()
+    test_payload_logging()
+    test_per_logger_level()
+    test_request_id_header()
+
+
+if __name__ == "__main__":
+    main()
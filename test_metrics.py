@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from fastapi.testclient import TestClient
+
+from app.config.config import settings
+from app.core.application import create_app
+from app.core.metrics import (
+    STAGE_DURATION,
+    UPSTREAM_LATENCY,
+    UPSTREAM_REQUESTS,
+    MetricsRegistry,
+    key_hash,
+    set_known_models,
+    stage_timer,
+)
+from app.exception.exceptions import UpstreamError
+from app.service.key.key_manager import KeyManager
+
+
+def test_render_prometheus_text():
+    """計數器、直方圖與儀表按 Prometheus 文本格式輸出"""
+    print("測試指標渲染...")
+    registry = MetricsRegistry()
+    counter = registry.counter("demo_total", "Demo counter", ("status",))
+    histogram = registry.histogram("demo_seconds", "Demo histogram", ("stage",), buckets=(0.1, 1.0))
+    registry.register_collector(lambda: [("demo_gauge", "Demo gauge", [({"state": 'a"b'}, 2)])])
+    counter.inc("200")
+    counter.inc("200", amount=2)
+    histogram.observe(0.05, "convert")
+    histogram.observe(0.5, "convert")
+    histogram.observe(5.0, "convert")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE demo_total counter" in lines
+    assert 'demo_total{status="200"} 3.0' in lines
+    assert 'demo_seconds_bucket{stage="convert",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="convert",le="1.0"} 2' in lines
+    assert 'demo_seconds_bucket{stage="convert",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{stage="convert"} 3' in lines
+    assert 'demo_gauge{state="a\\"b"} 2' in lines
+    print("  ✅ 測試通過: 文本格式正確")
+
+
+def test_stage_and_upstream_recording():
+    """階段計時與密鑰調用結果按模型和密鑰哈希記錄"""
+    print("測試階段與上游指標...")
+    set_known_models(["metrics-model"])
+    before = STAGE_DURATION.count("convert", "metrics-model")
+    with stage_timer("convert", "models/metrics-model"):
+        pass
+    assert STAGE_DURATION.count("convert", "metrics-model") == before + 1
+    # 模型目錄以外的模型名統一記為 other，不會產生新的時間序列
+    other = STAGE_DURATION.count("convert", "other")
+    for i in range(10):
+        with stage_timer("convert", f"made-up-{i}"):
+            pass
+    assert STAGE_DURATION.count("convert", "other") == other + 10
+    assert STAGE_DURATION.count("convert", "made-up-0") == 0
+
+    async def run():
+        manager = KeyManager(["metrics-key"])
+        key = await manager.get_next_working_key("metrics-model")
+        with manager.track(key, "metrics-model") as usage:
+            usage.mark()
+        await manager.handle_api_failure(key, error=UpstreamError(503, "unavailable"), model="metrics-model")
+
+    asyncio.run(run())
+    hashed = key_hash("metrics-key")
+    assert hashed != "metrics-key" and len(hashed) == 8
+    assert UPSTREAM_REQUESTS.get("metrics-model", hashed, "success") == 1
+    assert UPSTREAM_REQUESTS.get("metrics-model", hashed, "503") == 1
+    assert UPSTREAM_LATENCY.count("metrics-model", hashed) == 1
+    assert STAGE_DURATION.count("key_acquire", "metrics-model") >= 1
+    print("  ✅ 測試通過: 成功與失敗分別記錄")
+
+
+def test_metrics_endpoint():
+    """/metrics 需要 AUTH_TOKEN，並包含請求、階段與密鑰池指標"""
+    print("測試 /metrics 接口...")
+    with TestClient(create_app()) as client:
+        assert client.get("/health").status_code == 200
+        assert client.get("/metrics").status_code == 401
+        response = client.get("/metrics", headers={"Authorization": f"Bearer {settings.AUTH_TOKEN}"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'gemini_balance_http_requests_total{method="GET",route="/health",status="200"}' in body
+    assert 'gemini_balance_stage_duration_seconds_count{stage="auth",model=""}' in body
+    assert 'gemini_balance_keys{state="valid"}' in body
+    assert f'gemini_balance_key_in_flight{{key="{key_hash(settings.API_KEYS[0])}"}} 0' in body
+    assert "gemini_balance_image_generation_queue_depth" in body
+    assert settings.API_KEYS[0] not in body
+    print("  ✅ 測試通過: 指標接口可用")
+
+
+def main():
+    test_render_prometheus_text()
+    test_stage_and_upstream_recording()
+    test_metrics_endpoint()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.config.config import settings
+from app.middleware import request_logging_middleware
+from app.middleware.middleware import AuthMiddleware, is_public_path
+from app.middleware.request_logging_middleware import RequestLoggingMiddleware
+
+
+def _app():
+    app = FastAPI()
+
+    @app.get("/keys")
+    async def keys():
+        return {"ok": True}
+
+    @app.get("/v1/models")
+    async def models():
+        return {"ok": True}
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    return app
+
+
+def test_public_paths():
+    """公開路徑判斷與原有的前綴規則一致"""
+    print("測試公開路徑...")
+    for path in ["/", "/auth", "/metrics", "/static/a.css", "/gemini/v1beta/models", "/v1/chat/completions",
+                 "/v1beta/models", "/health", "/hf/v1/models"]:
+        assert is_public_path(path), path
+    for path in ["/keys", "/auth/x", "/metricsx", "/api"]:
+        assert not is_public_path(path), path
+    print("  ✅ 測試通過: 路徑判斷正確")
+
+
+def test_auth_middleware():
+    """未登錄訪問管理頁面時重定向，公開路徑與已登錄請求直接放行"""
+    print("測試認證中間件...")
+    app = _app()
+    app.add_middleware(AuthMiddleware)
+    client = TestClient(app)
+    response = client.get("/keys", follow_redirects=False)
+    assert response.status_code == 307 and response.headers["location"] == "/"
+    client.cookies.set("auth_token", "wrong")
+    assert client.get("/keys", follow_redirects=False).status_code == 307
+    client.cookies.set("auth_token", settings.AUTH_TOKEN)
+    assert client.get("/keys").json() == {"ok": True}
+    client.cookies.clear()
+    assert client.get("/v1/models").json() == {"ok": True}
+    print("  ✅ 測試通過: 認證行為不變")
+
+
+def test_request_logging_tees_body():
+    """請求體分塊流經中間件時只截取上限以內的部分記錄，下游仍收到完整請求體"""
+    print("測試請求日誌中間件...")
+    logged = []
+    original_info = request_logging_middleware.logger.info
+    original_limit = settings.LOG_PAYLOAD_MAX_CHARS
+    request_logging_middleware.logger.info = lambda msg, *args: logged.append(msg % args)
+    settings.LOG_PAYLOAD_MAX_CHARS = 8
+    try:
+        app = RequestLoggingMiddleware(_app())
+        chunks = [b"0123456789", b"abcdefghij", b"KLMNO"]
+        sent = []
+
+        async def receive():
+            body = chunks.pop(0)
+            return {"type": "http.request", "body": body, "more_body": bool(chunks)}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http", "method": "POST", "path": "/echo", "raw_path": b"/echo", "root_path": "",
+            "query_string": b"", "headers": [], "http_version": "1.1", "scheme": "http",
+            "server": ("test", 80), "client": ("test", 1),
+        }
+        asyncio.run(app(scope, receive, send))
+    finally:
+        request_logging_middleware.logger.info = original_info
+        settings.LOG_PAYLOAD_MAX_CHARS = original_limit
+    assert sent[-1]["body"] == b'{"size":25}'
+    assert logged == ["Request path: /echo", "Request body (25 bytes): 01234567...<truncated 17 bytes>"], logged
+    print("  ✅ 測試通過: 請求體未被整體緩衝")
+
+
+def main():
+    test_public_paths()
+    test_auth_middleware()
+    test_request_logging_tees_body()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.config.config import settings
+from app.exception.exceptions import ServiceUnavailableError
+from app.service.client import http_client
+from app.service.key.key_manager import KeyManager
+from app.service.model.model_catalog import ModelCatalog, etag_response
+from app.service.model.model_service import ModelService
+
+
+class FakeUpstream:
+    """返回模型列表，可設置延遲與失敗，並記錄請求次數"""
+
+    def __init__(self, names, delay=0.0):
+        self.names = names
+        self.delay = delay
+        self.status = 200
+        self.key_status = {}
+        self.calls = 0
+
+    async def handler(self, request: httpx.Request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        status = self.key_status.get(request.url.params["key"], self.status)
+        if status != 200:
+            return httpx.Response(status, json={"error": {"code": status}})
+        models = [{"name": f"models/{name}", "displayName": name.upper()} for name in self.names]
+        return httpx.Response(200, json={"models": models})
+
+
+def _service():
+    return ModelService(["gemini-2.0-flash-exp"], ["gemini-2.0-flash-exp"])
+
+
+def test_catalog_variants_and_lookup():
+    """目錄預先生成兩種格式（含變體），並發的首次請求只拉取一次"""
+    print("測試模型目錄...")
+    upstream = FakeUpstream(["gemini-1.5-flash", "gemini-2.0-flash-exp"], delay=0.02)
+
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            catalog = ModelCatalog(_service(), ttl=60)
+            manager = KeyManager(["k1"])
+            snapshots = await asyncio.gather(*[catalog.get(manager) for _ in range(5)])
+            return catalog, snapshots
+        finally:
+            await http_client.close_http_client()
+
+    catalog, snapshots = asyncio.run(run())
+    assert upstream.calls == 1 and all(snapshot is snapshots[0] for snapshot in snapshots)
+    gemini = json.loads(snapshots[0].gemini_body)
+    assert [model["name"] for model in gemini["models"]] == [
+        "models/gemini-1.5-flash",
+        "models/gemini-2.0-flash-exp",
+        "models/gemini-2.0-flash-exp-search",
+        "models/gemini-2.0-flash-exp-image",
+    ]
+    assert gemini["models"][2]["displayName"] == "GEMINI-2.0-FLASH-EXP For Search"
+    openai_ids = [model["id"] for model in json.loads(snapshots[0].openai_body)["data"]]
+    assert f"{settings.CREATE_IMAGE_MODEL}-chat" in openai_ids and "gemini-2.0-flash-exp-image" in openai_ids
+    assert catalog.check_model_support("gemini-2.0-flash-exp-search")
+    assert catalog.check_model_support("gemini-1.5-flash")
+    assert not catalog.check_model_support("gemini-1.5-flash-search")
+    assert not catalog.check_model_support("gemini-pro-vision")
+    print("  ✅ 測試通過: 目錄與變體正確")
+
+
+def test_stale_while_revalidate():
+    """過期後立即返回舊目錄並在後台刷新；刷新失敗時繼續使用舊目錄"""
+    print("測試後台刷新...")
+    upstream = FakeUpstream(["gemini-1.5-flash"])
+
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            catalog = ModelCatalog(_service(), ttl=60)
+            manager = KeyManager(["k1"])
+            first = await catalog.get(manager)
+
+            upstream.names = ["gemini-1.5-flash", "gemini-1.5-pro"]
+            upstream.delay = 0.05
+            catalog.invalidate()
+            assert await catalog.get(manager) is first
+            await catalog._refreshing
+            second = await catalog.get(manager)
+            assert second is not first and second.openai_etag != first.openai_etag
+            assert "gemini-1.5-pro" in second.model_ids
+
+            upstream.status = 500
+            catalog.invalidate()
+            await catalog.get(manager)
+            await asyncio.gather(catalog._refreshing, return_exceptions=True)
+            assert await catalog.get(manager) is second
+            assert upstream.calls == 3, upstream.calls
+
+            # 首次拉取失敗時返回 503
+            empty = ModelCatalog(_service(), ttl=60)
+            try:
+                await empty.get(manager)
+            except ServiceUnavailableError:
+                pass
+            else:
+                raise AssertionError("expected ServiceUnavailableError")
+        finally:
+            await http_client.close_http_client()
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 過期時返回舊目錄")
+
+
+def test_key_failure_isolation():
+    """並發的首次請求共享一次拉取；某個密鑰被限流時只冷卻該密鑰並換密鑰重試，等待者不會一起失敗"""
+    print("測試密鑰錯誤隔離...")
+    upstream = FakeUpstream(["gemini-1.5-flash"], delay=0.02)
+    upstream.key_status = {"k1": 429}
+
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            catalog = ModelCatalog(_service(), ttl=60)
+            manager = KeyManager(["k1", "k2"])
+            snapshots = await asyncio.gather(*[catalog.get(manager) for _ in range(10)])
+            return manager, snapshots
+        finally:
+            await http_client.close_http_client()
+
+    manager, snapshots = asyncio.run(run())
+    assert upstream.calls == 2, upstream.calls
+    assert all(snapshot is snapshots[0] for snapshot in snapshots)
+    assert "gemini-1.5-flash" in snapshots[0].model_ids
+    stats = manager.get_key_stats()
+    assert stats["k1"]["cooldown_remaining"] > 0 and stats["k2"]["cooldown_remaining"] == 0
+    print("  ✅ 測試通過: 只有失敗的密鑰被冷卻")
+
+
+def test_etag_response():
+    """客戶端 ETag 匹配時返回 304"""
+    print("測試 ETag...")
+    response = etag_response(b"{}", '"abc"', None)
+    assert response.status_code == 200 and response.headers["etag"] == '"abc"'
+    assert etag_response(b"{}", '"abc"', 'W/"abc"').status_code == 304
+    assert etag_response(b"{}", '"abc"', '"x", "abc"').status_code == 304
+    assert etag_response(b"{}", '"abc"', '"other"').status_code == 200
+    print("  ✅ 測試通過: ETag 協商正確")
+
+
+def main():
+    test_catalog_variants_and_lookup()
+    test_stale_while_revalidate()
+    test_key_failure_isolation()
+    test_etag_response()
+
+
+if __name__ == "__main__":
+    main()
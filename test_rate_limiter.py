@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+import time
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.exception.exceptions import UpstreamError
+from app.service.client.api_client import build_upstream_error
+from app.service.key.key_manager import KeyManager
+from app.service.key.key_scheduler import KeyScheduler
+from app.service.key.rate_limiter import RateLimiter
+from app.utils.json_codec import dumps_bytes
+
+
+def _quota_error(retry_delay="30s", model="gemini-2.0-flash-exp"):
+    body = {
+        "error": {
+            "code": 429,
+            "status": "RESOURCE_EXHAUSTED",
+            "details": [
+                {
+                    "@type": "type.googleapis.com/google.rpc.QuotaFailure",
+                    "violations": [
+                        {
+                            "quotaId": "GenerateRequestsPerMinutePerProjectPerModel-FreeTier",
+                            "quotaDimensions": {"model": model, "location": "global"},
+                        }
+                    ],
+                },
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": retry_delay},
+            ],
+        }
+    }
+    return build_upstream_error(429, httpx.Headers(), dumps_bytes(body))
+
+
+def test_upstream_error_classification():
+    """上游錯誤按狀態碼與錯誤詳情分類"""
+    print("測試上游錯誤分類...")
+    error = _quota_error()
+    assert error.is_rate_limited and not error.is_client_error
+    assert error.retry_after == 30.0
+    assert error.quota_model == "gemini-2.0-flash-exp"
+    assert "status code 429" in str(error)
+
+    error = build_upstream_error(429, httpx.Headers({"Retry-After": "7"}), b"rate limited")
+    assert error.retry_after == 7.0 and error.quota_model is None
+
+    body = {"error": {"code": 400, "details": [{"@type": "type.googleapis.com/google.rpc.ErrorInfo", "reason": "API_KEY_INVALID"}]}}
+    error = build_upstream_error(400, httpx.Headers(), dumps_bytes(body))
+    assert error.is_key_error and not error.is_client_error
+
+    error = build_upstream_error(400, httpx.Headers(), b'{"error": {"code": 400}}')
+    assert error.is_client_error
+    assert not build_upstream_error(503, httpx.Headers(), b"").is_client_error
+    print("  ✅ 測試通過: 錯誤分類正確")
+
+
+def test_rpm_bucket_routes_around_exhausted_keys():
+    """密鑰級 RPM 令牌桶耗盡後密鑰被跳過"""
+    print("測試 RPM 令牌桶...")
+    scheduler = KeyScheduler(["k1", "k2"], max_failures=3, limiter=RateLimiter(rpm=2))
+    picks = [scheduler.acquire() for _ in range(4)]
+    assert sorted(picks) == ["k1", "k1", "k2", "k2"], picks
+    # 全部耗盡時仍返回最早恢復的密鑰，耗盡的密鑰轉入冷卻
+    assert scheduler.acquire() in {"k1", "k2"}
+    assert not scheduler.is_available("k1") and not scheduler.is_available("k2")
+    print("  ✅ 測試通過: 耗盡配額的密鑰被跳過")
+
+
+def test_model_cooldown_only_affects_that_model():
+    """按模型冷卻的密鑰仍可用於其它模型"""
+    print("測試按模型冷卻...")
+    limiter = RateLimiter(model_limits={"gemini-pro": {"rpm": 1}})
+    scheduler = KeyScheduler(["k1", "k2"], max_failures=3, limiter=limiter)
+    scheduler.cooldown_model("k1", "gemini-flash", 30)
+    assert [scheduler.acquire("gemini-flash") for _ in range(3)] == ["k2", "k2", "k2"]
+    assert {scheduler.acquire("other") for _ in range(2)} == {"k1", "k2"}
+    # 每個密鑰在 gemini-pro 上每分鐘只允許一次請求
+    assert sorted([scheduler.acquire("gemini-pro"), scheduler.acquire("gemini-pro")]) == ["k1", "k2"]
+    assert limiter.model_wait("k1", "gemini-pro", time.monotonic()) > 0
+    print("  ✅ 測試通過: 模型級冷卻與配額互不影響")
+
+
+def test_key_manager_handles_error_classes():
+    """429 只冷卻不計失敗、無效密鑰直接禁用、請求錯誤不影響密鑰"""
+    print("測試密鑰管理器錯誤處理...")
+
+    async def run():
+        manager = KeyManager(["k1", "k2", "k3"])
+        next_key = await manager.handle_api_failure("k1", error=_quota_error(), model="gemini-2.0-flash-exp-search")
+        assert next_key != "k1"
+        assert manager.get_fail_count("k1") == 0
+        assert manager.scheduler.is_available("k1")
+        assert "k1" not in {await manager.get_next_working_key("gemini-2.0-flash-exp") for _ in range(4)}
+
+        invalid = UpstreamError(400, "bad key", reason="API_KEY_INVALID")
+        await manager.handle_api_failure("k2", error=invalid)
+        assert "k2" in (await manager.get_keys_by_status())["invalid_keys"]
+
+        bad_request = UpstreamError(400, "bad request")
+        assert await manager.handle_api_failure("k3", error=bad_request) == "k3"
+        assert manager.get_fail_count("k3") == 0
+
+    asyncio.run(run())
+    print("  ✅ 測試通過: 錯誤處理符合預期")
+
+
+def main():
+    test_upstream_error_classification()
+    test_rpm_bucket_routes_around_exhausted_keys()
+    test_model_cooldown_only_affects_that_model()
+    test_key_manager_handles_error_classes()
+
+
+if __name__ == "__main__":
+    main()
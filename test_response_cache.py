@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import sys
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.domain.gemini_models import GeminiRequest
+from app.domain.openai_models import ChatRequest
+from app.service.chat import response_cache
+from app.service.chat.gemini_chat_service import GeminiChatService
+from app.service.chat.openai_chat_service import OpenAIChatService
+from app.service.chat.response_cache import ResponseCache, cache_key, parse_cache_control
+from app.service.client import http_client
+from app.service.key.key_manager import KeyManager
+
+
+class FakeUpstream:
+    """稍作延遲後返回固定的非流式響應，並記錄請求次數"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = 0
+
+    async def handler(self, request: httpx.Request):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        if self.status != 200:
+            return httpx.Response(self.status, json={"error": {"code": self.status, "message": "upstream error"}})
+        return httpx.Response(200, json={
+            "candidates": [{"content": {"parts": [{"text": "label: spam"}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        })
+
+
+class SlowStream(httpx.AsyncByteStream):
+    """逐個輸出 SSE 事件，事件之間稍作延遲；記錄是否被提前關閉"""
+
+    def __init__(self, texts, owner):
+        self.texts = texts
+        self.owner = owner
+
+    async def __aiter__(self):
+        for text in self.texts:
+            event = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+            yield f"data: {json.dumps(event)}\n\n".encode()
+            await asyncio.sleep(0.03)
+        self.owner.completed += 1
+
+    async def aclose(self):
+        self.owner.closed += 1
+
+
+class StreamUpstream:
+    """流式上游，記錄請求次數、完整輸出次數與關閉次數"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.calls = 0
+        self.completed = 0
+        self.closed = 0
+
+    async def handler(self, request: httpx.Request):
+        self.calls += 1
+        return httpx.Response(200, stream=SlowStream(self.texts, self), headers={"content-type": "text/event-stream"})
+
+
+def _with_cache(upstream, run, cache):
+    original = response_cache._response_cache
+    response_cache._response_cache = cache
+
+    async def wrapper():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            return await run()
+        finally:
+            await http_client.close_http_client()
+
+    try:
+        return asyncio.run(wrapper())
+    finally:
+        response_cache._response_cache = original
+
+
+def _gemini_request(temperature):
+    return GeminiRequest(
+        contents=[{"role": "user", "parts": [{"text": "classify: win a prize"}]}],
+        generationConfig={"temperature": temperature},
+    )
+
+
+def test_cache_key_and_directives():
+    """緩存鍵忽略 null 字段、字段順序與易變字段；Cache-Control 指令解析"""
+    print("測試緩存鍵...")
+    base = {"contents": [{"parts": [{"text": "hi"}]}], "generationConfig": {"temperature": 0, "topK": None}}
+    reordered = {"generationConfig": {"temperature": 0}, "contents": [{"parts": [{"text": "hi"}]}], "cachedContent": "x"}
+    assert cache_key("gemini-1.5-flash", base) == cache_key("models/gemini-1.5-flash", reordered)
+    assert cache_key("gemini-1.5-flash", base) != cache_key("gemini-1.5-pro", base)
+    assert parse_cache_control("no-cache, max-age=60") == (False, True, 60.0)
+    assert parse_cache_control("No-Store") == (True, False, None)
+    assert parse_cache_control(None) == (False, False, None)
+    print("  ✅ 測試通過: 緩存鍵規範化")
+
+
+def test_gemini_cache_and_singleflight():
+    """並發的相同確定性請求只請求上游一次，之後命中緩存；非確定性請求與 no-store 不使用緩存"""
+    print("測試 Gemini 響應緩存...")
+    upstream = FakeUpstream()
+    cache = ResponseCache(max_bytes=1024 * 1024, ttl=60)
+
+    async def run():
+        service = GeminiChatService("https://upstream.test/v1beta", KeyManager(["k1", "k2"]))
+        results = await asyncio.gather(*[
+            service.generate_content("gemini-1.5-flash", _gemini_request(0), "k1") for _ in range(5)
+        ])
+        assert upstream.calls == 1, upstream.calls
+        cached = await service.generate_content("gemini-1.5-flash", _gemini_request(0), "k2")
+        assert upstream.calls == 1
+        await service.generate_content("gemini-1.5-flash", _gemini_request(0), "k1", cache_control="no-cache")
+        assert upstream.calls == 2
+        await service.generate_content("gemini-1.5-flash", _gemini_request(0), "k1", cache_control="no-store")
+        await service.generate_content("gemini-1.5-flash", _gemini_request(0.7), "k1")
+        assert upstream.calls == 4
+        return results, cached
+
+    results, cached = _with_cache(upstream, run, cache)
+    assert all(result == results[0] for result in results) and cached == results[0]
+    assert results[0]["candidates"][0]["content"]["parts"][0]["text"] == "label: spam"
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["coalesced"] == 4 and stats["bypassed"] == 2 and stats["entries"] == 1
+    print("  ✅ 測試通過: 相同請求只調用一次上游")
+
+
+def test_openai_cache_and_expiry():
+    """OpenAI 非流式請求命中緩存時仍生成新的響應 ID；條目過期後重新請求上游"""
+    print("測試 OpenAI 響應緩存...")
+    upstream = FakeUpstream()
+    cache = ResponseCache(max_bytes=1024 * 1024, ttl=0.2)
+
+    async def run():
+        service = OpenAIChatService("https://upstream.test/v1beta", KeyManager(["k1"]))
+
+        def request():
+            return ChatRequest(model="gemini-1.5-flash", messages=[{"role": "user", "content": "hi"}], temperature=0)
+
+        first = await service.create_chat_completion(request(), "k1")
+        second = await service.create_chat_completion(request(), "k1")
+        assert upstream.calls == 1
+        await asyncio.sleep(0.25)
+        await service.create_chat_completion(request(), "k1")
+        assert upstream.calls == 2
+        return first, second
+
+    first, second = _with_cache(upstream, run, cache)
+    assert first["choices"] == second["choices"]
+    assert first["choices"][0]["message"]["content"] == "label: spam"
+    print("  ✅ 測試通過: 命中與過期行為正確")
+
+
+def test_errors_are_not_cached():
+    """上游失敗時不寫入緩存，合併的請求各自重試而不共享同一個錯誤"""
+    print("測試上游錯誤...")
+    upstream = FakeUpstream(status=500)
+    cache = ResponseCache(max_bytes=1024 * 1024, ttl=60)
+
+    async def run():
+        service = GeminiChatService("https://upstream.test/v1beta", KeyManager(["k1", "k2"]))
+        return await asyncio.gather(*[
+            service.generate_content("gemini-1.5-flash", _gemini_request(0), "k1") for _ in range(3)
+        ], return_exceptions=True)
+
+    results = _with_cache(upstream, run, cache)
+    assert all(isinstance(result, Exception) for result in results)
+    assert upstream.calls == 3 and len(cache.entries) == 0
+    print("  ✅ 測試通過: 錯誤未被緩存")
+
+
+def _stream_texts(lines):
+    texts = []
+    for line in lines:
+        if line.startswith("data: ") and line.strip() != "data: [DONE]":
+            for choice in json.loads(line[6:]).get("choices", []):
+                texts.append(choice["delta"].get("content") or "")
+    return "".join(texts)
+
+
+def test_stream_replay_and_attach():
+    """相同的流式請求加入進行中的上游流，完成後的流直接回放，只請求上游一次"""
+    print("測試流式回放...")
+    upstream = StreamUpstream(["Hello", ", ", "world"])
+    cache = ResponseCache(max_bytes=1024 * 1024, ttl=60)
+
+    async def run():
+        service = OpenAIChatService("https://upstream.test/v1beta", KeyManager(["k1", "k2"]))
+
+        async def collect(delay):
+            await asyncio.sleep(delay)
+            request = ChatRequest(
+                model="gemini-1.5-flash", messages=[{"role": "user", "content": "hi"}], temperature=0, stream=True
+            )
+            stream = await service.create_chat_completion(request, "k1", "passthrough")
+            return [line async for line in stream]
+
+        # 第二個請求在第一個數據塊之後到達，先回放已有數據塊再跟隨後續數據塊
+        live = await asyncio.gather(collect(0), collect(0.04))
+        replayed = await collect(0)
+        return live, replayed
+
+    (first, attached), replayed = _with_cache(upstream, run, cache)
+    assert upstream.calls == 1 and upstream.completed == 1, (upstream.calls, upstream.completed)
+    for lines in (first, attached, replayed):
+        assert _stream_texts(lines) == "Hello, world", lines
+        assert lines[-1] == "data: [DONE]\n\n"
+    # 每個客戶端得到各自的響應 ID
+    assert json.loads(first[0][6:])["id"] != json.loads(replayed[0][6:])["id"]
+    stats = cache.stats()
+    assert stats["attached"] == 1 and stats["hits"] == 1 and stats["entries"] == 1
+    print("  ✅ 測試通過: 一次上游流服務三個客戶端")
+
+
+def test_stream_abandoned():
+    """所有客戶端斷開後取消上游流，未完成的流不寫入緩存"""
+    print("測試流式請求中途斷開...")
+    upstream = StreamUpstream(["a", "b", "c", "d"])
+    cache = ResponseCache(max_bytes=1024 * 1024, ttl=60)
+
+    async def run():
+        service = GeminiChatService("https://upstream.test/v1beta", KeyManager(["k1"]))
+        stream = service.stream_generate_content(
+            "gemini-1.5-flash", _gemini_request(0), "k1", "passthrough"
+        )
+        first = await stream.__anext__()
+        await stream.aclose()
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+        return first
+
+    first = _with_cache(upstream, run, cache)
+    assert json.loads(first[6:])["candidates"][0]["content"]["parts"][0]["text"] == "a"
+    assert upstream.completed == 0 and upstream.closed == 1
+    assert len(cache.entries) == 0 and not cache.streams
+    print("  ✅ 測試通過: 上游流已取消")
+
+
+def main():
+    test_cache_key_and_directives()
+    test_gemini_cache_and_singleflight()
+    test_openai_cache_and_expiry()
+    test_errors_are_not_cached()
+    test_stream_replay_and_attach()
+    test_stream_abandoned()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import sys
+import time
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from app.handler.stream_optimizer import StreamOptimizer
+
+
+async def _upstream(items, interval):
+    for item in items:
+        await asyncio.sleep(interval)
+        yield item
+
+
+async def _collect(stream):
+    return [item async for item in stream]
+
+
+def test_passthrough_forwards_whole_chunk():
+    """passthrough 模式下每個上游塊只輸出一次，且不引入延遲"""
+    print("測試 passthrough 模式...")
+    optimizer = StreamOptimizer(mode="passthrough")
+
+    async def run():
+        start = time.perf_counter()
+        out = await _collect(optimizer.optimize_stream_output("hello world", lambda t: t, lambda c: c))
+        return out, time.perf_counter() - start
+
+    out, elapsed = asyncio.run(run())
+    assert out == ["hello world"], out
+    assert elapsed < 0.01, elapsed
+    print("  ✅ 測試通過: 上游塊被整塊轉發")
+
+
+def test_request_mode_overrides_default():
+    """請求指定的模式優先於部署默認模式，無效值回退到默認模式"""
+    print("測試請求級模式覆蓋...")
+    optimizer = StreamOptimizer(mode="passthrough", max_delay=0, min_delay=0)
+    out = asyncio.run(_collect(optimizer.optimize_stream_output("abc", lambda t: t, lambda c: c, "drip")))
+    assert out == ["a", "b", "c"], out
+    assert optimizer.resolve_mode("DRIP") == "drip"
+    assert optimizer.resolve_mode("bogus") == "passthrough"
+    assert optimizer.resolve_mode(None) == "passthrough"
+    print("  ✅ 測試通過: 請求級模式生效")
+
+
+def test_coalesce_merges_and_never_delays_completion():
+    """coalesce 模式合併窗口內的事件，並在上游結束時立即刷新"""
+    print("測試 coalesce 模式...")
+    optimizer = StreamOptimizer(mode="coalesce", coalesce_window=0.05)
+    items = [f"data: {i}\n\n" for i in range(20)]
+
+    async def run():
+        start = time.perf_counter()
+        out = await _collect(optimizer.coalesce_stream(_upstream(items, 0.005)))
+        return out, time.perf_counter() - start
+
+    out, elapsed = asyncio.run(run())
+    assert "".join(out) == "".join(items)
+    assert len(out) < len(items), len(out)
+    # 上游本身約 0.1s，合併不應把完成時間推遲一個窗口以上
+    assert elapsed < 0.1 + 0.04, elapsed
+    print(f"  ✅ 測試通過: {len(items)} 個事件合併為 {len(out)} 次寫出，耗時 {elapsed:.3f}s")
+
+
+def test_coalesce_flushes_sparse_events_immediately():
+    """間隔大於窗口的事件不會被緩衝"""
+    print("測試 coalesce 模式下稀疏事件...")
+    optimizer = StreamOptimizer(mode="coalesce", coalesce_window=0.01)
+    items = ["a", "b", "c"]
+    out = asyncio.run(_collect(optimizer.coalesce_stream(_upstream(items, 0.03))))
+    assert out == items, out
+    print("  ✅ 測試通過: 稀疏事件逐個立即輸出")
+
+
+def main():
+    test_passthrough_forwards_whole_chunk()
+    test_request_mode_overrides_default()
+    test_coalesce_merges_and_never_delays_completion()
+    test_coalesce_flushes_sparse_events_immediately()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.config.config import settings
+from app.domain.gemini_models import GeminiRequest
+from app.domain.openai_models import ChatRequest
+from app.handler import response_handler
+from app.service.chat.gemini_chat_service import GeminiChatService
+from app.service.chat.openai_chat_service import OpenAIChatService
+from app.service.client import http_client
+from app.service.key.key_manager import KeyManager
+from app.utils.uploader import UploadError
+
+
+def _chunk(part):
+    return {"candidates": [{"content": {"parts": [part], "role": "model"}, "index": 0}]}
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """先輸出若干 SSE 事件，然後模擬連接中斷"""
+
+    def __init__(self, events, fail):
+        self.events = events
+        self.fail = fail
+
+    async def __aiter__(self):
+        for event in self.events:
+            yield f"data: {json.dumps(event)}\n\n".encode()
+        if self.fail:
+            raise httpx.ReadError("connection reset")
+
+
+class FakeUpstream:
+    """按順序返回預設的流式響應，並記錄每次請求的密鑰與請求體"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def handler(self, request: httpx.Request):
+        self.requests.append((request.url.params["key"], json.loads(request.content)))
+        status, events, fail = self.responses.pop(0)
+        if status != 200:
+            return httpx.Response(status, json={"error": {"code": status, "message": "upstream error"}})
+        return httpx.Response(200, stream=BrokenStream(events, fail), headers={"content-type": "text/event-stream"})
+
+
+def _run_gemini(responses, policy="resume"):
+    upstream = FakeUpstream(responses)
+    original_policy = settings.STREAM_RETRY_POLICY
+    settings.STREAM_RETRY_POLICY = policy
+
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            service = GeminiChatService("https://upstream.test/v1beta", KeyManager(["k1", "k2", "k3"]))
+            request = GeminiRequest(contents=[{"role": "user", "parts": [{"text": "hi"}]}])
+            return [
+                json.loads(line[6:])
+                async for line in service.stream_generate_content("gemini-1.5-flash", request, "k1", "passthrough")
+            ]
+        finally:
+            await http_client.close_http_client()
+
+    try:
+        return asyncio.run(run()), upstream
+    finally:
+        settings.STREAM_RETRY_POLICY = original_policy
+
+
+def _texts(events):
+    return "".join(
+        part.get("text", "")
+        for event in events
+        for candidate in event.get("candidates", [])
+        for part in candidate["content"]["parts"]
+    )
+
+
+def test_failover_before_first_byte():
+    """首個數據塊前失敗，換密鑰透明重試"""
+    print("測試首字節前換密鑰...")
+    events, upstream = _run_gemini([
+        (503, [], False),
+        (200, [], True),
+        (200, [_chunk({"text": "Hello"}), _chunk({"text": " world"})], False),
+    ])
+    assert _texts(events) == "Hello world"
+    assert not any("error" in event for event in events)
+    keys = [key for key, _ in upstream.requests]
+    assert keys[0] == "k1" and keys[1] != "k1" and keys[2] != keys[1], keys
+    print("  ✅ 測試通過: 客戶端無感知地切換密鑰")
+
+
+def test_resume_mid_stream_without_duplicates():
+    """中途失敗時以已發送文本為前綴續寫，客戶端不會收到重複內容"""
+    print("測試中途續寫...")
+    events, upstream = _run_gemini([
+        (200, [_chunk({"text": "Hello"}), _chunk({"text": " wor"})], True),
+        (200, [_chunk({"text": "ld!"})], False),
+    ])
+    assert _texts(events) == "Hello world!"
+    resumed = upstream.requests[1][1]["contents"]
+    assert resumed[-1] == {"role": "model", "parts": [{"text": "Hello wor"}]}, resumed
+    assert upstream.requests[1][0] != "k1"
+    print("  ✅ 測試通過: 從斷點續寫")
+
+
+def test_error_policy_ends_stream_with_error_event():
+    """error 策略下中途失敗發送錯誤事件後結束"""
+    print("測試 error 策略...")
+    events, upstream = _run_gemini([
+        (200, [_chunk({"text": "Hello"})], True),
+    ], policy="error")
+    assert _texts(events) == "Hello"
+    assert events[-1]["error"]["code"] == 503 and events[-1]["error"]["status"] == "UNAVAILABLE"
+    assert len(upstream.requests) == 1
+    print("  ✅ 測試通過: 發送錯誤事件且不重複生成")
+
+
+def test_non_text_output_and_client_errors_are_not_retried():
+    """已發送函數調用時無法續寫；請求錯誤不換密鑰重試"""
+    print("測試不可續寫的情況...")
+    call = {"functionCall": {"name": "lookup", "args": {}}}
+    events, upstream = _run_gemini([(200, [_chunk(call)], True)])
+    assert "error" in events[-1] and len(upstream.requests) == 1
+
+    events, upstream = _run_gemini([(400, [], False)])
+    assert len(events) == 1 and events[0]["error"]["status"] == "INVALID_ARGUMENT", events
+    assert len(upstream.requests) == 1
+    print("  ✅ 測試通過: 不可續寫時正常結束")
+
+
+def test_image_upload_failure_fails_over():
+    """圖片上傳失敗時該數據塊尚未發送，換密鑰透明重試而不是結束流"""
+    print("測試圖片上傳失敗...")
+    image = {"inlineData": {"mimeType": "image/png", "data": "aW1n"}}
+    calls = []
+
+    async def flaky_upload(files):
+        calls.append(len(files))
+        if len(calls) == 1:
+            raise UploadError("upload failed")
+        return [SimpleNamespace(success=True, data=SimpleNamespace(url="https://img.test/1.png")) for _ in files]
+
+    original = response_handler.upload_images
+    response_handler.upload_images = flaky_upload
+    try:
+        events, upstream = _run_gemini([
+            (200, [_chunk(image)], False),
+            (200, [_chunk(image)], False),
+        ])
+    finally:
+        response_handler.upload_images = original
+    assert len(events) == 1 and "error" not in events[0], events
+    assert "https://img.test/1.png" in json.dumps(events[0])
+    assert len(upstream.requests) == 2 and upstream.requests[1][0] != "k1"
+    print("  ✅ 測試通過: 上傳失敗後換密鑰重試")
+
+
+def test_openai_stream_resume():
+    """OpenAI 兼容接口同樣從斷點續寫"""
+    print("測試 OpenAI 流續寫...")
+    upstream = FakeUpstream([
+        (200, [_chunk({"text": "Hello"})], True),
+        (200, [_chunk({"text": " world"})], False),
+    ])
+
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handler))
+        try:
+            service = OpenAIChatService("https://upstream.test/v1beta", KeyManager(["k1", "k2"]))
+            request = ChatRequest(model="gemini-1.5-flash", stream=True, messages=[{"role": "user", "content": "hi"}])
+            stream = await service.create_chat_completion(request, "k1", "passthrough")
+            return [line async for line in stream]
+        finally:
+            await http_client.close_http_client()
+
+    lines = asyncio.run(run())
+    assert lines[-1] == "data: [DONE]\n\n"
+    chunks = [json.loads(line[6:]) for line in lines[:-1]]
+    content = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+    assert content == "Hello world", content
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    print("  ✅ 測試通過: OpenAI 流續寫")
+
+
+def main():
+    test_failover_before_first_byte()
+    test_resume_mid_stream_without_duplicates()
+    test_error_policy_ends_stream_with_error_event()
+    test_non_text_output_and_client_errors_are_not_retried()
+    test_image_upload_failure_fails_over()
+    test_openai_stream_resume()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController
+from app.core.security import SecurityService
+from app.core.token_store import TokenStore
+from app.exception.exceptions import AuthorizationError
+from app.middleware.admission_middleware import AdmissionMiddleware
+
+
+def _write(path, entries):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(entries, file)
+    # 確保 mtime 變化能被檢測到
+    stamp = time.time() + len(entries)
+    os.utime(path, (stamp, stamp))
+
+
+def test_lookup_and_admin():
+    """按摘要查找令牌，管理員令牌單獨識別"""
+    print("測試令牌查找...")
+    tokens = [f"sk-{i}" for i in range(5000)]
+    store = TokenStore(tokens, "sk-admin")
+    assert store.lookup("sk-4999") is not None
+    assert store.lookup("sk-5000") is None and store.lookup("") is None and store.lookup(None) is None
+    assert store.lookup("sk-admin").is_admin
+    assert store.is_admin("sk-admin") and not store.is_admin("sk-1") and not store.is_admin(None)
+    print("  ✅ 測試通過: 查找正確")
+
+
+def test_file_reload_and_metadata():
+    """令牌文件變化後自動重新載入，支持摘要形式與元數據，格式錯誤時保留原有令牌"""
+    print("測試令牌文件熱載入...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tokens.json")
+        digest = hashlib.sha256(b"sk-hashed").hexdigest()
+        _write(path, [
+            "sk-plain",
+            {"token": "sk-team", "name": "team", "rpm": 2, "models": ["gemini-1.5-flash"]},
+            {"sha256": digest, "name": "hashed"},
+        ])
+        store = TokenStore(["sk-static"], "sk-admin", path=path, reload_interval=0)
+        assert len(store) == 4
+        assert store.lookup("sk-hashed").name == "hashed"
+        team = store.lookup("sk-team")
+        assert team.allows_model("models/gemini-1.5-flash") and not team.allows_model("gemini-1.5-pro")
+        assert team.acquire() == 0 and team.acquire() == 0 and team.acquire() > 0
+
+        _write(path, [{"token": "sk-team", "name": "team", "rpm": 2}, "sk-new"])
+        assert store.lookup("sk-new") is not None and store.lookup("sk-plain") is None
+        assert store.lookup("sk-static") is not None
+        # 限額未變，沿用原有令牌桶
+        assert store.lookup("sk-team").acquire() > 0
+
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("{broken")
+        assert store.lookup("sk-new") is not None
+    print("  ✅ 測試通過: 熱載入生效")
+
+
+def test_security_service_model_access():
+    """無效令牌返回 401，無權使用的模型返回 403"""
+    print("測試令牌模型權限...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tokens.json")
+        _write(path, [{"token": "sk-team", "rpm": 1, "models": ["gemini-1.5-flash"]}])
+        service = SecurityService([], "sk-admin", token_store=TokenStore([], "sk-admin", path=path))
+
+        async def run():
+            assert await service.verify_authorization("Bearer sk-team") == "sk-team"
+            try:
+                await service.verify_authorization("Bearer sk-unknown")
+            except HTTPException as e:
+                assert e.status_code == 401
+            else:
+                raise AssertionError("expected HTTPException")
+            assert await service.verify_auth_token("Bearer sk-admin") == "sk-admin"
+
+        asyncio.run(run())
+        service.check_model_access("sk-team", "gemini-1.5-flash")
+        service.check_model_access("sk-admin", "gemini-1.5-pro")
+        try:
+            service.check_model_access("sk-team", "gemini-1.5-pro")
+        except AuthorizationError as e:
+            assert e.status_code == 403
+        else:
+            raise AssertionError("expected AuthorizationError")
+    print("  ✅ 測試通過: 模型權限生效")
+
+
+def test_empty_store_is_shared():
+    """令牌文件起初為空時，路由認證與準入中間件仍使用同一個共享存儲，之後加入的令牌同時生效"""
+    print("測試空令牌文件...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tokens.json")
+        _write(path, [])
+        store = TokenStore([], "sk-admin", path=path, reload_interval=0)
+        assert len(store) == 0
+        service = SecurityService([], "sk-admin", token_store=store)
+        assert service.token_store is store
+
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def chat(token: str = Depends(service.verify_authorization)):
+            return {"ok": True}
+
+        controller = AdmissionController(max_concurrency=4, max_queue=4, queue_timeout=1)
+        app.add_middleware(AdmissionMiddleware, controller=controller, token_store=store)
+        client = TestClient(app)
+        headers = {"Authorization": "Bearer sk-late"}
+        assert client.post("/v1/chat/completions", headers=headers).status_code == 401
+
+        _write(path, [{"token": "sk-late", "rpm": 1}])
+        assert client.post("/v1/chat/completions", headers=headers).status_code == 200
+        # 中間件看到同一個令牌及其限額
+        assert client.post("/v1/chat/completions", headers=headers).status_code == 429
+    print("  ✅ 測試通過: 空存儲未被替換")
+
+
+def main():
+    test_lookup_and_admin()
+    test_file_reload_and_metadata()
+    test_security_service_model_access()
+    test_empty_store_is_shared()
+
+
+if __name__ == "__main__":
+    main()
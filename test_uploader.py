@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import asyncio
+import base64
+import os
+import sys
+import time
+
+# 添加專案根目錄到Python路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("API_KEYS", '["test-key"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["test-token"]')
+
+import httpx
+
+from app.config.config import settings
+from app.handler.response_handler import OpenAIResponseHandler, upload_inline_images
+from app.service.client import http_client
+from app.utils.uploader import CloudFlareImgBedUploader, PicGoUploader, UploadError, upload_images
+
+
+class FakeImageHost:
+    """模擬圖床：每次上傳耗時固定，記錄最大並發數"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.count = 0
+
+    async def handler(self, request: httpx.Request):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        self.count += 1
+        index = self.count
+        if request.url.path == "/upload":
+            return httpx.Response(200, json=[{"src": f"/file/{index}.png"}])
+        if request.headers.get("X-API-Key") != "picgo-key":
+            return httpx.Response(401, json={"status_code": 401})
+        return httpx.Response(200, json={
+            "status_code": 200,
+            "image": {"width": 1, "height": 1, "filename": "a.png", "size": 3, "url": f"https://picgo.test/{index}.png"},
+        })
+
+
+def _run(host, coro_factory):
+    async def run():
+        http_client._shared_client = httpx.AsyncClient(transport=httpx.MockTransport(host.handler))
+        try:
+            return await coro_factory()
+        finally:
+            await http_client.close_http_client()
+
+    return asyncio.run(run())
+
+
+def test_upload_images_concurrently():
+    """多張圖片並發上傳，耗時約等於一次上傳，結果保持輸入順序"""
+    print("測試並發上傳...")
+    host = FakeImageHost(delay=0.05)
+    uploader = CloudFlareImgBedUploader("", "https://imgbed.test/upload")
+    files = [(b"png%d" % i, f"{i}.png") for i in range(4)]
+
+    async def run():
+        start = time.monotonic()
+        responses = await upload_images(files, uploader=uploader, concurrency=4)
+        return responses, time.monotonic() - start
+
+    responses, elapsed = _run(host, run)
+    assert host.max_active == 4, host.max_active
+    assert elapsed < 0.15, elapsed
+    assert sorted(r.data.url for r in responses) == [f"https://imgbed.test/file/{i}.png" for i in range(1, 5)]
+
+    host = FakeImageHost(delay=0.01)
+    _run(host, lambda: upload_images(files, uploader=uploader, concurrency=2))
+    assert host.max_active == 2
+    print("  ✅ 測試通過: 並發上傳且並發數受限")
+
+
+def test_picgo_uploader_errors():
+    """上傳失敗時拋出 UploadError"""
+    print("測試上傳錯誤處理...")
+    host = FakeImageHost(delay=0)
+    response = _run(host, lambda: PicGoUploader("picgo-key", "https://picgo.test/api").upload(b"x", "a.png"))
+    assert response.success and response.data.url == "https://picgo.test/1.png"
+    try:
+        _run(host, lambda: PicGoUploader("wrong", "https://picgo.test/api").upload(b"x", "a.png"))
+    except UploadError as e:
+        assert e.error_type.value == "network_error", e
+    else:
+        raise AssertionError("expected UploadError")
+    print("  ✅ 測試通過: 錯誤被包裝為 UploadError")
+
+
+def test_response_images_uploaded_before_parsing():
+    """響應中的多張圖片先並發上傳，同步解析時直接使用圖床地址"""
+    print("測試響應圖片上傳...")
+    host = FakeImageHost(delay=0.05)
+    image = {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(b"png").decode()}}
+    response = {"candidates": [{"content": {"parts": [{"text": "here"}, dict(image), {"inlineData": dict(image["inlineData"])}], "role": "model"}}]}
+    original = (settings.UPLOAD_PROVIDER, settings.CLOUDFLARE_IMGBED_URL)
+    settings.UPLOAD_PROVIDER, settings.CLOUDFLARE_IMGBED_URL = "cloudflare_imgbed", "https://imgbed.test/upload"
+    try:
+        _run(host, lambda: upload_inline_images(response))
+    finally:
+        settings.UPLOAD_PROVIDER, settings.CLOUDFLARE_IMGBED_URL = original
+    assert host.max_active == 2
+    result = OpenAIResponseHandler(config=None).handle_response(response, "gemini-2.0-flash-exp", stream=False)
+    text = result["choices"][0]["message"]["content"]
+    assert text.startswith("here") and text.count("![image](https://imgbed.test/file/") == 2, text
+    print("  ✅ 測試通過: 響應圖片並發上傳")
+
+
+def main():
+    test_upload_images_concurrently()
+    test_picgo_uploader_errors()
+    test_response_images_uploaded_before_parsing()
+
+
+if __name__ == "__main__":
+    main()